@@ -0,0 +1,274 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+"""
+End-to-end benchmark suite (data pipeline, generators and metrics) on synthetic Argoverse-like scenes.
+
+Usage:
+    python -m benchmark.run_benchmark --output bench_HEAD.json
+    python -m benchmark.run_benchmark --output bench_new.json --compare bench_HEAD.json
+
+The JSON report contains, for every benchmark, the mean/median/min/std time in ms, so reports of
+different commits can be compared with --compare.
+"""
+
+import argparse
+import importlib
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+import torch
+
+from benchmark.synthetic_argoverse import write_split
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--output', default='benchmark_report.json', type=str)
+parser.add_argument('--compare', default=None, type=str, help="Previous JSON report to compare with")
+parser.add_argument('--data_dir', default=None, type=str, help="Where the synthetic split is written (tmp by default)")
+parser.add_argument('--num_scenes', default=200, type=int)
+parser.add_argument('--batch_size', default=16, type=int)
+parser.add_argument('--repeats', default=20, type=int)
+parser.add_argument('--seed', default=0, type=int)
+parser.add_argument('--device', default="cuda" if torch.cuda.is_available() else "cpu", type=str)
+parser.add_argument('--generators', default="so,soconf,so_goals,soconf_goals,soconf_goals_cgh,trans_so", type=str)
+
+OBS_LEN = 20
+PRED_LEN = 30
+NUM_GOAL_POINTS = 32
+
+# Generator name -> (module, takes goal points as input)
+
+GENERATORS = {
+    "so": ("sophie.models.mp_so", False),
+    "soconf": ("sophie.models.mp_soconf", False),
+    "so_goals": ("sophie.models.mp_so_goals", True),
+    "soconf_goals": ("sophie.models.mp_soconf_goals", True),
+    "soconf_goals_cgh": ("sophie.models.mp_soconf_goals_cgh", True),
+    "trans_so": ("sophie.models.mp_trans_so", False),
+}
+
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize()
+
+def time_function(fn, repeats=20, warmup=2, device="cpu"):
+    """
+    Output:
+        dict with mean/median/min/std time (ms) over repeats calls
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        synchronize(device)
+        t0 = time.perf_counter()
+        fn()
+        synchronize(device)
+        times.append((time.perf_counter() - t0) * 1000.0)
+    times = np.array(times)
+    return {
+        "mean_ms": float(times.mean()),
+        "median_ms": float(np.median(times)),
+        "min_ms": float(times.min()),
+        "std_ms": float(times.std()),
+        "repeats": repeats
+    }
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def bench_data_pipeline(root_folder, args, results):
+    """
+    read_file, process_window_sequence, dataset construction and seq_collate
+    """
+    import sophie.data_loader.argoverse.dataset_sgan_version_test_map as dataset_module
+
+    folder = os.path.join(root_folder, "train", "data")
+    files = sorted(os.listdir(folder))[:min(50, args.num_scenes)]
+    paths = [os.path.join(folder, f) for f in files]
+    seq_len = OBS_LEN + PRED_LEN
+
+    results["read_file"] = time_function(lambda: [dataset_module.read_file(p) for p in paths],
+                                         repeats=max(args.repeats // 4, 1), warmup=1)
+    results["read_file"]["per_file_ms"] = results["read_file"]["mean_ms"] / len(paths)
+
+    scenes = []
+    for path in paths:
+        data = dataset_module.read_file(path)
+        frames = np.unique(data[:, 0]).tolist()
+        frame_data = [data[frame == data[:, 0], :] for frame in frames]
+        file_id = int(os.path.basename(path).split(".")[0])
+        scenes.append((frame_data, frames, file_id))
+
+    def process_all():
+        for frame_data, frames, file_id in scenes:
+            dataset_module.process_window_sequence(0, frame_data, frames, seq_len, PRED_LEN, 0.002,
+                                                   file_id, "val", OBS_LEN)
+    results["process_window_sequence"] = time_function(process_all, repeats=max(args.repeats // 4, 1), warmup=1)
+    results["process_window_sequence"]["per_file_ms"] = \
+        results["process_window_sequence"]["mean_ms"] / len(scenes)
+
+    def build_dataset(preprocess):
+        return dataset_module.ArgoverseMotionForecastingDataset(
+            dataset_name="argoverse_motion_forecasting_dataset", root_folder=root_folder,
+            obs_len=OBS_LEN, pred_len=PRED_LEN, split="train", split_percentage=1.0,
+            shuffle=False, batch_size=args.batch_size, class_balance=-1.0, obs_origin=OBS_LEN,
+            preprocess=preprocess)
+
+    results["dataset_preprocess"] = time_function(lambda: build_dataset(True), repeats=1, warmup=0)
+    results["dataset_preprocess"]["per_file_ms"] = results["dataset_preprocess"]["mean_ms"] / args.num_scenes
+    results["dataset_load"] = time_function(lambda: build_dataset(False), repeats=max(args.repeats // 4, 1), warmup=1)
+
+    dataset = build_dataset(False)
+    samples = [dataset[i % len(dataset)] for i in range(args.batch_size)]
+    results["getitem"] = time_function(lambda: [dataset[i % len(dataset)] for i in range(args.batch_size)],
+                                       repeats=args.repeats)
+    results["seq_collate"] = time_function(lambda: dataset_module.seq_collate(samples), repeats=args.repeats)
+    results["seq_collate"]["batch_size"] = args.batch_size
+
+    return dataset_module.seq_collate(samples)
+
+def build_inputs(batch, device):
+    batch = [tensor.to(device) for tensor in batch]
+    (obs_traj, pred_traj_gt, obs_traj_rel, pred_traj_gt_rel, non_linear_obj,
+     loss_mask, seq_start_end, frames, object_cls, obj_id, ego_origin, _, _) = batch
+    agent_idx = torch.where(object_cls==1)[0].cpu().numpy()
+    b = seq_start_end.shape[0]
+    goal_points = torch.randn(b, NUM_GOAL_POINTS, 2, device=device)
+    return obs_traj, obs_traj_rel, pred_traj_gt, pred_traj_gt_rel, seq_start_end, agent_idx, goal_points
+
+def output_loss(out):
+    tensors = out if isinstance(out, (tuple, list)) else [out]
+    return sum(o.float().pow(2).mean() for o in tensors if torch.is_tensor(o))
+
+def bench_generators(batch, args, results):
+    obs_traj, obs_traj_rel, _, _, seq_start_end, agent_idx, goal_points = build_inputs(batch, args.device)
+
+    for name in args.generators.split(","):
+        module_name, with_goals = GENERATORS[name]
+        try:
+            module = importlib.import_module(module_name)
+            generator = module.TrajectoryGenerator().to(args.device).train()
+
+            def forward():
+                if with_goals:
+                    return generator(obs_traj, obs_traj_rel, goal_points, seq_start_end, agent_idx)
+                return generator(obs_traj, obs_traj_rel, seq_start_end, agent_idx)
+
+            def forward_no_grad():
+                with torch.no_grad():
+                    return forward()
+
+            def forward_backward():
+                generator.zero_grad()
+                output_loss(forward()).backward()
+
+            results["generator_{}_forward".format(name)] = time_function(forward_no_grad, args.repeats,
+                                                                          device=args.device)
+            results["generator_{}_forward_backward".format(name)] = time_function(forward_backward, args.repeats,
+                                                                                   device=args.device)
+        except Exception as e:
+            results["generator_{}_forward".format(name)] = {"error": repr(e)}
+
+def bench_metrics(batch, args, results):
+    from sophie.modules.evaluation_metrics import displacement_error, final_displacement_error
+    from sophie.modules.losses import l2_loss_multimodal, mse_custom, pytorch_neg_multi_log_likelihood_batch
+
+    _, _, pred_traj_gt, pred_traj_gt_rel, seq_start_end, agent_idx, _ = build_inputs(batch, args.device)
+    gt = pred_traj_gt[:, agent_idx, :] # 30 x b x 2
+    b, m = gt.shape[1], 6
+    pred_mm = gt.permute(1, 0, 2).unsqueeze(1) + torch.randn(b, m, PRED_LEN, 2, device=args.device) # b x m x 30 x 2
+    conf = torch.softmax(torch.randn(b, m, device=args.device), dim=1)
+    avails = torch.ones(b, PRED_LEN, device=args.device)
+    pred = pred_mm[:, 0].permute(1, 0, 2) # 30 x b x 2
+
+    metrics = {
+        "displacement_error": lambda: displacement_error(pred, gt),
+        "final_displacement_error": lambda: final_displacement_error(pred[-1], gt[-1]),
+        "l2_loss_multimodal": lambda: l2_loss_multimodal(pred_mm, gt.permute(1, 0, 2), mode="sum"),
+        "mse_custom": lambda: mse_custom(gt, pred),
+        "nll_multimodal": lambda: pytorch_neg_multi_log_likelihood_batch(gt.permute(1, 0, 2), pred_mm, conf, avails),
+    }
+    try:
+        from sophie.trainers.trainer_gen_soconf_goals import cal_ade, cal_fde
+        metrics["cal_ade"] = lambda: cal_ade(gt, pred_mm, None, None, None)
+        metrics["cal_fde"] = lambda: cal_fde(gt, pred_mm, None, None, None)
+    except ImportError as e:
+        results["metric_cal_ade"] = {"error": repr(e)}
+
+    for name, fn in metrics.items():
+        results["metric_{}".format(name)] = time_function(fn, args.repeats, device=args.device)
+
+def compare_reports(old, new):
+    """
+    Print the ratio new/old of the mean time of every common benchmark
+    """
+    print("{:45s} {:>12s} {:>12s} {:>8s}".format("benchmark", "old (ms)", "new (ms)", "ratio"))
+    for name in sorted(new["results"].keys()):
+        if name not in old["results"]:
+            continue
+        old_ms = old["results"][name].get("mean_ms")
+        new_ms = new["results"][name].get("mean_ms")
+        if old_ms is None or new_ms is None:
+            continue
+        ratio = new_ms / old_ms if old_ms > 0 else math.inf
+        print("{:45s} {:12.3f} {:12.3f} {:8.2f}".format(name, old_ms, new_ms, ratio))
+
+def main(args):
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    data_dir = args.data_dir if args.data_dir is not None else tempfile.mkdtemp(prefix="argoverse_synthetic_")
+    root_folder = data_dir if data_dir.endswith("/") else data_dir + "/" # the dataset concatenates root_folder + split
+    t0 = time.perf_counter()
+    write_split(root_folder, "train", args.num_scenes, args.seed)
+    print("Synthetic split written to {} ({:.2f} s)".format(root_folder, time.perf_counter() - t0))
+
+    results = {}
+    batch = bench_data_pipeline(root_folder, args, results)
+    bench_generators(batch, args, results)
+    bench_metrics(batch, args, results)
+
+    report = {
+        "meta": {
+            "git_commit": get_git_commit(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": sys.version.split()[0],
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "device": args.device,
+            "num_threads": torch.get_num_threads(),
+            "num_scenes": args.num_scenes,
+            "batch_size": args.batch_size,
+            "repeats": args.repeats,
+            "seed": args.seed
+        },
+        "results": results
+    }
+    with open(args.output, "w") as report_file:
+        json.dump(report, report_file, indent=4)
+    print("Report written to {}".format(args.output))
+
+    for name, stats in sorted(results.items()):
+        if "error" in stats:
+            print("{:45s} ERROR {}".format(name, stats["error"]))
+        else:
+            print("{:45s} {:10.3f} ms".format(name, stats["mean_ms"]))
+
+    if args.compare is not None:
+        with open(args.compare) as old_file:
+            compare_reports(json.load(old_file), report)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+"""
+Deterministic synthetic scene generator that writes .csv files with the Argoverse 1.1
+motion-forecasting schema (TIMESTAMP,TRACK_ID,OBJECT_TYPE,X,Y,CITY_NAME), so the data pipeline and
+models can be benchmarked without the real dataset.
+
+Every scene has 50 frames (5 s at 10 Hz), one AV and one AGENT observed in every frame, and a number
+of OTHERS, some of them only partially observed (as in the real data, they are discarded by
+process_window_sequence).
+"""
+
+import argparse
+import os
+import numpy as np
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--output_dir', default='data/datasets/argoverse_synthetic/', type=str)
+parser.add_argument('--split', default='train', type=str)
+parser.add_argument('--num_scenes', default=100, type=int)
+parser.add_argument('--seed', default=0, type=int)
+
+SEQ_LEN = 50
+PERIOD = 0.1
+CITIES = ["PIT", "MIA"]
+CITY_CENTERS = {"PIT": (2500.0, 1200.0), "MIA": (600.0, 2000.0)}
+
+def simulate_track(rng, seq_len, start_pos, speed, yaw, yaw_rate):
+    """
+    Constant speed / constant yaw-rate motion model with small position noise
+    Output:
+        np.array (seq_len,2)
+    """
+    yaws = yaw + yaw_rate * PERIOD * np.arange(seq_len)
+    steps = speed * PERIOD * np.stack([np.cos(yaws), np.sin(yaws)], axis=1)
+    traj = start_pos + np.cumsum(steps, axis=0)
+    traj += rng.normal(0, 0.02, size=traj.shape)
+    return traj
+
+def generate_scene(rng, num_others_range=(3, 15), partial_prob=0.3):
+    """
+    Output:
+        list of rows (timestamp, track_id, object_type, x, y, city_name), sorted by timestamp
+    """
+    city = CITIES[rng.integers(len(CITIES))]
+    center = np.array(CITY_CENTERS[city]) + rng.uniform(-300, 300, size=2)
+    t0 = 315969629.0 + rng.uniform(0, 1e6)
+    timestamps = t0 + PERIOD * np.arange(SEQ_LEN)
+
+    tracks = []
+    num_others = int(rng.integers(num_others_range[0], num_others_range[1] + 1))
+    for object_type in ["AV", "AGENT"] + ["OTHERS"] * num_others:
+        start_pos = center + rng.uniform(-30, 30, size=2)
+        speed = rng.uniform(0, 15)
+        yaw = rng.uniform(-np.pi, np.pi)
+        yaw_rate = 0.0 if rng.random() < 0.6 else rng.uniform(-0.4, 0.4) # straight and curved trajectories
+        traj = simulate_track(rng, SEQ_LEN, start_pos, speed, yaw, yaw_rate)
+
+        first, last = 0, SEQ_LEN
+        if object_type == "OTHERS" and rng.random() < partial_prob:
+            first = int(rng.integers(0, SEQ_LEN // 2))
+            last = int(rng.integers(SEQ_LEN // 2, SEQ_LEN + 1))
+        track_id = "00000000-0000-0000-0000-{:012d}".format(len(tracks))
+        tracks.append((track_id, object_type, traj, first, last))
+
+    rows = []
+    for t in range(SEQ_LEN):
+        for track_id, object_type, traj, first, last in tracks:
+            if first <= t < last:
+                rows.append((timestamps[t], track_id, object_type, traj[t, 0], traj[t, 1], city))
+    return rows
+
+def write_split(output_dir, split="train", num_scenes=100, seed=0):
+    """
+    Write num_scenes .csv files to output_dir/split/data/ (same layout as the real dataset)
+    Output:
+        list of written paths
+    """
+    rng = np.random.default_rng(seed)
+    folder = os.path.join(output_dir, split, "data")
+    os.makedirs(folder, exist_ok=True)
+
+    paths = []
+    for file_id in range(1, num_scenes + 1):
+        rows = generate_scene(rng)
+        path = os.path.join(folder, "{}.csv".format(file_id))
+        with open(path, "w") as csv_file:
+            csv_file.write("TIMESTAMP,TRACK_ID,OBJECT_TYPE,X,Y,CITY_NAME\n")
+            for timestamp, track_id, object_type, x, y, city in rows:
+                csv_file.write("{:.7f},{},{},{:.5f},{:.5f},{}\n".format(timestamp, track_id, object_type, x, y, city))
+        paths.append(path)
+    return paths
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    paths = write_split(args.output_dir, args.split, args.num_scenes, args.seed)
+    print("Written {} scenes to {}".format(len(paths), os.path.dirname(paths[0])))
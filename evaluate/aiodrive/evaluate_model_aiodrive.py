@@ -14,6 +14,7 @@ from torch.utils.data import DataLoader
 from attrdict import AttrDict
 
 from sophie.data_loader.aiodrive.dataset import read_file, seq_collate_image_aiodrive, AioDriveDataset
+from sophie.data_loader.aiodrive.image_loader import configure_image_loader
 from sophie.models import SoPhieGenerator
 from sophie.modules.evaluation_metrics import displacement_error, final_displacement_error
 from sophie.utils.utils import relative_to_abs
@@ -26,6 +27,9 @@ parser.add_argument('--dset_type', default='test', type=str)
 parser.add_argument('--results_path', default='results/aiodrive', type=str)
 parser.add_argument('--results_file', default='test_json', type=str)
 parser.add_argument('--skip', default=1, type=int)
+parser.add_argument('--image_threads', default=4, type=int, help="Image decoding threads")
+parser.add_argument('--image_cache_size', default=256, type=int, help="Decoded frames kept in the LRU cache")
+parser.add_argument('--image_prefetch', default=0, type=int, help="Next frames of each sequence decoded in background")
 
 classes = {"Car":0, "Cyc":1, "Mot":2, "Ped":3, "Dum":-1} # Car, Ped, Mot, Cyc, Dummy
 
@@ -254,6 +258,9 @@ def main(args):
     if test_submission:
         pred_len = 0 # 0 only in test, since we do not have these data
 
+    image_loader = configure_image_loader(num_threads=args.image_threads, cache_size=args.image_cache_size,
+                                          prefetch=args.image_prefetch)
+
     for path in paths:
         checkpoint = torch.load(path)
         generator = get_generator(checkpoint.config_cp, config_file)
@@ -287,6 +294,7 @@ def main(args):
 
         print('Dataset: {}, Pred Len: {}, ADE: {:.2f}, FDE: {:.2f}'.format(
             args.dataset_path, pred_len, ade, fde))
+        print("Image loader: ", image_loader.stats())
 
 if __name__ == '__main__':
     args = parser.parse_args()
@@ -18,13 +18,13 @@ from pathlib import Path
 from prodict import Prodict
 from torch.utils.data import DataLoader
 
-from argoverse.evaluation.competition_util import generate_forecasting_h5
 
 sys.path.append("/home/robesafe/libraries/SoPhie")
 
 from sophie.data_loader.argoverse.dataset_unified import ArgoverseMotionForecastingDataset, seq_collate
 from sophie.models import SoPhieGenerator
 from sophie.modules.evaluation_metrics import displacement_error, final_displacement_error
+from sophie.utils.submission_writer import SubmissionWriter
 from sophie.utils.utils import relative_to_abs
 
 parser = argparse.ArgumentParser()
@@ -33,7 +33,10 @@ parser.add_argument('--dataset_path', default='data/datasets/argoverse/', type=s
 parser.add_argument('--num_samples', default=2, type=int)
 parser.add_argument('--dset_type', default='test', type=str)
 parser.add_argument('--results_path', default='results/argoverse/exp1', type=str)
-parser.add_argument('--results_file', default='test_predictions', type=str)
+parser.add_argument('--results_file', default='test_predictions', type=str,
+                    help="Unused (the predictions are written to <results_path>/argoverse_forecasting_baseline.h5)")
+parser.add_argument('--resume', action='store_true',
+                    help="Continue the .h5 file of a previous (interrupted) run. ADE/FDE only cover the new batches")
 
 # Global variables
 
@@ -41,14 +44,6 @@ seqs_without_agent = 0
 
 # Auxiliar functions
 
-class AutoTree(dict):
-    """
-    Dictionary with unlimited levels
-    """
-    def __missing__(self, key):
-        value = self[key] = type(self)()
-        return value
-
 def condition(x,class_name):
     """
     """
@@ -71,24 +66,21 @@ def evaluate_helper(error, seq_start_end):
 
 # Evaluate model functions
 
-def store_json(json_dict, predicted_trajectories, object_cls, obj_id, num_seq):
+def agent_predictions(predicted_trajectories, object_cls, obj_id, num_seq):
     """
+    Predicted trajectory of the AGENT of every sequence of the batch
+    Output:
+        np.array (batch_size,pred_len,2)
     """
-    # TODO: Get multimodal prediction, not only the best one (At this moment, it is the same both for '0' and '1')
 
     global seqs_without_agent
 
-    # print("Pred Traj: ", predicted_trajectories, predicted_trajectories.shape)
-    # print("Obj cls: ", object_cls, object_cls.shape)
-    # print("Obj id: ", obj_id, obj_id.shape)
-    # print("Num seq: ", num_seq, num_seq.shape)
-
     batch_size = int(object_cls.shape[0])
     num_agents_per_obs = int(predicted_trajectories.shape[1] / batch_size)
 
+    agent_pred_trajectories = []
     for i in range(batch_size):
         curr_obj_id = obj_id[i].cpu().data.numpy() # (num_agents_per_obs,)
-        curr_num_seq = int(num_seq[i].cpu().data.numpy())
         agent_index = np.where(curr_obj_id == 1.0)[0] # AGENT ID
 
         if agent_index.size > 0:
@@ -96,23 +88,16 @@ def store_json(json_dict, predicted_trajectories, object_cls, obj_id, num_seq):
         else: # TODO: Fix this -> What should we do if the agent is further than distance_threshold in the obs_len-th frame?
             seqs_without_agent += 1
             agent_pred_trajectory = np.random.randn(predicted_trajectories.shape[0],2)
+        agent_pred_trajectories.append(agent_pred_trajectory)
 
-        # TODO: THIS IS NOT CORRECT: Provisional multimodal prediction (at this moment we do not provide different predictions)
-
-        multimodal_agent_pred_trajectory = np.array([agent_pred_trajectory,agent_pred_trajectory]) # N (different predictions) x 30 x 2
-        multimodal_agent_pred_trajectory = multimodal_agent_pred_trajectory.tolist()
-        json_dict[curr_num_seq] = multimodal_agent_pred_trajectory
-        # print("agent_pred_trajectory: ", agent_pred_trajectory, agent_pred_trajectory.shape)
+    return np.stack(agent_pred_trajectories, axis=0)
 
-    return json_dict
-
-def evaluate(loader, generator, num_samples, results_path, results_file, encoding_dict, pred_len, split):
+def evaluate(loader, generator, num_samples, results_path, encoding_dict, pred_len, split, resume=False):
     """
     """
 
-    final_results = os.path.join(results_path, results_file + '.json')
-
-    json_dict = AutoTree()
+    # Every sample is a mode of the AGENT prediction, streamed to the .h5 file batch by batch
+    writer = SubmissionWriter(results_path, num_modes=num_samples, resume=resume)
 
     final_ade, final_fde = 0,0
     ade_outer, fde_outer = [], []
@@ -122,6 +107,9 @@ def evaluate(loader, generator, num_samples, results_path, results_file, encodin
         for batch_index, batch in enumerate(loader):
             print(f"Evaluating batch {batch_index+1}/{len(loader)}")
 
+            if all(writer.done(seq_id) for seq_id in batch[11].view(-1).tolist()): # Already in the .h5 file (resume)
+                continue
+
             batch = [tensor.cuda() for tensor in batch] # Use GPU
             # batch = [tensor for tensor in batch] # Use CPU
 
@@ -129,6 +117,7 @@ def evaluate(loader, generator, num_samples, results_path, results_file, encodin
              loss_mask, seq_start_end, frames, object_cls, obj_id, ego_vehicle_origin, num_seq) = batch
 
             ade, fde = [], []
+            modes = []
             total_traj += pred_traj_gt.size(1)
 
             for _ in range(num_samples):
@@ -141,7 +130,7 @@ def evaluate(loader, generator, num_samples, results_path, results_file, encodin
                 ego_vehicle_origin = ego_vehicle_origin.reshape(ego_vehicle_origin.shape[0],-1) # batch_size x 1 x 2 -> batch_size x 2
                 pred_traj_fake = relative_to_abs(pred_traj_fake_rel, ego_vehicle_origin) # Absolute coordinates
 
-                json_dict = store_json(json_dict, pred_traj_fake, object_cls, obj_id, num_seq)
+                modes.append(agent_predictions(pred_traj_fake, object_cls, obj_id, num_seq))
 
                 if split != "test": # We cannot compute ADE and FDE metrics if we do not have the gt data for those frames
                     ade.append(displacement_error(
@@ -151,6 +140,8 @@ def evaluate(loader, generator, num_samples, results_path, results_file, encodin
                         pred_traj_fake[-1], pred_traj_gt[-1], mode='raw'
                     ))
 
+            writer.append(num_seq.view(-1).cpu().numpy(), np.stack(modes, axis=1)) # batch_size x num_samples x 30 x 2
+
             if split != "test":
                 ade_sum = evaluate_helper(ade, seq_start_end)
                 fde_sum = evaluate_helper(fde, seq_start_end)
@@ -165,15 +156,9 @@ def evaluate(loader, generator, num_samples, results_path, results_file, encodin
             final_ade = -1
             final_fde = -1  
 
-        # Store JSON
-
-        # print(("JSON dict: ", json_dict, type(json_dict)))
-        with open(final_results, 'w') as output_file:
-            json.dump(json_dict, output_file)
+        # Close the H5 file for Argoverse Motion-Forecasting competition
 
-        # Generate H5 file for Argoverse Motion-Forecasting competition
-        
-        generate_forecasting_h5(json_dict, results_path)
+        writer.close()
 
     return final_ade, final_fde
 
@@ -241,7 +226,7 @@ def main(args):
     with open(encoding_ids_file) as input_file:
         encoding_dict = json.load(input_file)
 
-    # Evaluate, store results in .json file and get metrics
+    # Evaluate, store results in .h5 file and get metrics
 
     ## Create results folder if does not exist
 
@@ -250,8 +235,8 @@ def main(args):
         os.mkdir(args.results_path)
 
     ade, fde = evaluate(test_loader, generator, args.num_samples, args.results_path, 
-                        args.results_file, encoding_dict, config_file.hyperparameters.pred_len, 
-                        config_file.dataset.split)
+                        encoding_dict, config_file.hyperparameters.pred_len, 
+                        config_file.dataset.split, resume=args.resume)
 
     print('\n\nDataset: {}, Pred Len: {:.2f} s, ADE: {:.2f}, FDE: {:.2f}'.format(args.dataset_path, 
                                                                              config_file.hyperparameters.pred_len/10, 
@@ -20,8 +20,6 @@ from pathlib import Path
 from prodict import Prodict
 from torch.utils.data import DataLoader
 
-from argoverse.evaluation.competition_util import generate_forecasting_h5
-
 BASE_DIR = "/home/robesafe/libraries/SoPhie"
 sys.path.append(BASE_DIR)
 
@@ -29,6 +27,8 @@ from sophie.data_loader.argoverse.dataset_sgan_version import ArgoverseMotionFor
 # from sophie.models.sophie_adaptation import TrajectoryGenerator
 from sophie.models.mp_soconf import TrajectoryGenerator
 from sophie.modules.evaluation_metrics import displacement_error, final_displacement_error
+from sophie.utils.instrumentation import build_profiler
+from sophie.utils.submission_writer import SubmissionWriter
 from sophie.utils.utils import relative_to_abs, relative_to_abs_sgan
 
 parser = argparse.ArgumentParser()
@@ -36,6 +36,7 @@ parser.add_argument('--model_path', type=str)
 parser.add_argument('--dataset_path', default='data/datasets/argoverse/', type=str)
 parser.add_argument('--num_samples', default=6, type=int)
 parser.add_argument('--dset_type', default='test', type=str)
+parser.add_argument('--resume', action='store_true', help="Continue the .h5 file of a previous (interrupted) run")
 
 # Global variables
 
@@ -43,11 +44,12 @@ seqs_without_agent = 0
 
 # Evaluate model functions
 
-def evaluate(loader, generator, num_samples, pred_len, split, results_path):
+def evaluate(loader, generator, num_samples, pred_len, split, results_path, profiler=None, resume=False):
     """
+    The predictions are streamed to the .h5 file batch by batch (see SubmissionWriter)
     """
 
-    output_all = {}
+    writer = SubmissionWriter(results_path, num_modes=num_samples, resume=resume)
     test_folder = BASE_DIR+"/data/datasets/argoverse/motion-forecasting/test/data/"
     file_list = glob.glob(os.path.join(test_folder, "*.csv"))
     file_list = [int(name.split("/")[-1].split(".")[0]) for name in file_list]
@@ -56,6 +58,11 @@ def evaluate(loader, generator, num_samples, pred_len, split, results_path):
     with torch.no_grad(): # When testing, gradient calculation is not required
         for batch_index, batch in enumerate(loader):
             print(f"Evaluating batch {batch_index+1}/{len(loader)}")
+            if profiler is not None:
+                profiler.step()
+
+            if writer.done(batch[11][0]): # Already in the .h5 file (resume)
+                continue
 
             batch = [tensor.cuda() for tensor in batch]
             
@@ -74,26 +81,12 @@ def evaluate(loader, generator, num_samples, pred_len, split, results_path):
 
             predicted_traj = torch.stack(predicted_traj, axis=0).view(num_samples,-1,2) # Num_samples x pred_len x 2 (x,y)
 
-            key = num_seq_list[0].cpu().item()
-
-            output_all[key] = predicted_traj.cpu().numpy()
-            file_list.remove(key)
-
-        # add sequences not loaded in dataset
-        file_list = []
-        try:
-            print("No processed files: {}".format(len(file_list.keys())))
-        except:
-            print("All files have been processed")
-
-        for key in file_list:
-            output_all[key] = np.zeros((num_samples, 30, 2))
+            writer.append(num_seq_list.view(-1).cpu().numpy(), predicted_traj.unsqueeze(0))
 
-        # Generate H5 file for Argoverse Motion-Forecasting competition
-        pdb.set_trace()
-        generate_forecasting_h5(output_all, results_path)
+        # Add sequences not loaded in dataset (zeros) and close the H5 file for the Argoverse Motion-Forecasting competition
+        writer.close(file_list)
 
-    return output_all
+    return writer.path
 
 # Ad-hoc generator for each dataset
 
@@ -174,8 +167,12 @@ def main(args):
         print("Create results path folder: ", results_path)
         os.makedirs(results_path) # os.makedirs create intermediate directories. os.mkdir only the last one
 
-    output_all = evaluate(test_loader, generator, args.num_samples, config_file.hyperparameters.pred_len, 
-                          config_file.dataset.split, results_path)
+    # torch.profiler capture windows (hyperparameters.profile in the config file)
+    profiler = build_profiler(config_file.hyperparameters.profile, os.path.join(results_path, "profiler"), name="test")
+    profiler.start()
+    results_file = evaluate(test_loader, generator, args.num_samples, config_file.hyperparameters.pred_len, 
+                            config_file.dataset.split, results_path, profiler=profiler, resume=args.resume)
+    profiler.stop()
     
 if __name__ == '__main__':
     args = parser.parse_args()
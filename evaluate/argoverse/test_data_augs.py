@@ -26,12 +26,9 @@ from sophie.data_loader.argoverse.dataset_sgan_version_test_map import Argoverse
                                                                        read_file, process_window_sequence
 import sophie.data_loader.argoverse.map_utils as map_utils
 from sophie.trainers.trainer_sophie_adaptation import cal_ade, cal_fde
-from argoverse.map_representation.map_api import ArgoverseMap
 import sophie.data_loader.argoverse.map_utils as map_utils
 import sophie.data_loader.argoverse.dataset_utils as dataset_utils
 
-avm = ArgoverseMap()
-
 with open(r'./configs/sophie_argoverse.yml') as config:
             config = yaml.safe_load(config)
             config = Prodict.from_dict(config)
@@ -23,33 +23,39 @@ from sophie.utils.utils import relative_to_abs_sgan
 from sophie.models.mp_sovi import TrajectoryGenerator
 from sophie.data_loader.argoverse.dataset_sgan_version_test_map import ArgoverseMotionForecastingDataset, \
                                                                        seq_collate, load_list_from_folder, \
-                                                                       read_file, process_window_sequence
+                                                                       read_file, process_window_sequence, dist_around
 import sophie.data_loader.argoverse.map_utils as map_utils
 from sophie.trainers.trainer_sophie_adaptation import cal_ade, cal_fde
-from argoverse.map_representation.map_api import ArgoverseMap
 import sophie.data_loader.argoverse.map_utils as map_utils
 import sophie.data_loader.argoverse.dataset_utils as dataset_utils
-
-avm = ArgoverseMap()
+from sophie.modules.evaluation_metrics import drivable_area_compliance
 
 with open(r'./configs/sophie_argoverse.yml') as config:
             config = yaml.safe_load(config)
             config = Prodict.from_dict(config)
             config.base_dir = BASE_DIR
 
-def evaluate_feasible_area_prediction(pred_traj_fake, filename):
+def evaluate_feasible_area_prediction(pred_traj_fake, origin_pos, filename):
     """
     Get feasible_area_loss. If a prediction point (in pixel coordinates) is in the drivable (feasible)
     area, is weighted with 1. Otherwise, it is weighted with 0. Theoretically, all points must be
     in the prediction area for the AGENT in Argoverse
 
     Input:
-        pred_traj_fake: Torch.tensor -> pred_len x batch_size x 2 (x|y)
-        filename: Image filename to read
+        pred_traj_fake: Torch.tensor -> pred_len x batch_size x 2 (x|y) in global (map) coordinates
+        origin_pos: Torch.tensor -> batch_size x 2, center of the rasterized maps
+        filename: Image filename (or list of batch_size filenames) to read
     Output:
-        feasible_area_loss: min = 0 (num_points · 1), max = pred_len (num_points · 1)
+        feasible_area_loss: Torch.tensor -> batch_size x pred_len, 1 (drivable) or 0
     """
 
+    filenames = [filename] if isinstance(filename, str) else filename
+    masks = torch.from_numpy(dataset_utils.get_drivable_masks(filenames)).to(pred_traj_fake.device)
+    masks = masks.expand(pred_traj_fake.shape[1], -1, -1)
+
+    _, drivable = drivable_area_compliance(pred_traj_fake.permute(1,0,2).unsqueeze(1), masks,
+                                           origin_pos, dist_around)
+    feasible_area_loss = drivable[:,0,:].long()
 
     return feasible_area_loss
 
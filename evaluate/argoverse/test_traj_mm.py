@@ -27,9 +27,6 @@ from sophie.data_loader.argoverse.dataset_sgan_version_data_augs import Argovers
                                                                        read_file
 import sophie.data_loader.argoverse.map_utils as map_utils
 # from sophie.trainers.trainer_sophie_adaptation import cal_ade, cal_fde
-from argoverse.map_representation.map_api import ArgoverseMap
-
-avm = ArgoverseMap()
 
 pred_gt_file = "test_trajectories/" "pred_gt.npy"
 pred_fake_file = "test_trajectories/" "pred_fake.npy"
@@ -199,7 +196,7 @@ except:
             map_utils.map_generator(file_id,
                                     origin_pos,
                                     dist_rasterized_map,
-                                    avm,
+                                    map_utils.get_avm(),
                                     city_name,
                                     show=True,
                                     root_folder=data_images_folder)
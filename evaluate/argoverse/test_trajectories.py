@@ -27,9 +27,6 @@ from sophie.data_loader.argoverse.dataset_sgan_version_test_map import Argoverse
                                                                        read_file
 import sophie.data_loader.argoverse.map_utils as map_utils
 from sophie.trainers.trainer_sophie_adaptation import cal_ade, cal_fde
-from argoverse.map_representation.map_api import ArgoverseMap
-
-avm = ArgoverseMap()
 
 pred_len = 30
 
@@ -123,7 +120,7 @@ if MAP_GENERATION:
         map_utils.map_generator(file_id,
                                 origin_pos,
                                 dist_rasterized_map,
-                                avm,
+                                map_utils.get_avm(),
                                 city_name,
                                 show=True,
                                 root_folder=data_images_folder)
@@ -3,6 +3,9 @@ import copy, glob, glob2
 from torch.utils.data import Dataset
 import cv2
 
+from sophie.data_loader.aiodrive.image_loader import get_image_loader
+from sophie.data_loader.windowing import agent_windows
+
 np.set_printoptions(precision=3, suppress=True)
 
 def safe_list(input_data, warning=False, debug=False):
@@ -149,19 +152,19 @@ def get_folder_name(video_path, seq_name):
     return full_path
 
 def load_images(video_path, frames, extension="png", new_shape=(600,600)):
-    frames_list = []
-    cont = 0
-    for frame in frames:
-        folder_name = get_folder_name(video_path[0], frame[0].item())
-        cont += 1
-        image_id = str(int(frame[1].item()))
-        image_url = os.path.join(folder_name, "{}.{}".format(image_id.zfill(6), extension))
-        #print("image_url: ", image_url)
-        frame = cv2.imread(image_url)
-        frame = cv2.resize(frame, new_shape)
-        frames_list.append(np.expand_dims(frame, axis=0))
-    frames_arr = np.concatenate(frames_list, axis=0)
-    return frames_arr
+    """
+    Decode the frames (seq_name_int, frame) with the process-wide ImageLoader (thread pool + LRU
+    cache, see image_loader.configure_image_loader)
+    """
+    loader = get_image_loader()
+    assert tuple(loader.new_shape) == tuple(new_shape), "Configure the image loader with new_shape"
+
+    def image_url(seq_name, frame):
+        folder_name = get_folder_name(video_path[0], seq_name)
+        return os.path.join(folder_name, "{}.{}".format(str(frame).zfill(6), extension))
+
+    keys = [(int(frame[0].item()), int(frame[1].item())) for frame in frames]
+    return loader.load(keys, image_url)
 
 def seq_collate_image_aiodrive(data): # id_frame
     """
@@ -347,200 +350,36 @@ class AioDriveDataset(Dataset):
                 min_frame, max_frame = frames[0], frames[-1]
                 num_windows = int(max_frame - min_frame + 1 - skip*(self.seq_len - 1))      # include all frames for past and future
 
-            # loop through every windows
-            for window_index in range(num_windows):
-                start_frame = int(window_index + min_frame)
-                end_frame = int(start_frame + self.seq_len*skip)        # right-open, not including this frame  
-               
-                if split=='test':
-                    if windows_frames and start_frame not in windows_frames:
-                        # print("Continue")
-                        continue
-
-                # print("Start frame: ", start_frame)
-                    
-                frame = start_frame + self.obs_len
-                seq_name_int = seqname2int(seq_name)
-                if frame > 999:
-                    frame -= 1
-                seq_frame = np.array([seq_name_int, frame])
-
-                # reduce window during testing, only evaluate every N windows
-                # if phase == 'testing':
-                #     check_pass = check_eval_windows(start_frame+self.obs_len*skip, self.obs_len*skip, self.pred_len*skip, split=split)
-                #     if not check_pass: 
-                #         continue
-
-                # get data in current window
-                curr_seq_data = []
-                for frame in range(start_frame, end_frame, skip):
-                    curr_seq_data.append(data[frame == data[:, 0], :])        
-                curr_seq_data = np.concatenate(curr_seq_data, axis=0) # frame - id - x - y
-
-                # initialize data
-
-                peds_in_curr_seq_list = []
-
-                peds_in_curr_seq = np.unique(curr_seq_data[:, 1]) # numero de peds en la ventana
-                peds_len = peds_in_curr_seq.shape[0]
-
-                num_agents = 32
-                num_mini_batches = math.ceil(float(peds_len/32))
-
-                for mini_batch in range(num_mini_batches):
-                    if mini_batch == num_mini_batches-1:
-                        peds_in_curr_seq_1 = peds_in_curr_seq[num_agents*mini_batch:]
-                        dummy = [-1 for i in range(32 - peds_in_curr_seq_1.shape[0])]
-                        peds_in_curr_seq_1 = np.concatenate((peds_in_curr_seq_1, dummy))
-                        peds_in_curr_seq_list.append(peds_in_curr_seq_1)
-                    else:
-                        peds_in_curr_seq_1 = peds_in_curr_seq[num_agents*mini_batch:num_agents*(mini_batch+1)]
-                        peds_in_curr_seq_list.append(peds_in_curr_seq_1)
-
-                ### crea las esructuras de datos con peds_in_curr_seq de objetos por batch
-                # print(">>>>>>>>>>>>>")
-                for current_peds in peds_in_curr_seq_list:
-                    # print("Current ped: ", current_peds)
-                    curr_seq_rel   = np.zeros((len(current_peds), 2, self.seq_len))     # objects x 2 x seq_len
-                    curr_seq       = np.zeros((len(current_peds), 2, self.seq_len))
-                    curr_loss_mask = np.zeros((len(current_peds)   , self.seq_len))     # objects x seq_len
-                    id_frame_list  = np.zeros((len(current_peds), 3, self.seq_len))     # objects x 3 x seq_len
-                    object_class_list = np.zeros(len(current_peds))
-                    object_class_list.fill(-1)
-                    id_frame_list.fill(0)
-                    num_peds_considered = 0
-                    _non_linear_ped = []
-
-                    # loop through every object in this window
-                    # print("current_peds: ", current_peds)
-                    for _, ped_id in enumerate(current_peds):
-                        if ped_id == -1:
-                            num_peds_considered += 1
-                            continue
-
-                        object_class = getObjecClass(path)
-                        object_class_id = self.objects_id_dict[object_class]
-                        curr_ped_seq = curr_seq_data[curr_seq_data[:, 1] == ped_id, :]      # frame - id - x - y for one of the id of the window, same id
-                        pad_front    = int(curr_ped_seq[0, 0] ) - start_frame      # first frame of window       
-                        pad_end      = int(curr_ped_seq[-1, 0]) - start_frame + skip # last frame of window
-                        assert pad_end % skip == 0, 'error'
-                        frame_existing = curr_ped_seq[:, 0].tolist() # frames of windows
-                        #print("frame_existing: ", frame_existing, pad_front, pad_end, curr_ped_seq)
-
-                        # pad front and back data to make the trajectory complete
-                        if pad_end - pad_front != self.seq_len * skip:
-                            
-                            # pad end
-                            to_be_paded_end = int(self.seq_len - pad_end / skip)
-                            pad_end_seq  = np.expand_dims(curr_ped_seq[-1, :], axis=0)
-                            pad_end_seq  = np.repeat(pad_end_seq, to_be_paded_end, axis=0)
-                            frame_offset = np.zeros((to_be_paded_end, 4), dtype='float32')
-                            frame_offset[:, 0] = np.array(range(1, to_be_paded_end+1))
-                            pad_end_seq += frame_offset * skip                          # shift first columns for frame
-                            curr_ped_seq = np.concatenate((curr_ped_seq, pad_end_seq), axis=0)
-
-                            # pad front
-                            to_be_paded_front = int(pad_front / skip)
-                            pad_front_seq = np.expand_dims(curr_ped_seq[0, :], axis=0)
-                            pad_front_seq = np.repeat(pad_front_seq, to_be_paded_front, axis=0)
-                            frame_offset = np.zeros((to_be_paded_front, 4), dtype='float32')
-                            frame_offset[:, 0] = np.array(range(-to_be_paded_front, 0))
-                            pad_front_seq += frame_offset * skip
-                            curr_ped_seq = np.concatenate((pad_front_seq, curr_ped_seq), axis=0)
-
-                            # set pad front and end to correct values
-                            pad_front = 0
-                            pad_end = self.seq_len * skip
-
-                        # add edge case when the object reappears at a bad frame
-                        # in other words, missing intermediate frame
-                        if curr_ped_seq.shape[0] != (pad_end - pad_front) / skip:
-                            frame_all = list(range(int(curr_ped_seq[0, 0]), int(curr_ped_seq[-1, 0])+skip, skip))     
-                            frame_missing, _ = remove_list_from_list(frame_all, curr_ped_seq[:, 0].tolist())
-
-                            # pad all missing frames with zeros
-                            pad_seq = np.expand_dims(curr_ped_seq[-1, :], axis=0)
-                            pad_seq = np.repeat(pad_seq, len(frame_missing), axis=0)
-                            pad_seq.fill(0)
-                            pad_seq[:, 0] = np.array(frame_missing)
-                            pad_seq[:, 1] = ped_id          # fill ID
-                            curr_ped_seq = np.concatenate((curr_ped_seq, pad_seq), axis=0)
-                            curr_ped_seq = curr_ped_seq[np.argsort(curr_ped_seq[:, 0])]
-
-                        assert pad_front == 0, 'error'
-                        assert pad_end == self.seq_len * skip, 'error'
-                        
-                        # make sure the seq_len frames are continuous, no jumping frames
-                        start_frame_now = int(curr_ped_seq[0, 0])
-                        if curr_ped_seq[-1, 0] != start_frame_now + (self.seq_len-1)*skip:
-                            num_peds_considered += 1
-                            continue
-
-                        # make sure that past data has at least one frame
-                        past_frame_list = [*range(start_frame_now, start_frame_now + self.obs_len * skip, skip)]
-                        common = find_unique_common_from_lists(past_frame_list, frame_existing, only_com=True)
-                        #print("common ", common)
-                        if len(common) == 0:
-                            num_peds_considered += 1
-                            continue
-
-                        # make sure that future GT data has at least one frame
-                        if phase != 'testing':
-                            gt_frame_list = [*range(start_frame_now + self.obs_len*skip, start_frame_now + self.seq_len*skip, skip)]
-                            common = find_unique_common_from_lists(gt_frame_list, frame_existing, only_com=True)
-                            if len(common) == 0: 
-                                num_peds_considered += 1
-                                continue
-
-                        # only keep the state
-                        cache_tmp = np.transpose(curr_ped_seq[:, :2])       # 2xseq_len | [0,:] list of frames | [1,:] id
-                        curr_ped_seq = np.transpose(curr_ped_seq[:, 2:])    # 2 x seq_len | [0,:] x | [1,:] y
-
-                        # print("cache_tmp: ", cache_tmp, cache_tmp.shape)
-                        # print("curr_ped_seq: ", curr_ped_seq, curr_ped_seq.shape)
-
-                        # Make coordinates relative
-                        rel_curr_ped_seq = np.zeros(curr_ped_seq.shape)
-                        rel_curr_ped_seq[:, 1:] = curr_ped_seq[:, 1:] - curr_ped_seq[:, :-1]
-                        _idx = num_peds_considered
-                        curr_seq[_idx, :, :] = curr_ped_seq     
-                        curr_seq_rel[_idx, :, :] = rel_curr_ped_seq
-
-                        # record seqname, frame and ID information 20 - 3 - x
-                        id_frame_list[_idx, :2, :] = cache_tmp
-                        id_frame_list[_idx, 2, :] = seq_name_int # img_id - ped_id - seqname2int
-                        
-                        # Linear vs Non-Linear Trajectory, only fit for the future part not past part
-
-                        if phase != 'testing':
-                            _non_linear_ped.append(poly_fit(curr_ped_seq, pred_len, threshold))     
-
-                        # add mask onto padded dummay data
-                        frame_exist_index = np.array([frame_tmp - start_frame_now for frame_tmp in frame_existing])
-                        frame_exist_index = (frame_exist_index / skip).astype('uint8')
-                        curr_loss_mask[_idx, frame_exist_index] = 1
-
-                        # object id
-                        object_class_list[num_peds_considered] = object_class_id
-
-                        num_peds_considered += 1
-                        #print("b")
-                    
-                    #print("num_peds_considered ", num_peds_considered)
-                    #num_peds_considered = 32
-                    if num_peds_considered > min_ped:
-                        if len(_non_linear_ped) != num_peds_considered:
-                            dummy = [-1 for i in range(num_peds_considered - len(_non_linear_ped))]
-                            _non_linear_ped = _non_linear_ped + dummy
-                        non_linear_ped += _non_linear_ped
-                        num_peds_in_seq.append(num_peds_considered)
-                        loss_mask_list.append(curr_loss_mask[:num_peds_considered])
-                        seq_list.append(curr_seq[:num_peds_considered])
-                        seq_list_rel.append(curr_seq_rel[:num_peds_considered])
-                        seq_id_list.append(id_frame_list[:num_peds_considered])
-                        frames_list.append(seq_frame)
-                        object_class_id_list.append(object_class_list)
-                        object_id_list.append(id_frame_list[:num_peds_considered][:,1,0])
+            # all windows at once (vectorized kernel, see sophie/data_loader/windowing.py)
+            start_frames = [int(window_index + min_frame) for window_index in range(num_windows)]
+            if split == 'test' and windows_frames:
+                start_frames = [start_frame for start_frame in start_frames if start_frame in windows_frames]
+            num_agents = 32
+            if len(start_frames) == 0 or num_agents <= min_ped:
+                continue
+
+            seq_name_int = seqname2int(seq_name)
+            object_class_id = self.objects_id_dict[getObjecClass(path)]
+            windows = agent_windows(data, start_frames, self.seq_len, self.obs_len, skip=skip,
+                                    num_agents=num_agents, check_future=phase != 'testing',
+                                    pred_len=pred_len, threshold=threshold,
+                                    seq_name_int=seq_name_int, object_class_id=object_class_id)
+
+            # frame of interest of every group
+            frame = np.array(start_frames)[windows["window"]] + self.obs_len
+            frame[frame > 999] -= 1
+            seq_frame = np.stack([np.full(len(frame), seq_name_int), frame], axis=1)
+
+            num_groups = len(windows["window"])
+            non_linear_ped += windows["non_linear"].tolist()
+            num_peds_in_seq += [num_agents] * num_groups
+            loss_mask_list.append(windows["loss_mask"])
+            seq_list.append(windows["seq"])
+            seq_list_rel.append(windows["seq_rel"])
+            seq_id_list.append(windows["id_frame"])
+            frames_list += list(seq_frame)
+            object_class_id_list += list(windows["object_class"])
+            object_id_list += list(windows["object_id"])
 
         self.num_seq = len(seq_list)
         seq_list = np.concatenate(seq_list, axis=0)             # objects x 2 x seq_len
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+import numpy as np
+import cv2
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class ImageLoader():
+    """
+    Decode (cv2.imread + cv2.resize) AIODrive frames in a bounded thread pool (OpenCV releases the GIL)
+    and keep the last cache_size decoded frames in an LRU cache keyed by (seq_name_int, frame), so the
+    frames shared by overlapping windows are decoded once.
+
+        loader = ImageLoader(num_threads=4, cache_size=256, prefetch=8)
+        frames = loader.load(keys, image_url) # keys: [(seq_name_int, frame)] -> np.array (b,600,600,3) uint8
+        loader.stats() # hit rate and decode throughput
+
+    prefetch > 0: after every load(), the next prefetch frames of each sequence are decoded in
+    background (the frames of the upcoming windows when the windows are read in order).
+    The pool is created lazily, so the loader can be used in forked DataLoader workers.
+    """
+    def __init__(self, num_threads=4, cache_size=256, prefetch=0, new_shape=(600,600)):
+        self.num_threads = num_threads
+        self.cache_size = cache_size
+        self.prefetch_frames = prefetch
+        self.new_shape = new_shape
+
+        self.lock = threading.Lock()
+        self.cache = OrderedDict() # (seq_name_int, frame) -> np.array (600,600,3) uint8
+        self.pending = {} # (seq_name_int, frame) -> Future
+        self.pool = None
+        self.pid = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+            self.decoded = 0
+            self.decode_time = 0.0
+            self.load_time = 0.0
+            self.loaded = 0
+
+    def _get_pool(self):
+        if self.pool is None or self.pid != os.getpid(): # Not inherited from the parent process
+            self.lock = threading.Lock()
+            self.pool = ThreadPoolExecutor(max_workers=self.num_threads)
+            self.pid = os.getpid()
+            self.pending = {}
+        return self.pool
+
+    def _decode(self, key, image_url):
+        t0 = time.perf_counter()
+        try:
+            frame = cv2.imread(image_url)
+            assert frame is not None, "Image {} could not be read".format(image_url)
+            frame = cv2.resize(frame, self.new_shape)
+        except Exception:
+            with self.lock:
+                self.pending.pop(key, None)
+            raise
+        with self.lock:
+            self.decoded += 1
+            self.decode_time += time.perf_counter() - t0
+            self.cache[key] = frame
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            self.pending.pop(key, None)
+        return frame
+
+    def _submit(self, key, image_url):
+        """
+        Cached frame or Future of the decode (shared if it is already pending)
+        """
+        pool = self._get_pool()
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key], True
+            if key not in self.pending:
+                self.pending[key] = pool.submit(self._decode, key, image_url)
+            return self.pending[key], False
+
+    def load(self, keys, image_url):
+        """
+        Input:
+            keys: list of (seq_name_int, frame)
+            image_url: function (seq_name_int, frame) -> path of the image
+        Output:
+            np.array (len(keys),600,600,3) uint8
+        """
+        t0 = time.perf_counter()
+        keys = [(int(seq_name), int(frame)) for seq_name, frame in keys]
+        results, hits = [], 0
+        for key in keys:
+            result, hit = self._submit(key, image_url(*key))
+            results.append(result)
+            hits += hit
+        frames_arr = np.stack([r if isinstance(r, np.ndarray) else r.result() for r in results], axis=0)
+
+        with self.lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+            self.loaded += len(keys)
+            self.load_time += time.perf_counter() - t0
+
+        if self.prefetch_frames > 0:
+            self.prefetch(keys, image_url)
+        return frames_arr
+
+    def prefetch(self, keys, image_url):
+        """
+        Decode in background the next prefetch_frames frames of every given (seq_name_int, frame)
+        """
+        for seq_name, frame in set(keys):
+            for k in range(1, self.prefetch_frames + 1):
+                url = image_url(seq_name, frame + k)
+                if os.path.isfile(url):
+                    self._submit((seq_name, frame + k), url)
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hit_rate": self.hits / max(requests, 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "decoded": self.decoded,
+                "decoded_per_s": self.decoded / max(self.decode_time, 1e-9), # per thread
+                "frames_per_s": self.loaded / max(self.load_time, 1e-9), # seen by the collate function
+                "cached": len(self.cache)
+            }
+
+# Process-wide loader used by seq_collate_image_aiodrive
+
+_image_loader = ImageLoader()
+
+def get_image_loader():
+    return _image_loader
+
+def configure_image_loader(num_threads=4, cache_size=256, prefetch=0, new_shape=(600,600)):
+    global _image_loader
+    _image_loader = ImageLoader(num_threads=num_threads, cache_size=cache_size, prefetch=prefetch,
+                                new_shape=new_shape)
+    return _image_loader
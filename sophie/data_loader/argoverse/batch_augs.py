@@ -0,0 +1,301 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+"""
+Batched data augmentation on the collated tensors (seq_len x num_agents·batch_size x 2), on the
+device of the batch. Batched versions of dataset_utils.swap_points, erase_points, add_gaussian_noise
+and rotate_traj: every augmentation is applied to a random subset of agents (or scenes, for the
+rotation) given by a per-sample mask, with a seeded torch.Generator.
+
+    augs = BatchAugmentation(swap_prob=0.5, erase_prob=0.9, noise_prob=0.8, rotation_prob=0.5,
+                             seed=0, device="cuda")
+    obs_traj, pred_traj_gt, obs_traj_rel, pred_traj_gt_rel = augs(obs_traj, pred_traj_gt, seq_start_end)
+    batch = augs.augment_batch(batch) # Also rotates the frames (frames_kind) of the rotated scenes
+"""
+
+import torch
+
+# Content of the frames slot of a collated batch (see dataset_sgan_version_test_map.get_frames_kind).
+# None: dummy frames, nothing to rotate
+FRAMES_KINDS = (None, "raster", "goal_points", "centerlines")
+
+def get_pairs_batch(num_agents, num_obs, num_pairs, generator=None, device="cpu", start_from=1):
+    """
+    Batched get_pairs: num_pairs non-consecutive indeces per agent in the range (start_from, num_obs-1),
+    uniformly sampled (k sorted values in [0, m-k] plus their rank are k non-consecutive values in [0, m-1])
+    Input:
+        num_agents, num_obs, num_pairs: int
+    Output:
+        indeces: torch.tensor (num_agents, num_pairs) long, sorted
+    """
+    num_slots = num_obs - start_from - num_pairs + 1
+    assert num_pairs >= 0 and num_slots >= num_pairs, "Too many non-consecutive points"
+    if num_pairs == 0:
+        return torch.zeros((num_agents, 0), dtype=torch.long, device=device)
+
+    scores = torch.rand((num_agents, num_slots), generator=generator, device=device)
+    chosen = scores.argsort(dim=1)[:, :num_pairs].sort(dim=1)[0]
+    return chosen + torch.arange(num_pairs, device=device)[None, :] + start_from
+
+def _gather_steps(traj, steps):
+    """
+    Input:
+        traj: torch.tensor (T, N, 2)
+        steps: torch.tensor (N, T) long -> new_traj[t, n] = traj[steps[n, t], n]
+    """
+    steps = steps.t().unsqueeze(-1).expand(-1, -1, traj.shape[-1])
+    return traj.gather(0, steps)
+
+def swap_points_batch(traj, mask, num_obs=20, percentage=0.2, generator=None):
+    """
+    Batched swap_points: swap x(i) <-> x(i-1) for round(percentage*num_obs) non-consecutive i of the
+    observations
+    Input:
+        traj: torch.tensor (T, N, 2)
+        mask: torch.tensor (N,) bool, agents to be augmented
+    Output:
+        torch.tensor (T, N, 2)
+    """
+    seq_len, num_agents, _ = traj.shape
+    idx = get_pairs_batch(num_agents, num_obs, round(percentage*num_obs), generator, traj.device)
+    steps = torch.arange(seq_len, device=traj.device).repeat(num_agents, 1) # N x T
+    steps.scatter_(1, idx, idx - 1)
+    steps.scatter_(1, idx - 1, idx)
+    steps = torch.where(mask[:, None], steps, torch.arange(seq_len, device=traj.device)[None, :])
+    return _gather_steps(traj, steps)
+
+def erase_points_batch(traj, mask, num_obs=20, percentage=0.2, generator=None):
+    """
+    Batched erase_points: x(i) <- x(i-1) for round(percentage*num_obs) non-consecutive i of the
+    observations
+    Input:
+        traj: torch.tensor (T, N, 2)
+        mask: torch.tensor (N,) bool, agents to be augmented
+    Output:
+        torch.tensor (T, N, 2)
+    """
+    seq_len, num_agents, _ = traj.shape
+    idx = get_pairs_batch(num_agents, num_obs, round(percentage*num_obs), generator, traj.device)
+    steps = torch.arange(seq_len, device=traj.device).repeat(num_agents, 1) # N x T
+    steps.scatter_(1, idx, idx - 1)
+    steps = torch.where(mask[:, None], steps, torch.arange(seq_len, device=traj.device)[None, :])
+    return _gather_steps(traj, steps)
+
+def add_gaussian_noise_batch(traj, mask, num_obs=20, multi_point=True, mu=0, sigma=0.5, generator=None):
+    """
+    Batched add_gaussian_noise: gaussian offsets in the observations (one per point if multi_point,
+    otherwise a single x|y offset per agent)
+    Input:
+        traj: torch.tensor (T, N, 2)
+        mask: torch.tensor (N,) bool, agents to be augmented
+    Output:
+        torch.tensor (T, N, 2)
+    """
+    num_agents = traj.shape[1]
+    size = (num_obs if multi_point else 1, num_agents, 2)
+    noise = torch.randn(size, generator=generator, device=traj.device, dtype=traj.dtype) * sigma + mu
+    noise = noise * mask[None, :, None].type(traj.dtype)
+
+    noised_traj = traj.clone()
+    noised_traj[:num_obs] += noise
+    return noised_traj
+
+def rotation_matrices(angles):
+    """
+    Input:
+        angles: torch.tensor (B,) degrees
+    Output:
+        torch.tensor (B, 2, 2), counterclockwise rotations ([[c,-s],[s,c]])
+    """
+    angles_rad = torch.deg2rad(angles)
+    c, s = torch.cos(angles_rad), torch.sin(angles_rad)
+    return torch.stack([torch.stack([c, -s], dim=-1), torch.stack([s, c], dim=-1)], dim=-2)
+
+def scene_index(seq_start_end):
+    """
+    Input:
+        seq_start_end: torch.tensor (B, 2)
+    Output:
+        torch.tensor (num_agents,) long, scene of every agent
+    """
+    lengths = seq_start_end[:, 1] - seq_start_end[:, 0]
+    return torch.repeat_interleave(torch.arange(len(seq_start_end), device=lengths.device), lengths)
+
+def rotate_scenes(traj, R, seq_start_end):
+    """
+    Scene-consistent rotation: all the agents of a scene are rotated (around the origin of the scene,
+    (0,0) in the local frame) with the same matrix
+    Input:
+        traj: torch.tensor (T, N, 2)
+        R: torch.tensor (B, 2, 2)
+        seq_start_end: torch.tensor (B, 2)
+    Output:
+        torch.tensor (T, N, 2)
+    """
+    R_agent = R[scene_index(seq_start_end)].type(traj.dtype) # N x 2 x 2
+    return torch.einsum('nij,tnj->tni', R_agent, traj)
+
+def rotate_points(points, R, origin=None):
+    """
+    Rotate points of every scene (e.g. goal points) around the origin of the scene
+    Input:
+        points: torch.tensor (B, K, 2)
+        R: torch.tensor (B, 2, 2)
+        origin: torch.tensor (B, 1, 2) or None ((0,0), local frame)
+    Output:
+        torch.tensor (B, K, 2)
+    """
+    R = R.type(points.dtype)
+    if origin is None:
+        return torch.einsum('bij,bkj->bki', R, points)
+    origin = origin.type(points.dtype)
+    return torch.einsum('bij,bkj->bki', R, points - origin) + origin
+
+def rotate_rasters(frames, R):
+    """
+    Rotate a batch of rasters (centered on the origin of the scene, x to the right and y upwards as
+    rendered by map_utils) with the rotation matrices of the trajectories, with a single grid_sample
+    Input:
+        frames: torch.tensor (B, C, H, W), H == W
+        R: torch.tensor (B, 2, 2)
+    Output:
+        torch.tensor (B, C, H, W)
+    """
+    # Output pixel p (image coordinates, y downwards) samples the input at R^-1 p in world
+    # coordinates, that is, R p in image coordinates (F R(-a) F = R(a), F = diag(1,-1))
+
+    theta = torch.zeros((frames.shape[0], 2, 3), dtype=frames.dtype, device=frames.device)
+    theta[:, :, :2] = R.type(frames.dtype)
+    grid = torch.nn.functional.affine_grid(theta, list(frames.shape), align_corners=False)
+    return torch.nn.functional.grid_sample(frames, grid, mode="bilinear", padding_mode="zeros",
+                                           align_corners=False)
+
+def rotate_raster_cv2(img, angle):
+    """
+    CPU version of rotate_rasters for a single (cached) raster
+    Input:
+        img: np.array (H, W, C)
+        angle: degrees (counterclockwise, as rotation_matrices)
+    Output:
+        np.array (H, W, C)
+    """
+    import cv2
+
+    height, width = img.shape[:2]
+    M = cv2.getRotationMatrix2D((width / 2, height / 2), float(angle), 1.0) # Positive -> counterclockwise
+    return cv2.warpAffine(img, M, (width, height))
+
+def to_relative(obs_traj, pred_traj_gt):
+    """
+    Displacements between consecutive steps (0 at the first observation)
+    """
+    obs_traj_rel = torch.zeros_like(obs_traj)
+    obs_traj_rel[1:] = obs_traj[1:] - obs_traj[:-1]
+    pred_traj_gt_rel = pred_traj_gt - torch.cat([obs_traj[-1:], pred_traj_gt[:-1]], dim=0)
+    return obs_traj_rel, pred_traj_gt_rel
+
+class BatchAugmentation():
+    """
+    Swapping, erasing and gaussian noise (per agent, observations only) and rotation (per scene, whole
+    sequence) of a collated batch. *_prob: probability of applying every augmentation to an agent/scene
+    """
+    def __init__(self, swap_prob=0.0, erase_prob=0.0, noise_prob=0.0, rotation_prob=0.0, swap_percentage=0.2,
+                 erase_percentage=0.3, mu=0, sigma=0.5, multi_point=True, rotation_angles=(90,180,270),
+                 seed=None, device="cpu", frames_kind=None):
+        assert frames_kind in FRAMES_KINDS, "Unknown frames kind {}".format(frames_kind)
+        self.swap_prob = swap_prob
+        self.erase_prob = erase_prob
+        self.noise_prob = noise_prob
+        self.rotation_prob = rotation_prob
+        self.swap_percentage = swap_percentage
+        self.erase_percentage = erase_percentage
+        self.mu, self.sigma = mu, sigma
+        self.multi_point = multi_point
+        self.frames_kind = frames_kind
+        self.device = torch.device(device)
+        self.rotation_angles = torch.tensor(rotation_angles, dtype=torch.float, device=self.device)
+
+        self.generator = torch.Generator(device=self.device)
+        if seed is not None:
+            self.generator.manual_seed(seed)
+        else:
+            self.generator.seed()
+
+    def mask(self, n, prob):
+        """
+        Output:
+            torch.tensor (n,) bool, True with probability prob
+        """
+        return torch.rand(n, generator=self.generator, device=self.device) < prob
+
+    def sample_rotations(self, num_scenes):
+        """
+        Output:
+            angles: torch.tensor (num_scenes,) degrees (0 if the scene is not rotated)
+            R: torch.tensor (num_scenes, 2, 2)
+        """
+        choice = torch.randint(len(self.rotation_angles), (num_scenes,), generator=self.generator,
+                               device=self.device)
+        angles = torch.where(self.mask(num_scenes, self.rotation_prob), self.rotation_angles[choice],
+                             torch.zeros(num_scenes, device=self.device))
+        return angles, rotation_matrices(angles)
+
+    def __call__(self, obs_traj, pred_traj_gt, seq_start_end, return_rotations=False):
+        """
+        Input:
+            obs_traj: torch.tensor (obs_len, N, 2)
+            pred_traj_gt: torch.tensor (pred_len, N, 2)
+            seq_start_end: torch.tensor (B, 2)
+        Output:
+            obs_traj, pred_traj_gt, obs_traj_rel, pred_traj_gt_rel (and the (B,) angles and (B,2,2)
+            rotation matrices if return_rotations)
+        """
+        obs_len, num_agents, _ = obs_traj.shape
+
+        if self.swap_prob > 0:
+            obs_traj = swap_points_batch(obs_traj, self.mask(num_agents, self.swap_prob), obs_len,
+                                         self.swap_percentage, self.generator)
+        if self.erase_prob > 0:
+            obs_traj = erase_points_batch(obs_traj, self.mask(num_agents, self.erase_prob), obs_len,
+                                          self.erase_percentage, self.generator)
+        if self.noise_prob > 0:
+            obs_traj = add_gaussian_noise_batch(obs_traj, self.mask(num_agents, self.noise_prob), obs_len,
+                                                self.multi_point, self.mu, self.sigma, self.generator)
+
+        angles, R = self.sample_rotations(len(seq_start_end))
+        if self.rotation_prob > 0:
+            obs_traj = rotate_scenes(obs_traj, R, seq_start_end)
+            pred_traj_gt = rotate_scenes(pred_traj_gt, R, seq_start_end)
+
+        obs_traj_rel, pred_traj_gt_rel = to_relative(obs_traj, pred_traj_gt)
+
+        if return_rotations:
+            return obs_traj, pred_traj_gt, obs_traj_rel, pred_traj_gt_rel, angles, R
+        return obs_traj, pred_traj_gt, obs_traj_rel, pred_traj_gt_rel
+
+    def augment_batch(self, batch):
+        """
+        Augment a collated (and possibly already on the device) batch of the Argoverse seq_collate. If
+        a scene is rotated, its trajectories and its frames (given by frames_kind) are rotated with the
+        same matrix: goal points (B,K,2, map coordinates, rotated around ego_origin), candidate
+        centerlines (B,K,L,2, w.r.t. the origin of the scene) or raster (B,C,H,W). ego_origin is the
+        pivot, so it does not change
+        """
+        (obs_traj, pred_traj_gt, obs_traj_rel, pred_traj_gt_rel, non_linear_obj,
+         loss_mask, seq_start_end, frames, object_cls, obj_id, ego_origin, num_seq, norm) = batch
+
+        obs_traj, pred_traj_gt, obs_traj_rel, pred_traj_gt_rel, angles, R = \
+            self(obs_traj, pred_traj_gt, seq_start_end, return_rotations=True)
+
+        if self.rotation_prob > 0 and self.frames_kind is not None:
+            R = R.to(frames.device)
+            if self.frames_kind == "raster":
+                frames = rotate_rasters(frames, R)
+            elif self.frames_kind == "goal_points":
+                frames = rotate_points(frames, R, ego_origin.to(frames.device))
+            elif self.frames_kind == "centerlines": # Points, the (0,0) padding is kept
+                b, k, l, _ = frames.shape
+                frames = rotate_points(frames.reshape(b, k*l, 2), R).reshape(b, k, l, 2)
+
+        return (obs_traj, pred_traj_gt, obs_traj_rel, pred_traj_gt_rel, non_linear_obj,
+                loss_mask, seq_start_end, frames, object_cls, obj_id, ego_origin, num_seq, norm)
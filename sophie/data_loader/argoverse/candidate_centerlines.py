@@ -0,0 +1,179 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+"""
+Candidate centerlines of the AGENT, extracted offline.
+
+The map-graph search of the Argoverse baseline (lanes around the last observation, DFS over the
+successors/predecessors, remove_overlapping_lane_seq, filter_candidate_centerlines and
+get_centerlines_most_aligned_with_trajectory, all chained by ArgoverseMap.get_candidate_centerlines_for_traj)
+is run once per scene, in parallel. The top-K centerlines (closest to the last observation first) are
+resampled to L points and stored in a compact, fixed-size store:
+
+    <store>/centerlines.npy   float32 (num_scenes, K, L, 2) x, y w.r.t. the origin of the scene (0 padded)
+    <store>/index.npy         int64 (num_scenes, 2): file_id, number of valid centerlines (sorted by file_id)
+
+    python -m sophie.data_loader.argoverse.candidate_centerlines --split train --num_workers 8
+    python -m sophie.data_loader.argoverse.candidate_centerlines --split train --lazy --split_percentage 1.0
+
+--lazy covers the scenes of the lazy mode of the dataset (.csv files) instead of data_processed.
+
+The dataset option centerlines=True serves them as (B,K,L,2) tensors without map queries.
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+from multiprocessing import Pool
+
+import torch
+
+from sophie.data_loader.argoverse.map_utils import get_avm
+from sophie.data_loader.argoverse.lane_features import city_name_from_id, resample_polyline, load_scenes
+
+NUM_CENTERLINES = 6
+CENTERLINE_LENGTH = 40
+
+def polyline_distance(point, polyline):
+    """
+    Minimum distance between a point and the segments of a polyline
+    Input:
+        point: np.array (2,)
+        polyline: np.array (N,2)
+    Output:
+        float
+    """
+    if len(polyline) == 1:
+        return float(np.linalg.norm(polyline[0] - point))
+    a, b = polyline[:-1], polyline[1:]
+    ab = b - a
+    t = np.clip(((point - a) * ab).sum(axis=1) / np.maximum((ab**2).sum(axis=1), 1e-12), 0.0, 1.0)
+    return float(np.linalg.norm(a + t[:, None] * ab - point, axis=1).min())
+
+def extract_candidate_centerlines(agent_obs, city_name, origin, num_centerlines=NUM_CENTERLINES,
+                                  centerline_length=CENTERLINE_LENGTH, max_search_radius=50.0):
+    """
+    Input:
+        agent_obs: np.array (obs_len,2) observed trajectory of the AGENT (map coordinates)
+        city_name: "PIT" or "MIA"
+        origin: (2,) map coordinates of the origin of the scene
+    Output:
+        np.array (num_centerlines,centerline_length,2) float32 w.r.t. the origin (0 padded)
+        number of valid centerlines
+    """
+    avm = get_avm()
+    origin = np.asarray(origin, dtype=np.float64).reshape(2)
+    candidates = avm.get_candidate_centerlines_for_traj(agent_obs, city_name, viz=False,
+                                                        max_search_radius=max_search_radius)
+    candidates = [np.asarray(cl, dtype=np.float64)[:, :2] for cl in candidates if len(cl) > 0]
+    distances = [polyline_distance(agent_obs[-1], cl) for cl in candidates]
+    order = np.argsort(distances, kind="stable")[:num_centerlines]
+
+    centerlines = np.zeros((num_centerlines, centerline_length, 2), dtype=np.float32)
+    for k, i in enumerate(order):
+        centerlines[k] = resample_polyline(candidates[i], centerline_length) - origin
+    return centerlines, len(order)
+
+def _extract_worker(args):
+    row, file_id, agent_obs, city_id, origin, num_centerlines, centerline_length, max_search_radius = args
+    centerlines, num_valid = extract_candidate_centerlines(agent_obs, city_name_from_id(city_id), origin,
+                                                           num_centerlines, centerline_length, max_search_radius)
+    return row, file_id, centerlines, num_valid
+
+def build_centerline_store(store_path, file_ids, agent_obs, origins, city_ids, num_centerlines=NUM_CENTERLINES,
+                           centerline_length=CENTERLINE_LENGTH, max_search_radius=50.0, num_workers=8,
+                           chunksize=16):
+    """
+    Extract the candidate centerlines of every scene in parallel (one ArgoverseMap per worker). Every
+    result is written in its row of the (preallocated) memory-mapped array as it arrives
+    Input:
+        file_ids: (S,) scene ids
+        agent_obs: (S,obs_len,2) observed trajectory of the AGENT (map coordinates)
+        origins: (S,2) map coordinates of the origin of every scene
+        city_ids: (S,) 0 -> PIT, 1 -> MIA
+    """
+    os.makedirs(store_path, exist_ok=True)
+    file_ids = np.asarray(file_ids, dtype=np.int64).reshape(-1)
+    order = np.argsort(file_ids, kind="stable") # rows sorted by file_id
+    num_scenes = len(file_ids)
+
+    centerlines = np.lib.format.open_memmap(os.path.join(store_path, "centerlines.npy.tmp"), mode="w+",
+                                            dtype=np.float32,
+                                            shape=(num_scenes, num_centerlines, centerline_length, 2))
+    index = np.zeros((num_scenes, 2), dtype=np.int64)
+    tasks = [(row, int(file_ids[i]), np.asarray(agent_obs[i], dtype=np.float64), float(city_ids[i]),
+              np.asarray(origins[i], dtype=np.float64).reshape(2), num_centerlines, centerline_length,
+              max_search_radius) for row, i in enumerate(order)]
+
+    t0 = time.time()
+    with Pool(num_workers) as pool:
+        for n, (row, file_id, scene_centerlines, num_valid) in enumerate(
+                pool.imap_unordered(_extract_worker, tasks, chunksize=chunksize)):
+            centerlines[row] = scene_centerlines
+            index[row] = (file_id, num_valid)
+            if n % 1000 == 0:
+                print("Centerlines {}/{} ({:.1f} s)".format(n, num_scenes, time.time() - t0))
+
+    centerlines.flush()
+    del centerlines
+    os.replace(os.path.join(store_path, "centerlines.npy.tmp"), os.path.join(store_path, "centerlines.npy"))
+    np.save(os.path.join(store_path, "index.npy"), index)
+    return index
+
+class CenterlineStore():
+    """
+    Read-only, memory-mapped candidate centerlines (see build_centerline_store)
+    """
+    def __init__(self, store_path):
+        self.index = np.load(os.path.join(store_path, "index.npy"))
+        self.centerlines = np.load(os.path.join(store_path, "centerlines.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.index)
+
+    def rows(self, file_ids):
+        file_ids = np.asarray(file_ids, dtype=np.int64).reshape(-1)
+        rows = np.searchsorted(self.index[:, 0], file_ids)
+        rows = np.minimum(rows, len(self.index) - 1)
+        missing = self.index[rows, 0] != file_ids
+        assert not missing.any(), "Scenes {} not in the centerline store (lazy datasets need a store built " \
+                                  "with --lazy)".format(file_ids[missing])
+        return rows
+
+    def get_batch(self, file_ids):
+        """
+        Output:
+            torch.tensor (B,K,L,2) float32, torch.tensor (B,) number of valid centerlines
+        """
+        rows = self.rows(file_ids)
+        order = np.argsort(rows, kind="stable") # sequential reads of the memory map
+        centerlines = np.empty((len(rows),) + self.centerlines.shape[1:], dtype=np.float32)
+        centerlines[order] = self.centerlines[rows[order]]
+        return torch.from_numpy(centerlines), torch.from_numpy(self.index[rows, 1])
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--root_folder', default="data/datasets/argoverse/motion-forecasting/", type=str)
+parser.add_argument('--split', default="train", type=str)
+parser.add_argument('--store_path', default=None, type=str, help="<root_folder>/<split>/candidate_centerlines by default")
+parser.add_argument('--num_centerlines', default=NUM_CENTERLINES, type=int, help="K")
+parser.add_argument('--centerline_length', default=CENTERLINE_LENGTH, type=int, help="L")
+parser.add_argument('--max_search_radius', default=50.0, type=float)
+parser.add_argument('--num_workers', default=8, type=int)
+parser.add_argument('--obs_origin', default=20, type=int)
+parser.add_argument('--lazy', action='store_true', help="Scenes of the .csv files (lazy dataset) instead of data_processed")
+parser.add_argument('--split_percentage', default=1.0, type=float, help="--lazy: fraction of the files (1.0 covers any selection)")
+parser.add_argument('--start_from_percentage', default=0.0, type=float)
+
+def main(args):
+    file_ids, agent_obs, origins, city_ids = load_scenes(args)
+    store_path = args.store_path or os.path.join(args.root_folder, args.split, "candidate_centerlines")
+    index = build_centerline_store(store_path, file_ids, agent_obs, origins, city_ids,
+                                   num_centerlines=args.num_centerlines, centerline_length=args.centerline_length,
+                                   max_search_radius=args.max_search_radius, num_workers=args.num_workers)
+    print("Candidate centerlines written to {} ({} scenes, {:.2f} centerlines per scene)".format(
+          store_path, len(index), index[:, 1].mean() if len(index) > 0 else 0.0))
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
@@ -32,7 +32,7 @@ from torch.utils.data import Dataset
 from numba import jit
 
 # from argoverse.map_representation.map_api import ArgoverseMap
-# import sophie.data_loader.argoverse.map_utils as map_utils
+import sophie.data_loader.argoverse.map_utils as map_utils
 import sophie.data_loader.argoverse.dataset_utils as dataset_utils
 
 frames_path = None
@@ -133,8 +133,7 @@ def load_images(num_seq, obs_seq_data, city_id, ego_origin, dist_rasterized_map,
                                                             # (required by map_utils)
 
         fig = map_utils.map_generator(
-            curr_obs_seq_data, obs_len, curr_ego_origin, dist_rasterized_map, avm, city_name,
-            object_class_id, show=True, smoothen=True
+            curr_num_seq, curr_ego_origin, dist_rasterized_map, map_utils.get_avm(), city_name
         )
         end = time.time()
         # print(f"Time consumed by map generator: {end-start}")
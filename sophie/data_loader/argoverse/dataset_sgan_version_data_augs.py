@@ -12,7 +12,6 @@ import os
 import math
 import csv
 import time
-from PIL import Image
 import pdb
 import copy
 import glob2
@@ -20,24 +19,20 @@ import glob
 import multiprocessing
 from numpy.random import default_rng
 
-from sklearn import linear_model
-
 import cv2
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
 import numpy as np
 from multiprocessing.dummy import Pool
 
 import torch
 from torch.utils.data import Dataset
 
-from numba import jit
-
-from argoverse.map_representation.map_api import ArgoverseMap
 import sophie.data_loader.argoverse.map_utils as map_utils
 import sophie.data_loader.argoverse.dataset_utils as dataset_utils
+import sophie.data_loader.argoverse.batch_augs as batch_augs
+
+from sophie.utils.utils import relative_to_abs, LazyModule
 
-from sophie.utils.utils import relative_to_abs
+plt = LazyModule("matplotlib.pyplot") # Only imported to render the visual data
 
 data_imgs_folder = None
 visual_data = False
@@ -55,8 +50,18 @@ rotation_prob = [0.5,0.5]
 rotation_angles = [90,180,270]
 rotation_angles_prob = [0.33,0.33,0.34]
 
+batch_augmentation = batch_augs.BatchAugmentation(erase_prob=dropout_prob[1], noise_prob=gaussian_noise_prob[1],
+                                                  erase_percentage=0.3, mu=0, sigma=0.5)
+
+def seed_worker(worker_id):
+    """
+    worker_init_fn of the training DataLoader: the generator of batch_augmentation is created in the
+    parent process, so every forked worker would draw the same augmentation stream. Reseeded from the
+    per-worker seed of torch (base seed + worker_id)
+    """
+    batch_augmentation.generator.manual_seed(torch.initial_seed())
+
 frames_path = None
-avm = ArgoverseMap()
 dist_around = 40
 dist_rasterized_map = [-dist_around, dist_around, -dist_around, dist_around]
 
@@ -259,28 +264,10 @@ def seq_collate(data):
     curr_split = data_imgs_folder.split('/')[-3]
 
     if APPLY_DATA_AUGMENTATION and curr_split == "train":
-        num_obstacles = obs_traj.shape[1]
-        obs_len = obs_traj.shape[0]
-
-        apply_dropout = np.random.choice(decision,num_obstacles,p=dropout_prob)
-        apply_gaussian_noise = np.random.choice(decision,num_obstacles,p=gaussian_noise_prob)
-        apply_rotation = np.random.choice(decision,1,p=rotation_prob) # To the whole sequence
-        if apply_rotation:
-            angle = np.random.choice(rotation_angles,1,p=rotation_angles_prob)
-
-        obs_traj = dataset_utils.erase_points_collate(obs_traj,apply_dropout,num_obs=obs_len,percentage=0.3)
-        obs_traj = dataset_utils.add_gaussian_noise_collate(obs_traj,apply_gaussian_noise,num_obstacles,num_obs=obs_len,mu=0,sigma=0.5)
-
-        # Get new relatives
-
-        obs_traj_rel = torch.zeros((obs_traj.shape))
-
-        for i in range(num_obstacles): # TODO: Do this with a matricial operation
-            _obs_traj = obs_traj[:,i,:]
-            _obs_traj_rel = torch.zeros((_obs_traj.shape))
-            _obs_traj_rel[1:,:] = _obs_traj[1:,:] - _obs_traj[:-1,:]
+        # Erasing and gaussian noise of the observations (per agent), batched (see batch_augs). The
+        # rotation (whole sequence) is not applied here since the rasterized map is not rotated
 
-            obs_traj_rel[:,i,:] = _obs_traj_rel
+        obs_traj, pred_traj_gt, obs_traj_rel, _ = batch_augmentation(obs_traj, pred_traj_gt, seq_start_end)
 
     ## Get physical information (image or goal points. Otherwise, use dummies)
 
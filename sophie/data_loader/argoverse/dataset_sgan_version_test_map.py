@@ -12,7 +12,6 @@ import os
 import math
 import csv
 import time
-from PIL import Image
 import pdb
 import copy
 import glob2
@@ -20,28 +19,27 @@ import glob
 import multiprocessing
 from numpy.random import default_rng
 
-from sklearn import linear_model
-
 import cv2
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
 import numpy as np
 from multiprocessing.dummy import Pool
+from collections import OrderedDict
 
 import torch
 from torch.utils.data import Dataset
 
-from numba import jit
-
-from argoverse.map_representation.map_api import ArgoverseMap
 import sophie.data_loader.argoverse.map_utils as map_utils
 import sophie.data_loader.argoverse.dataset_utils as dataset_utils
 
-from sophie.utils.utils import relative_to_abs
+from sophie.utils.utils import relative_to_abs, LazyModule
+from sophie.utils.instrumentation import get_timer
+
+plt = LazyModule("matplotlib.pyplot") # Only imported to render the visual data
 
 data_imgs_folder = None
 visual_data = False
 goal_points = False
+candidate_centerlines = False # Served from the store of candidate_centerlines.py
+centerlines_folder = None
 
 # Data augmentation variables
 
@@ -51,7 +49,6 @@ dropout_prob = [0.1,0.9]
 rotation_available_angles = [90,180,270]
 
 frames_path = None
-avm = ArgoverseMap()
 dist_around = 40
 dist_rasterized_map = [-dist_around, dist_around, -dist_around, dist_around]
 
@@ -120,7 +117,6 @@ def load_images(num_seq, obs_seq_data, first_obs, city_id, ego_origin, dist_rast
     batch_size = len(object_class_id_list)
     frames_list = []
 
-    # rasterized_start = time.time()
     t0_idx = 0
     for i in range(batch_size):
         
@@ -144,18 +140,13 @@ def load_images(num_seq, obs_seq_data, first_obs, city_id, ego_origin, dist_rast
             city_name = "MIA"
 
         curr_ego_origin = ego_origin[i].reshape(1,-1)
-                                                     
-        start = time.time()
 
         filename = data_imgs_folder + "/" + str(curr_num_seq) + ".png"
 
-        img = map_utils.plot_trajectories(filename, curr_obs_seq_data, curr_first_obs, 
-                                          curr_ego_origin, object_class_id, dist_rasterized_map,
-                                          rot_angle=0,obs_len=obs_len, smoothen=True, show=False)
-
-        end = time.time()
-        # print(f"Time consumed by map generation and render: {end-start}")
-        start = time.time()
+        with get_timer().stage("map_render"):
+            img = map_utils.plot_trajectories(filename, curr_obs_seq_data, curr_first_obs, 
+                                              curr_ego_origin, object_class_id, dist_rasterized_map,
+                                              rot_angle=0,obs_len=obs_len, smoothen=True, show=False)
 
         if debug_images:
             print("frames path: ", frames_path)
@@ -166,13 +157,9 @@ def load_images(num_seq, obs_seq_data, first_obs, city_id, ego_origin, dist_rast
             cv2.imwrite(filename,img)
 
         plt.close("all")
-        end = time.time()
         frames_list.append(img)
         t0_idx = t1_idx
 
-    # rasterized_end = time.time()
-    # print(f"Time consumed by rasterized image: {rasterized_end-rasterized_start}")
-
     frames_arr = np.array(frames_list)
     return frames_arr
 
@@ -219,16 +206,43 @@ def load_goal_points(num_seq, obs_seq_data, first_obs, city_id, ego_origin, dist
 
     return goal_points_array
 
+_centerline_stores = {} # folder -> CenterlineStore (opened once per process)
+
+def load_candidate_centerlines(num_seq):
+    """
+    Candidate centerlines of the AGENT of every scene (no map queries)
+    Output:
+        torch.tensor (batch_size,K,L,2) w.r.t. the origin of every scene (0 padded)
+    """
+    if centerlines_folder not in _centerline_stores:
+        from sophie.data_loader.argoverse.candidate_centerlines import CenterlineStore
+        _centerline_stores[centerlines_folder] = CenterlineStore(centerlines_folder)
+    centerlines, _ = _centerline_stores[centerlines_folder].get_batch(torch.stack(num_seq).numpy())
+    return centerlines
+
+def get_frames_kind():
+    """
+    Content of the frames slot of the batches (batch_augs.FRAMES_KINDS), same order as _seq_collate
+    """
+    if visual_data:
+        return "raster"
+    elif goal_points:
+        return "goal_points"
+    elif candidate_centerlines:
+        return "centerlines"
+    return None
+
 def seq_collate(data):
     """
     This functions takes as input the dataset output (see __getitem__ function below) and transforms it to
     a particular format to feed the Pytorch standard dataloader
     """
 
-    start = time.time()
+    with get_timer().stage("seq_collate"):
+        return _seq_collate(data)
 
-    (obs_traj, pred_traj_gt, obs_traj_rel, pred_traj_gt_rel,
-     non_linear_obj, loss_mask, seq_id_list, object_class_id_list, 
+def _seq_collate(data):
+    (obs_traj, pred_traj_gt, non_linear_obj, loss_mask, seq_timestamps, object_class_id_list, 
      object_id_list, city_id, ego_vehicle_origin, num_seq_list, norm) = zip(*data)
 
     batch_size = len(ego_vehicle_origin) # tuple of tensors
@@ -242,35 +256,39 @@ def seq_collate(data):
 
     obs_traj = torch.cat(obs_traj, dim=0).permute(2, 0, 1) # Past Observations x Num_agents · batch_size x 2
     pred_traj_gt = torch.cat(pred_traj_gt, dim=0).permute(2, 0, 1)
-    obs_traj_rel = torch.cat(obs_traj_rel, dim=0).permute(2, 0, 1)
-    pred_traj_gt_rel = torch.cat(pred_traj_gt_rel, dim=0).permute(2, 0, 1)
-    non_linear_obj = torch.cat(non_linear_obj)
-    loss_mask = torch.cat(loss_mask, dim=0)
-    seq_start_end = torch.LongTensor(seq_start_end)
-    id_frame = torch.cat(seq_id_list, dim=0).permute(2, 0, 1) # seq_len - objs_in_curr_seq - 3
 
-    start = time.time()
+    # Relative displacements between consecutive steps (0 at the first observation)
+
+    obs_traj_rel = torch.zeros_like(obs_traj)
+    obs_traj_rel[1:] = obs_traj[1:] - obs_traj[:-1]
+    pred_traj_gt_rel = pred_traj_gt - torch.cat([obs_traj[-1:], pred_traj_gt[:-1]], dim=0)
+
+    non_linear_obj = torch.cat(non_linear_obj).type(torch.float)
+    loss_mask = torch.cat(loss_mask, dim=0).type(torch.float)
+    seq_start_end = torch.LongTensor(seq_start_end)
 
     first_obs = obs_traj[0,:,:] # 1 x agents · batch_size x 2
 
     if visual_data: # batch_size x channels x height x width
-        frames = load_images(num_seq_list, obs_traj_rel, first_obs, city_id, ego_vehicle_origin,
-                            dist_rasterized_map, object_class_id_list, debug_images=False)
+        with get_timer().stage("load_images"):
+            frames = load_images(num_seq_list, obs_traj_rel, first_obs, city_id, ego_vehicle_origin,
+                                dist_rasterized_map, object_class_id_list, debug_images=False)
         frames = torch.from_numpy(frames).type(torch.float32)
         frames = frames.permute(0, 3, 1, 2)
     elif goal_points: # batch_size x num_goal_points x 2 (x|y) (real-world coordinates (HDmap))
-        frames = load_goal_points(num_seq_list, obs_traj_rel, first_obs, city_id, ego_vehicle_origin,
-                            dist_rasterized_map, object_class_id_list, debug_images=False)
+        with get_timer().stage("load_goal_points"):
+            frames = load_goal_points(num_seq_list, obs_traj_rel, first_obs, city_id, ego_vehicle_origin,
+                                dist_rasterized_map, object_class_id_list, debug_images=False)
         frames = torch.from_numpy(frames).type(torch.float32)
+    elif candidate_centerlines: # batch_size x K x L x 2 (x|y) (w.r.t. the origin of the scene)
+        with get_timer().stage("load_candidate_centerlines"):
+            frames = load_candidate_centerlines(num_seq_list)
     else:
         frames = np.random.randn(1,1,1,1)
         frames = torch.from_numpy(frames).type(torch.float32)
 
-    end = time.time()
-    # print(f"Time consumed by load_images function: {end-start}\n")
-
-    object_cls = torch.cat(object_class_id_list, dim=0)
-    obj_id = torch.cat(object_id_list, dim=0)
+    object_cls = torch.cat(object_class_id_list, dim=0).type(torch.float)
+    obj_id = torch.cat(object_id_list, dim=0).type(torch.float)
     ego_vehicle_origin = torch.stack(ego_vehicle_origin)
     num_seq_list = torch.stack(num_seq_list)
     norm = torch.stack(norm)
@@ -278,9 +296,6 @@ def seq_collate(data):
     out = [obs_traj, pred_traj_gt, obs_traj_rel, pred_traj_gt_rel, non_linear_obj,
            loss_mask, seq_start_end, frames, object_cls, obj_id, ego_vehicle_origin, num_seq_list, norm]
 
-    end = time.time()
-    # print(f"Time consumed by seq_collate function: {end-start}\n")
-
     return tuple(out)
 
 # time 1 csv -> 0.0104s | 200000 csv -> 34m
@@ -522,7 +537,8 @@ class ArgoverseMotionForecastingDataset(Dataset):
     """Dataloder for the Trajectory datasets"""
     def __init__(self, dataset_name, root_folder, obs_len=20, pred_len=30, skip=1, threshold=0.002, distance_threshold=30,
                  min_objs=0, windows_frames=None, split='train', num_agents_per_obs=10, split_percentage=0.1, start_from_percentage=0.0,
-                 shuffle=False, batch_size=16, class_balance=-1.0, obs_origin=1, v_data=False):
+                 shuffle=False, batch_size=16, class_balance=-1.0, obs_origin=1, v_data=False, preprocess=False,
+                 lazy=False, lazy_cache_size=1024, centerlines=False):
         super(ArgoverseMotionForecastingDataset, self).__init__()
 
         self.root_folder = root_folder
@@ -542,40 +558,41 @@ class ArgoverseMotionForecastingDataset(Dataset):
         self.obs_origin = obs_origin
         self.min_ped = 2
         self.cont_seqs = 0
+        self.lazy = lazy
         global visual_data
         visual_data = v_data
+        global candidate_centerlines
+        candidate_centerlines = centerlines
 
-        GENERATE_SEQUENCES = False
+        GENERATE_SEQUENCES = preprocess # Process the .csv files and store them in data_processed
         SAVE_NPY = True
 
-        if GENERATE_SEQUENCES:
-            folder = root_folder + split + "/data/"
-            files, num_files = load_list_from_folder(folder)
-
-            self.file_id_list = []
-            root_file_name = None
-            for file_name in files:
-                if not root_file_name:
-                    root_file_name = os.path.dirname(os.path.abspath(file_name))
-                file_id = int(os.path.normpath(file_name).split('/')[-1].split('.')[0])
-                self.file_id_list.append(file_id)
-            self.file_id_list.sort()
-            print("Num files (whole split): ", num_files)
-
-            if self.shuffle:
-                rng = default_rng()
-                indeces = rng.choice(num_files, size=int(num_files*split_percentage), replace=False)
-                self.file_id_list = np.take(self.file_id_list, indeces, axis=0)
+        if self.lazy:
+            # Lazy mode: only the scene index (file ids) is built here. Every scene is read and windowed
+            # in __getitem__ and the last lazy_cache_size processed scenes are kept in an LRU cache
+            # (per DataLoader worker), so the start-up time and the memory do not depend on the
+            # number of scenes (e.g. split_percentage 1.0)
+
+            self.root_file_name = self.select_files(split_percentage, start_from_percentage)
+            self.num_seq = len(self.file_id_list)
+            self.lazy_cache_size = lazy_cache_size
+            self.scene_cache = OrderedDict() # file_id -> __getitem__ output
+
+            if self.class_balance >= 0.0:
+                print("Class balance is not available in lazy mode (the scenes are not classified in advance)")
+                self.class_balance = -1.0
+
+            # The normalization of the whole split is only known if the split was preprocessed
+
+            filename = root_folder + split + "/data_processed/" + "norm" + ".npy"
+            if os.path.isfile(filename):
+                self.norm = torch.from_numpy(np.load(filename))
             else:
-                start_from = int(start_from_percentage*num_files)
-                n_files = int(split_percentage*num_files)
-                self.file_id_list = self.file_id_list[start_from:start_from+n_files]
+                self.norm = torch.zeros((2,2), dtype=torch.float64)
+            return
 
-                if (start_from + n_files) >= num_files:
-                    self.file_id_list = self.file_id_list[start_from:]
-                else:
-                    self.file_id_list = self.file_id_list[start_from:start_from+n_files]
-            print("Num files to be analized: ", len(self.file_id_list))
+        if GENERATE_SEQUENCES:
+            root_file_name = self.select_files(split_percentage, start_from_percentage)
 
             num_objs_in_seq = []
             seq_list = []
@@ -604,21 +621,10 @@ class ArgoverseMotionForecastingDataset(Dataset):
                 t1 = time.time()
                 print(f"File {file_id} -> {i}/{len(self.file_id_list)}")
                 num_seq_list.append(file_id)
-                path = os.path.join(root_file_name,str(file_id)+".csv")
-                data = read_file(path) 
-            
-                frames = np.unique(data[:, 0]).tolist() 
-                frame_data = []
-                for frame in frames:
-                    frame_data.append(data[frame == data[:, 0], :]) # save info for each frame
-
-                num_sequences = int(math.ceil((len(frames) - self.seq_len + 1) / skip))
-                idx = 0
 
                 num_objs_considered, _non_linear_obj, curr_loss_mask, curr_seq, \
                 curr_seq_rel, id_frame_list, object_class_list, city_id, ego_origin = \
-                    process_window_sequence(idx, frame_data, frames, \
-                                            self.seq_len, self.pred_len, threshold, file_id, self.split, self.obs_origin)
+                    self.process_file(root_file_name, file_id)
 
                 # Check if the trajectory is a straight line or has a curve
 
@@ -724,19 +730,17 @@ class ArgoverseMotionForecastingDataset(Dataset):
                 filename = root_folder + split + "/data_processed/" + "city_id" + ".npy"
                 with open(filename, 'wb') as my_file: np.save(my_file, self.city_ids)
 
-                assert 1 == 0
-
         else:
             print("Loading .npy files ...")
 
-            filename = root_folder + split + "/data_processed/" + "seq_list" + ".npy"
-            with open(filename, 'rb') as my_file: seq_list = np.load(my_file)
+            # The big arrays are memory-mapped: only the compact copies below become resident.
+            # seq_list_rel is not loaded (the relative displacements are derived in seq_collate)
 
-            filename = root_folder + split + "/data_processed/" + "seq_list_rel" + ".npy"
-            with open(filename, 'rb') as my_file: seq_list_rel = np.load(my_file)
+            filename = root_folder + split + "/data_processed/" + "seq_list" + ".npy"
+            seq_list = np.load(filename, mmap_mode='r')
 
             filename = root_folder + split + "/data_processed/" + "loss_mask_list" + ".npy"
-            with open(filename, 'rb') as my_file: loss_mask_list = np.load(my_file)
+            loss_mask_list = np.load(filename, mmap_mode='r')
 
             filename = root_folder + split + "/data_processed/" + "non_linear_obj" + ".npy"
             with open(filename, 'rb') as my_file: non_linear_obj = np.load(my_file)
@@ -745,7 +749,7 @@ class ArgoverseMotionForecastingDataset(Dataset):
             with open(filename, 'rb') as my_file: num_objs_in_seq = np.load(my_file)
 
             filename = root_folder + split + "/data_processed/" + "seq_id_list" + ".npy"
-            with open(filename, 'rb') as my_file: seq_id_list = np.load(my_file)
+            seq_id_list = np.load(filename, mmap_mode='r')
 
             filename = root_folder + split + "/data_processed/" + "object_class_id_list" + ".npy"
             with open(filename, 'rb') as my_file: object_class_id_list = np.load(my_file)
@@ -772,31 +776,142 @@ class ArgoverseMotionForecastingDataset(Dataset):
             filename = root_folder + split + "/data_processed/" + "city_id" + ".npy"
             with open(filename, 'rb') as my_file: self.city_ids = np.load(my_file)
 
-        ## Create torch data
-
-        self.obs_traj = torch.from_numpy(seq_list[:, :, :self.obs_len]).type(torch.float)
-        self.pred_traj_gt = torch.from_numpy(seq_list[:, :, self.obs_len:]).type(torch.float)
-        self.obs_traj_rel = torch.from_numpy(seq_list_rel[:, :, :self.obs_len]).type(torch.float)
-        self.pred_traj_gt_rel = torch.from_numpy(seq_list_rel[:, :, self.obs_len:]).type(torch.float)
-        self.loss_mask = torch.from_numpy(loss_mask_list).type(torch.float)
-        self.non_linear_obj = torch.from_numpy(non_linear_obj).type(torch.float)
-        cum_start_idx = [0] + np.cumsum(num_objs_in_seq).tolist()
-        self.seq_start_end = [(start, end) for start, end in zip(cum_start_idx, cum_start_idx[1:])]
-        self.seq_id_list = torch.from_numpy(seq_id_list).type(torch.float)
-        self.object_class_id_list = torch.from_numpy(object_class_id_list).type(torch.float)
-        self.object_id_list = torch.from_numpy(object_id_list).type(torch.float)
-        self.ego_vehicle_origin = torch.from_numpy(ego_vehicle_origin).type(torch.float)
+        ## Create torch data (compact layout)
+        #   - One float32 absolute trajectory tensor (objects x 2 x seq_len). obs_traj/pred_traj_gt are
+        #     views of it and the relative displacements are derived in seq_collate
+        #   - loss_mask (bool), non_linear_obj and object classes (int8), object ids (int32)
+        #   - seq_id_list (timestamp, id, file_id per object and step) is replaced by a per-sequence
+        #     record: the timestamps of the sequence (all the stored objects are observed in every
+        #     frame), file_id = num_seq_list and id = object_id_list
+
+        # NB: All the state lives in a few contiguous numpy arrays / tensors (no per-sequence Python
+        # objects), so the DataLoader workers (fork) only read the pages inherited from the parent
+        # process: __getitem__ does integer slicing, there are no refcount updates that dirty
+        # (and copy) the shared pages and the RSS of the workers does not grow with the dataset
+
+        cum_start_idx = np.concatenate([[0], np.cumsum(num_objs_in_seq)]).astype(np.int64)
+        self.seq_start_end = np.ascontiguousarray(np.stack([cum_start_idx[:-1], cum_start_idx[1:]], axis=1)) # num_seq x 2
+        self.city_ids = np.ascontiguousarray(np.asarray(self.city_ids, dtype=np.float32).reshape(-1))
+
+        self.traj = torch.from_numpy(np.asarray(seq_list, dtype=np.float32))
+        self.obs_traj = self.traj[:, :, :self.obs_len]
+        self.pred_traj_gt = self.traj[:, :, self.obs_len:]
+        self.loss_mask = torch.from_numpy(np.asarray(loss_mask_list) > 0)
+        self.non_linear_obj = torch.from_numpy(np.asarray(non_linear_obj, dtype=np.int8))
+        self.seq_timestamps = torch.from_numpy(np.asarray(seq_id_list[cum_start_idx[:-1], 0, :], dtype=np.float64))
+        self.object_class_id_list = torch.from_numpy(np.asarray(object_class_id_list, dtype=np.int8))
+        self.object_id_list = torch.from_numpy(np.asarray(object_id_list, dtype=np.int32))
+        self.ego_vehicle_origin = torch.from_numpy(np.ascontiguousarray(ego_vehicle_origin, dtype=np.float32))
         self.num_seq_list = torch.from_numpy(num_seq_list).type(torch.int)
         self.straight_trajectories_list = torch.from_numpy(straight_trajectories_list).type(torch.int)
         self.curved_trajectories_list = torch.from_numpy(curved_trajectories_list).type(torch.int)
         self.norm = torch.from_numpy(np.array(norm))
-        
+
+    def select_files(self, split_percentage, start_from_percentage):
+        """
+        Select the scenes (self.file_id_list) of the split
+        Output:
+            root_file_name: folder of the .csv files
+        """
+        folder = self.root_folder + self.split + "/data/"
+        files, num_files = load_list_from_folder(folder)
+
+        self.file_id_list = []
+        root_file_name = None
+        for file_name in files:
+            if not root_file_name:
+                root_file_name = os.path.dirname(os.path.abspath(file_name))
+            file_id = int(os.path.normpath(file_name).split('/')[-1].split('.')[0])
+            self.file_id_list.append(file_id)
+        self.file_id_list.sort()
+        print("Num files (whole split): ", num_files)
+
+        if self.shuffle:
+            rng = default_rng()
+            indeces = rng.choice(num_files, size=int(num_files*split_percentage), replace=False)
+            self.file_id_list = np.take(self.file_id_list, indeces, axis=0)
+        else:
+            start_from = int(start_from_percentage*num_files)
+            n_files = int(split_percentage*num_files)
+            self.file_id_list = self.file_id_list[start_from:start_from+n_files]
+
+            if (start_from + n_files) >= num_files:
+                self.file_id_list = self.file_id_list[start_from:]
+            else:
+                self.file_id_list = self.file_id_list[start_from:start_from+n_files]
+        self.file_id_list = np.asarray(self.file_id_list, dtype=np.int64)
+        print("Num files to be analized: ", len(self.file_id_list))
+
+        return root_file_name
+
+    def process_file(self, root_file_name, file_id):
+        """
+        Read and window a single scene (.csv file)
+        Output:
+            process_window_sequence output
+        """
+        path = os.path.join(root_file_name,str(file_id)+".csv")
+        data = read_file(path) 
+
+        frames = np.unique(data[:, 0]).tolist() 
+        frame_data = []
+        for frame in frames:
+            frame_data.append(data[frame == data[:, 0], :]) # save info for each frame
+
+        idx = 0
+        return process_window_sequence(idx, frame_data, frames, self.seq_len, self.pred_len,
+                                       self.threshold, file_id, self.split, self.obs_origin)
+
+    def get_scene(self, index):
+        """
+        Lazy mode: __getitem__ output of the index-th scene, from the LRU cache or processed on demand.
+        If the scene has less than min_ped complete objects, the next one is taken
+        """
+        for offset in range(self.num_seq):
+            file_id = int(self.file_id_list[(index + offset) % self.num_seq])
+            if file_id in self.scene_cache:
+                self.scene_cache.move_to_end(file_id)
+                return self.scene_cache[file_id]
+
+            num_objs_considered, _non_linear_obj, curr_loss_mask, curr_seq, \
+            curr_seq_rel, id_frame_list, object_class_list, city_id, ego_origin = \
+                self.process_file(self.root_file_name, file_id)
+            if num_objs_considered < self.min_ped:
+                continue
+
+            n = num_objs_considered
+            traj = torch.from_numpy(curr_seq[:n].astype(np.float32))
+            out = [
+                    traj[:, :, :self.obs_len], traj[:, :, self.obs_len:],
+                    torch.from_numpy(np.asarray(_non_linear_obj, dtype=np.int8)),
+                    torch.from_numpy(curr_loss_mask[:n] > 0),
+                    torch.from_numpy(id_frame_list[0, 0, :].copy()),
+                    torch.from_numpy(object_class_list[:n].astype(np.int8)),
+                    torch.from_numpy(id_frame_list[:n, 1, 0].astype(np.int32)),
+                    np.float32(city_id),
+                    torch.from_numpy(np.asarray(ego_origin, dtype=np.float32)),
+                    torch.tensor(file_id, dtype=torch.int),
+                    self.norm
+                  ]
+
+            self.scene_cache[file_id] = out
+            while len(self.scene_cache) > self.lazy_cache_size:
+                self.scene_cache.popitem(last=False)
+            return out
+
+        raise RuntimeError("No scene with at least {} complete objects in {}".format(self.min_ped, self.split))
+
     def __len__(self):
         return self.num_seq
 
     def __getitem__(self, index):
         global data_imgs_folder
         data_imgs_folder = self.root_folder + self.split + "/data_images/"
+        global centerlines_folder
+        centerlines_folder = self.root_folder + self.split + "/candidate_centerlines/"
+        if self.lazy:
+            return self.get_scene(index)
+
         if self.class_balance >= 0.0:
             if self.cont_seqs % self.batch_size == 0: # Get a new batch
                 self.cont_straight_traj = []
@@ -823,12 +938,11 @@ class ArgoverseMotionForecastingDataset(Dataset):
             else:
                 self.cont_curved_traj.append(index)
 
-        start, end = self.seq_start_end[index]
+        start, end = int(self.seq_start_end[index, 0]), int(self.seq_start_end[index, 1])
         out = [
                 self.obs_traj[start:end, :, :], self.pred_traj_gt[start:end, :, :],
-                self.obs_traj_rel[start:end, :, :], self.pred_traj_gt_rel[start:end, :, :],
                 self.non_linear_obj[start:end], self.loss_mask[start:end, :],
-                self.seq_id_list[start:end, :, :], self.object_class_id_list[start:end], 
+                self.seq_timestamps[index], self.object_class_id_list[start:end], 
                 self.object_id_list[start:end], self.city_ids[index], self.ego_vehicle_origin[index,:,:],
                 self.num_seq_list[index], self.norm
               ] 
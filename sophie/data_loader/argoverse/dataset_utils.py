@@ -10,15 +10,18 @@ import numpy as np
 import pdb
 import cv2
 from numpy.random import default_rng
-from sklearn import linear_model
 import math
 import random
 import pdb
-import matplotlib.pyplot as plt 
-from matplotlib.patches import Circle
 from random import sample
 import copy
 import torch
+from functools import lru_cache
+
+from sophie.utils.utils import LazyModule
+
+plt = LazyModule("matplotlib.pyplot") # Imported on first use (debug plots)
+linear_model = LazyModule("sklearn.linear_model")
 
 def dot(v,w):
     x,y,z = v
@@ -755,4 +758,35 @@ def get_goal_points(filename, obs_seq, origin_pos, real_world_offset, NUM_GOAL_P
     final_samples_px = np.hstack((final_samples_y.reshape(-1,1), final_samples_x.reshape(-1,1))) # rows, columns
     rw_points = transform_px2real_world(final_samples_px, origin_pos, real_world_offset, img_size)
     # pdb.set_trace()
-    return rw_points
\ No newline at end of file
+    return rw_points
+
+# Drivable area masks (feasible area metric)
+
+@lru_cache(maxsize=256)
+def _packed_drivable_mask(filename, img_size):
+    """
+    Bit-packed drivable mask (img_size^2 / 8 bytes, 45 KB for 600x600), so the cache of every process
+    (DataLoader workers, validation loop) stays around 11 MB
+    """
+    img_map = cv2.imread(filename)
+    assert img_map is not None, "Image {} could not be read".format(filename)
+    img_map = cv2.resize(img_map, dsize=(img_size,img_size))
+    img_map_gray = cv2.cvtColor(img_map,cv2.COLOR_BGR2GRAY)
+    return np.packbits(img_map_gray == 255)
+
+def get_drivable_mask(filename, img_size=600):
+    """
+    Binary drivable mask of a rasterized map (white pixels), cached (read and resized once per file)
+    Output:
+        np.array (img_size, img_size) bool
+    """
+    packed = _packed_drivable_mask(filename, img_size)
+    return np.unpackbits(packed, count=img_size*img_size).reshape(img_size, img_size).astype(bool)
+
+def get_drivable_masks(filenames, img_size=600):
+    """
+    Output:
+        np.array (len(filenames), img_size, img_size) bool
+    """
+    return np.stack([get_drivable_mask(filename, img_size) for filename in filenames], axis=0)
+
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+"""
+Lane graph features (vectorized map) for mp_mmtrans.
+
+The lanes around the origin of every scene are extracted from the ArgoverseMap once (offline),
+resampled to LANE_POINTS points and stored in a memory-mapped lane store:
+
+    <store>/lanes.bin   float32 (total_lanes, LANE_POINTS, 5): x, y (w.r.t. the origin of the scene),
+                        has_traffic_control, turn_direction (-1 left, 0 none, 1 right), is_intersection
+    <store>/index.npy   int64 (num_scenes, 3): file_id, first lane, number of lanes (sorted by file_id)
+
+    python -m sophie.data_loader.argoverse.lane_features --root_folder data/datasets/argoverse/motion-forecasting/ \
+                                                         --split train --num_workers 8
+
+The scenes are those of data_processed (preprocessed split) or, with --lazy, every .csv file of the
+split, as picked by the lazy mode of the dataset (select_files/get_scene).
+
+The training data loader only reads (page cache) the lanes of each scene: LaneGraphDataset wraps the
+Argoverse dataset and seq_collate_mmtrans pads agents and lanes into the mmTrans inputs
+(HISTORY, POS, LANE, VALID_LEN).
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+from multiprocessing import Pool
+
+import torch
+from torch.utils.data import Dataset
+
+from sophie.data_loader.argoverse.map_utils import get_avm
+
+LANE_POINTS = 10
+LANE_CHANNELS = 5
+TURN_DIRECTION = {"LEFT": -1.0, "NONE": 0.0, "RIGHT": 1.0}
+
+def city_name_from_id(city_id):
+    return "PIT" if round(float(city_id)) == 0 else "MIA"
+
+def resample_polyline(polyline, num_points):
+    """
+    Resample a polyline to num_points points equally spaced along its arc length
+    Input:
+        polyline: np.array (N,D)
+    Output:
+        np.array (num_points,D)
+    """
+    polyline = np.asarray(polyline, dtype=np.float64)
+    if len(polyline) == 1:
+        return np.repeat(polyline, num_points, axis=0)
+    arc = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(polyline, axis=0), axis=1))])
+    if arc[-1] == 0.0:
+        return np.repeat(polyline[:1], num_points, axis=0)
+    samples = np.linspace(0.0, arc[-1], num_points)
+    return np.stack([np.interp(samples, arc, polyline[:, d]) for d in range(polyline.shape[1])], axis=1)
+
+def extract_scene_lanes(city_name, origin, radius=50.0, max_lanes=64, num_points=LANE_POINTS):
+    """
+    Lanes (closest first) whose centerline is within the manhattan radius of the origin
+    Input:
+        city_name: "PIT" or "MIA"
+        origin: (2,) map coordinates of the origin of the scene
+    Output:
+        np.array (num_lanes,num_points,5) float32, coordinates w.r.t. the origin
+    """
+    avm = get_avm()
+    origin = np.asarray(origin, dtype=np.float64).reshape(2)
+    lane_ids = avm.get_lane_ids_in_xy_bbox(origin[0], origin[1], city_name, query_search_range_manhattan=radius)
+
+    lanes, distances = [], []
+    for lane_id in lane_ids:
+        centerline = resample_polyline(avm.get_lane_segment_centerline(lane_id, city_name)[:, :2], num_points)
+        centerline = centerline - origin
+        lane = np.zeros((num_points, LANE_CHANNELS), dtype=np.float32)
+        lane[:, :2] = centerline
+        lane[:, 2] = float(avm.lane_has_traffic_control_measure(lane_id, city_name))
+        lane[:, 3] = TURN_DIRECTION.get(avm.get_lane_turn_direction(lane_id, city_name), 0.0)
+        lane[:, 4] = float(avm.lane_is_in_intersection(lane_id, city_name))
+        lanes.append(lane)
+        distances.append(np.linalg.norm(centerline, axis=1).min())
+
+    if len(lanes) == 0:
+        return np.zeros((0, num_points, LANE_CHANNELS), dtype=np.float32)
+    order = np.argsort(distances, kind="stable")[:max_lanes]
+    return np.stack(lanes, axis=0)[order]
+
+def _extract_worker(args):
+    file_id, city_id, origin, radius, max_lanes = args
+    return file_id, extract_scene_lanes(city_name_from_id(city_id), origin, radius, max_lanes)
+
+def build_lane_store(store_path, file_ids, origins, city_ids, radius=50.0, max_lanes=64, num_workers=8,
+                     chunksize=16):
+    """
+    Extract the lanes of every scene in parallel (one ArgoverseMap per worker) and write the lane store.
+    The lanes are appended to lanes.bin as they arrive, so the memory does not grow with the split
+    Input:
+        file_ids: (S,) scene ids
+        origins: (S,2) map coordinates of the origin of every scene (ego_vehicle_origin)
+        city_ids: (S,) 0 -> PIT, 1 -> MIA
+    """
+    os.makedirs(store_path, exist_ok=True)
+    tasks = [(int(file_id), float(city_id), np.asarray(origin, dtype=np.float64).reshape(2), radius, max_lanes)
+             for file_id, city_id, origin in zip(file_ids, city_ids, origins)]
+
+    index = []
+    offset = 0
+    t0 = time.time()
+    tmp_path = os.path.join(store_path, "lanes.bin.tmp")
+    with open(tmp_path, "wb") as lanes_file, Pool(num_workers) as pool:
+        for i, (file_id, lanes) in enumerate(pool.imap(_extract_worker, tasks, chunksize=chunksize)):
+            lanes.astype(np.float32).tofile(lanes_file)
+            index.append((file_id, offset, len(lanes)))
+            offset += len(lanes)
+            if i % 1000 == 0:
+                print("Lanes {}/{} ({:.1f} s)".format(i, len(tasks), time.time() - t0))
+
+    index = np.array(index, dtype=np.int64).reshape(-1, 3)
+    index = index[np.argsort(index[:, 0], kind="stable")]
+    os.replace(tmp_path, os.path.join(store_path, "lanes.bin"))
+    np.save(os.path.join(store_path, "index.npy"), index)
+    return index
+
+_scan_dataset = None
+
+def _init_scan_worker(dataset):
+    global _scan_dataset
+    _scan_dataset = dataset
+
+def _scan_worker(file_id):
+    dataset = _scan_dataset
+    num_objs, _, _, seq, _, _, object_class, city_id, ego_origin = dataset.process_file(dataset.root_file_name,
+                                                                                         file_id)
+    agent = np.where(np.asarray(object_class[:num_objs]) == 1)[0]
+    if num_objs < dataset.min_ped or len(agent) == 0: # Never served by get_scene
+        return file_id, None
+    origin = np.asarray(ego_origin, dtype=np.float64).reshape(2)
+    agent_obs = seq[agent[0], :, :dataset.obs_len].T + origin # obs_len x 2 (map coordinates)
+    return file_id, (agent_obs, origin, float(city_id))
+
+def scan_lazy_scenes(dataset, num_workers=8, chunksize=16):
+    """
+    Scenes of a lazy dataset (every file of dataset.file_id_list, read and windowed as get_scene does)
+    Output:
+        file_ids (S,), agent_obs (S,obs_len,2) observed trajectory of the AGENT (map coordinates),
+        origins (S,2), city_ids (S,)
+    """
+    file_ids, agent_obs, origins, city_ids = [], [], [], []
+    t0 = time.time()
+    with Pool(num_workers, initializer=_init_scan_worker, initargs=(dataset,)) as pool:
+        for i, (file_id, scene) in enumerate(pool.imap(_scan_worker, dataset.file_id_list, chunksize=chunksize)):
+            if i % 1000 == 0:
+                print("Scenes {}/{} ({:.1f} s)".format(i, len(dataset.file_id_list), time.time() - t0))
+            if scene is None:
+                continue
+            file_ids.append(int(file_id))
+            agent_obs.append(scene[0])
+            origins.append(scene[1])
+            city_ids.append(scene[2])
+    return (np.asarray(file_ids, dtype=np.int64), np.asarray(agent_obs).reshape(-1, dataset.obs_len, 2),
+            np.asarray(origins).reshape(-1, 2), np.asarray(city_ids))
+
+class LaneStore():
+    """
+    Read-only, memory-mapped lane store (see build_lane_store). The arrays are shared by the DataLoader
+    workers (no per-scene Python objects)
+    """
+    def __init__(self, store_path, num_points=LANE_POINTS):
+        self.index = np.load(os.path.join(store_path, "index.npy"))
+        total_lanes = int((self.index[:, 1] + self.index[:, 2]).max()) if len(self.index) > 0 else 0
+        self.lanes = np.memmap(os.path.join(store_path, "lanes.bin"), dtype=np.float32, mode="r",
+                               shape=(total_lanes, num_points, LANE_CHANNELS))
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, file_id):
+        """
+        Output:
+            np.array (num_lanes,LANE_POINTS,5) float32 (view of the memory map)
+        """
+        row = np.searchsorted(self.index[:, 0], file_id)
+        assert row < len(self.index) and self.index[row, 0] == file_id, "Scene {} not in the lane store".format(file_id)
+        _, offset, num_lanes = self.index[row]
+        return self.lanes[offset:offset+num_lanes]
+
+class LaneGraphDataset(Dataset):
+    """
+    Argoverse dataset (dataset_sgan_version_test_map) + lanes of every scene from the lane store
+    """
+    def __init__(self, dataset, store_path, max_lanes=None):
+        self.dataset = dataset
+        self.store_path = store_path
+        self.max_lanes = max_lanes
+        self.store = LaneStore(store_path)
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        item = self.dataset[index]
+        file_id = int(item[-2]) # num_seq_list
+        lanes = self.store.get(file_id)
+        if self.max_lanes is not None:
+            lanes = lanes[:self.max_lanes]
+        return item, torch.from_numpy(np.array(lanes))
+
+def valid_mask(valid_len, max_len):
+    """
+    Input:
+        valid_len: torch.tensor (B,)
+    Output:
+        torch.tensor (B,max_len) bool, True for the first valid_len[b] elements
+    """
+    return torch.arange(int(max_len), device=valid_len.device)[None, :] < valid_len[:, None]
+
+def _pad_batch(tensors, max_len):
+    """
+    List of B tensors (n_b,...) -> (B,max_len,...) zero padded
+    """
+    out = tensors[0].new_zeros((len(tensors), max_len) + tuple(tensors[0].shape[1:]))
+    for i, tensor in enumerate(tensors):
+        out[i, :len(tensor)] = tensor
+    return out
+
+def seq_collate_mmtrans(data):
+    """
+    Collate function of LaneGraphDataset, inputs of mmTrans:
+        HISTORY: [batch size, max_agent_num, obs_len-1, 4] vectorized past trajectories (segment start
+                 x|y, segment end x|y), the AGENT (object of interest) first
+        POS: [batch size, max_agent_num, 2] last observed position
+        LANE: [batch size, max_lane_num, 10, 5]
+        VALID_LEN: [batch size, 2] (number of valid agents & valid lanes)
+        AGENT_MASK, LANE_MASK: [batch size, max_agent_num], [batch size, max_lane_num] bool
+        FUTURE: [batch size, max_agent_num, pred_len, 2]
+        ORIGIN: [batch size, 2], CITY: [batch size], SEQ: [batch size] (file id)
+    """
+    items, lanes = zip(*data)
+    (obs_traj, pred_traj_gt, non_linear_obj, loss_mask, seq_timestamps, object_class_id_list,
+     object_id_list, city_id, ego_vehicle_origin, num_seq_list, norm) = zip(*items)
+
+    histories, positions, futures = [], [], []
+    for obs, pred, object_class in zip(obs_traj, pred_traj_gt, object_class_id_list):
+        order = torch.cat([torch.where(object_class == 1)[0], torch.where(object_class != 1)[0]]) # AGENT first
+        obs = obs[order].permute(0, 2, 1) # agents x obs_len x 2
+        histories.append(torch.cat([obs[:, :-1], obs[:, 1:]], dim=-1))
+        positions.append(obs[:, -1])
+        futures.append(pred[order].permute(0, 2, 1))
+
+    num_agents = torch.tensor([len(h) for h in histories], dtype=torch.long)
+    num_lanes = torch.tensor([len(l) for l in lanes], dtype=torch.long)
+    max_agents, max_lanes = int(num_agents.max()), int(num_lanes.max())
+
+    return {
+        "HISTORY": _pad_batch(histories, max_agents),
+        "POS": _pad_batch(positions, max_agents),
+        "LANE": _pad_batch(lanes, max_lanes),
+        "VALID_LEN": torch.stack([num_agents, num_lanes], dim=1),
+        "AGENT_MASK": valid_mask(num_agents, max_agents),
+        "LANE_MASK": valid_mask(num_lanes, max_lanes),
+        "FUTURE": _pad_batch(futures, max_agents),
+        "ORIGIN": torch.stack(ego_vehicle_origin).reshape(-1, 2),
+        "CITY": torch.tensor(np.asarray(city_id, dtype=np.float32)),
+        "SEQ": torch.stack(num_seq_list)
+    }
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--root_folder', default="data/datasets/argoverse/motion-forecasting/", type=str)
+parser.add_argument('--split', default="train", type=str)
+parser.add_argument('--store_path', default=None, type=str, help="<root_folder>/<split>/lane_store by default")
+parser.add_argument('--radius', default=50.0, type=float, help="Manhattan radius (m) around the origin")
+parser.add_argument('--max_lanes', default=64, type=int)
+parser.add_argument('--num_workers', default=8, type=int)
+parser.add_argument('--obs_origin', default=20, type=int)
+parser.add_argument('--lazy', action='store_true', help="Scenes of the .csv files (lazy dataset) instead of data_processed")
+parser.add_argument('--split_percentage', default=1.0, type=float, help="--lazy: fraction of the files (1.0 covers any selection)")
+parser.add_argument('--start_from_percentage', default=0.0, type=float)
+
+def load_scenes(args):
+    """
+    Scene ids, observed trajectory of the AGENT (map coordinates), origins and cities of the split:
+    preprocessed (data_processed) or, with args.lazy, the scenes of the lazy dataset
+    """
+    from sophie.data_loader.argoverse.dataset_sgan_version_test_map import ArgoverseMotionForecastingDataset
+
+    if args.lazy:
+        dataset = ArgoverseMotionForecastingDataset(dataset_name="argoverse_motion_forecasting_dataset",
+                                                    root_folder=args.root_folder, split=args.split,
+                                                    obs_origin=args.obs_origin, lazy=True,
+                                                    split_percentage=args.split_percentage,
+                                                    start_from_percentage=args.start_from_percentage)
+        return scan_lazy_scenes(dataset, num_workers=args.num_workers)
+
+    dataset = ArgoverseMotionForecastingDataset(dataset_name="argoverse_motion_forecasting_dataset",
+                                                root_folder=args.root_folder, split=args.split,
+                                                obs_origin=args.obs_origin, preprocess=False)
+    origins = dataset.ego_vehicle_origin.numpy().reshape(-1, 2)
+    agent_rows = np.array([start + int(np.where(dataset.object_class_id_list[start:end].numpy() == 1)[0][0])
+                           for start, end in dataset.seq_start_end])
+    agent_obs = dataset.obs_traj[agent_rows].numpy().transpose(0, 2, 1) + origins[:, None, :] # S x obs_len x 2
+    return dataset.num_seq_list.numpy(), agent_obs, origins, np.asarray(dataset.city_ids)
+
+def main(args):
+    file_ids, _, origins, city_ids = load_scenes(args)
+    store_path = args.store_path or os.path.join(args.root_folder, args.split, "lane_store")
+    index = build_lane_store(store_path, file_ids, origins, city_ids,
+                             radius=args.radius, max_lanes=args.max_lanes, num_workers=args.num_workers)
+    print("Lane store written to {} ({} scenes, {} lanes)".format(store_path, len(index), int(index[:, 2].sum())))
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
@@ -9,44 +9,35 @@ Created on Mon Feb 7 12:33:19 2022
 import torch
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-from shapely.geometry import Polygon, MultiPolygon, Point
 import copy
 import logging
 import sys
 import time
 import pdb
 import os
-
-import PIL.ImageDraw as ImageDraw
-import PIL.Image as Image
 import math
 
 from collections import defaultdict
+from functools import lru_cache
 from typing import Any, Dict, List, Optional, Tuple, Union
 
-import matplotlib.lines as mlines
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
-import scipy.interpolate as interp
-
-from argoverse.utils.centerline_utils import (
-    centerline_to_polygon,
-    filter_candidate_centerlines,
-    get_centerlines_most_aligned_with_trajectory,
-    lane_waypt_to_query_dist,
-    remove_overlapping_lane_seq,
-)
-
-from argoverse.map_representation.map_api import ArgoverseMap
-from argoverse.utils.mpl_plotting_utils import plot_bbox_2D
-from argoverse.utils.se3 import SE3
-from argoverse.utils.transform import quat2rotmat
-
-from sophie.utils.utils import relative_to_abs
+from sophie.utils.utils import relative_to_abs, LazyModule
 import sophie.data_loader.argoverse.dataset_utils as dataset_utils
 
+# Plotting and geometry libraries are imported on first use (not needed to train without visual data)
+
+plt = LazyModule("matplotlib.pyplot")
+interp = LazyModule("scipy.interpolate")
+centerline_utils = LazyModule("argoverse.utils.centerline_utils")
+
+@lru_cache(maxsize=1)
+def get_avm():
+    """
+    ArgoverseMap (vector maps of both cities) of the current process, loaded on first use
+    """
+    from argoverse.map_representation.map_api import ArgoverseMap
+    return ArgoverseMap()
+
 IS_OCCLUDED_FLAG = 100
 LANE_TANGENT_VECTOR_SCALING = 4
 plot_lane_tangent_arrows = True
@@ -121,7 +112,7 @@ def map_generator(curr_num_seq,
                   avm,
                   city_name,
                   show: bool = False,
-                  root_folder = "data/datasets/argoverse/motion-forecasting/train/data_images") -> None:
+                  root_folder = "data/datasets/argoverse/motion-forecasting/train/data_images"):
     """
     """
 
@@ -202,7 +193,7 @@ def map_generator(curr_num_seq,
     t0 = time.time()
 
     for lane_cl in lane_centerlines:
-        lane_polygon = centerline_to_polygon(lane_cl[:, :2])
+        lane_polygon = centerline_utils.centerline_to_polygon(lane_cl[:, :2])
                                                                           #"black"  
         ax.fill(lane_polygon[:, 0], lane_polygon[:, 1], "white", edgecolor='white', fill=True)
                                                         #"grey"
@@ -231,6 +222,7 @@ def map_generator(curr_num_seq,
 
     plt.savefig(filename, bbox_inches='tight', facecolor=fig.get_facecolor(), 
                 edgecolor='none', pad_inches=0)
+    return fig
 
 # Plot trajectories for data augmentation testing
 
@@ -7,6 +7,8 @@ import cv2
 import torch
 from torch.utils.data.dataset import Dataset
 
+from sophie.data_loader.windowing import sliding_windows, poly_fit_batch
+
 def seq_collate(data):
     (obs_seq_list, pred_seq_list, obs_seq_rel_list, pred_seq_rel_list,
      non_linear_ped_list, loss_mask_list) = zip(*data)
@@ -97,11 +99,54 @@ def poly_fit(traj, traj_len, threshold):
     else:
         return 0.0
 
+def extract_frames(video_path, frame_ids, new_shape, cache_path, max_grab=30):
+    """
+    Decode only the needed frames of a video and store them, resized, in an on-disk uint8 cache
+    Input:
+    - video_path: Path to the video
+    - frame_ids: Frame ids (1-based, as counted by the annotations) to extract
+    - new_shape: (width, height) of the stored frames (cv2.resize convention)
+    - cache_path: .npy file (N, height, width, 3) with the frames sorted by id. The ids are stored
+      next to it (<cache_path>.ids.npy). If both exist with the same ids, the video is not decoded
+    - max_grab: Gaps up to this number of frames are skipped with grab() (no retrieve/resize),
+      larger gaps with a seek
+    Output:
+    - ids: np.array (N,) with the sorted unique ids, row i of the cache is frame ids[i]
+    """
+    ids = np.unique(np.asarray(frame_ids, dtype=np.int64))
+    ids_path = cache_path + ".ids.npy"
+    if os.path.isfile(cache_path) and os.path.isfile(ids_path) and np.array_equal(np.load(ids_path), ids):
+        return ids
+
+    cap = cv2.VideoCapture(video_path)
+    cache = np.lib.format.open_memmap(cache_path + ".tmp.npy", mode="w+", dtype=np.uint8,
+                                      shape=(len(ids), new_shape[1], new_shape[0], 3))
+    position = 0 # 0-based index of the next frame returned by read(), i.e. frame id position+1
+    for i, frame_id in enumerate(ids):
+        gap = frame_id - 1 - position
+        if gap < 0 or gap > max_grab:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_id - 1)
+        else:
+            for _ in range(gap):
+                cap.grab()
+        ret, frame = cap.read()
+        assert ret, "Frame {} could not be read from {}".format(frame_id, video_path)
+        position = frame_id
+        cache[i] = cv2.resize(frame, new_shape)
+    cap.release()
+
+    cache.flush()
+    del cache
+    os.replace(cache_path + ".tmp.npy", cache_path)
+    np.save(ids_path, ids)
+    return ids
+
 class EthUcyDataset(Dataset):
     
     def __init__(
         self, data_dir, obs_len=8, pred_len=12, skip=1, threshold=0.002, #pred_len=12 
-        min_ped=1, delim='\t', img_shape=(600,600), videos_path="", video_extension="avi"
+        min_ped=1, delim='\t', img_shape=(600,600), videos_path="", video_extension="avi",
+        frames_cache_dir=None
     ):
         super(EthUcyDataset, self).__init__()
 
@@ -116,6 +161,9 @@ class EthUcyDataset(Dataset):
         self.img_shape = img_shape
         self.videos_path = videos_path
         self.video_extension = video_extension
+        # Resized frames are cached as .npy files (memory-mapped in __getitem__)
+        self.frames_cache_dir = frames_cache_dir if frames_cache_dir is not None else \
+                                os.path.join(videos_path, "frames_cache")
         self.prepare_dataset()
 
     def prepare_dataset(self):
@@ -126,7 +174,6 @@ class EthUcyDataset(Dataset):
         seq_list_rel = []
         loss_mask_list = []
         non_linear_ped = []
-        frames_list = []
         frame_dict_dataset = []
 
         for path in all_files:
@@ -137,108 +184,54 @@ class EthUcyDataset(Dataset):
             dataset_name = self.get_dataset_name(path)
             #data = read_file(self.videos_path + "/" + dataset_name, self.delim)
             data = read_file(path, self.delim)
-            # obtain frames from all the data and
-            # create data structure oredered by frame
-            frames = np.unique(data[:, 0]).tolist()
-            frame_data = []
-            for frame in frames:
-                frame_data.append(data[frame == data[:, 0], :])
+            # obtain frames from all the data: the windows are built over the index of the
+            # frame in the sorted unique frames (vectorized kernel, see sophie/data_loader/windowing.py)
+            frames, frame_index = np.unique(data[:, 0], return_inverse=True)
             num_sequences = int(
                 math.ceil((len(frames) - self.seq_len + 1) / self.skip)) #>? why add 1
+            starts = np.arange(0, num_sequences * self.skip + 1, self.skip)
+
+            window, _, present, curr_seq = sliding_windows(
+                frame_index, data[:, 1], np.around(data[:, 2:4], decimals=4), starts, self.seq_len)
+
+            # only the agents observed in the whole window are considered
+            considered = present.all(axis=1)
+            window = window[considered]
+            curr_seq = curr_seq[considered].transpose(0, 2, 1) # agents x 2 x seq_len
+            curr_seq_rel = np.zeros(curr_seq.shape)
+            curr_seq_rel[:, :, 1:] = curr_seq[:, :, 1:] - curr_seq[:, :, :-1]
+            # Linear vs Non-Linear Trajectory
+            _non_linear = poly_fit_batch(curr_seq, self.pred_len, self.threshold)
+
+            peds_per_window = np.bincount(window, minlength=len(starts))
+            first_ped = np.cumsum(peds_per_window) - peds_per_window
 
             frames_dts = []
-            
-            for idx in range(0, num_sequences * self.skip + 1, self.skip):
-
-                ## secuencia
-                curr_seq_data = np.concatenate(
-                    frame_data[idx:idx + self.seq_len], axis=0)
-
-                ## agentes en secuencia
-                peds_in_curr_seq = np.unique(curr_seq_data[:, 1])
-                curr_seq_rel = np.zeros((len(peds_in_curr_seq), 2, # numero de agentes en escena, xy, longitud secuencia
-                                         self.seq_len))
-                                        
-                curr_seq = np.zeros((len(peds_in_curr_seq), 2, self.seq_len))
-                curr_loss_mask = np.zeros((len(peds_in_curr_seq),
-                                           self.seq_len))
-                num_peds_considered = 0
-                _non_linear_ped = []
-                frame_idx_list = []
-
-                for _, ped_id in enumerate(peds_in_curr_seq):
-
-                    ## get [frame id x y] of agent
-                    curr_ped_seq = curr_seq_data[curr_seq_data[:, 1] ==
-                                                 ped_id, :]
-                    curr_ped_seq = np.around(curr_ped_seq, decimals=4)
-
-                    # get index of frame for current agent. start and end
-                    pad_front = frames.index(curr_ped_seq[0, 0]) - idx
-                    pad_end = frames.index(curr_ped_seq[-1, 0]) - idx + 1
-                    if pad_end - pad_front != self.seq_len:
-                        continue
-
-                    frame_idx = frames.index(curr_ped_seq[-1, 0]) - self.obs_len + 1
-                    frame_idx_list.append(frame_idx)
-                    
-                    ## get points of agents (2,self.seq_len)
-                    curr_ped_seq = np.transpose(curr_ped_seq[:, 2:])
-                    curr_ped_seq = curr_ped_seq
-
-                    # Make coordinates relative
-                    rel_curr_ped_seq = np.zeros(curr_ped_seq.shape)
-                    rel_curr_ped_seq[:, 1:] = \
-                        curr_ped_seq[:, 1:] - curr_ped_seq[:, :-1]
-
-                    _idx = num_peds_considered
-                    curr_seq[_idx, :, pad_front:pad_end] = curr_ped_seq
-                    curr_seq_rel[_idx, :, pad_front:pad_end] = rel_curr_ped_seq
-                    # Linear vs Non-Linear Trajectory
-                    _non_linear_ped.append(
-                        poly_fit(curr_ped_seq, self.pred_len, self.threshold))
-
-                    curr_loss_mask[_idx, pad_front:pad_end] = 1
-                    num_peds_considered += 1
-
-                if num_peds_considered > self.min_ped:
-                    num_peds_considered = 32
-                    if len(_non_linear_ped) < num_peds_considered:
-                        len_nlp = len(_non_linear_ped)
-                        dumm = [0 for _ in range(num_peds_considered-len_nlp)]
-                        _non_linear_ped = _non_linear_ped + dumm
-
-                    non_linear_ped += _non_linear_ped
-                    num_peds_in_seq.append(num_peds_considered)
-                    if curr_loss_mask[:num_peds_considered].shape[0] != num_peds_considered:
-                        (f_dim, s_dim) = curr_loss_mask[:num_peds_considered].shape
-                        dumm = np.zeros((num_peds_considered-f_dim, s_dim))
-                        curr_loss_mask_ped = curr_loss_mask[:num_peds_considered]
-                        curr_loss_mask_ped_final = np.concatenate((curr_loss_mask_ped, dumm), axis=0)
-                    else:
-                        curr_loss_mask_ped_final = curr_loss_mask[:num_peds_considered]
-
-                    loss_mask_list.append(curr_loss_mask_ped_final)
-
-                    curr_seq_ped = curr_seq[:num_peds_considered]
-                    if curr_seq_ped.shape[0] != num_peds_considered:
-                        (f_dim, s_dim, t_dim) = curr_seq_ped.shape
-                        dumm = np.zeros((num_peds_considered-f_dim, s_dim, t_dim))
-                        curr_seq_ped_final = np.concatenate((curr_seq_ped, dumm), axis=0)
-                    else:
-                        curr_seq_ped_final = curr_seq_ped
-                    seq_list.append(curr_seq_ped_final)
-
-                    curr_seq_rel_ped = curr_seq_rel[:num_peds_considered]
-                    if curr_seq_rel_ped.shape[0] != num_peds_considered:
-                        (f_dim, s_dim, t_dim) = curr_seq_rel_ped.shape
-                        dumm = np.zeros((num_peds_considered-f_dim, s_dim, t_dim))
-                        curr_seq_ped_final = np.concatenate((curr_seq_rel_ped, dumm), axis=0)
-                    else: 
-                        curr_seq_ped_final = curr_seq_rel_ped
-                    seq_list_rel.append(curr_seq_ped_final)
-
-                    frames_dts.append(np.unique(frame_idx_list)[0])
+            num_peds_considered = 32
+            for idx in np.nonzero(peds_per_window > self.min_ped)[0]:
+                start, end = first_ped[idx], first_ped[idx] + peds_per_window[idx]
+                num_peds = min(end - start, num_peds_considered)
+
+                _non_linear_ped = _non_linear[start:end].tolist()
+                if len(_non_linear_ped) < num_peds_considered:
+                    _non_linear_ped += [0 for _ in range(num_peds_considered - len(_non_linear_ped))]
+                non_linear_ped += _non_linear_ped
+                num_peds_in_seq.append(num_peds_considered)
+
+                curr_loss_mask = np.zeros((num_peds_considered, self.seq_len))
+                curr_loss_mask[:num_peds] = 1
+                loss_mask_list.append(curr_loss_mask)
+
+                curr_seq_ped = np.zeros((num_peds_considered, 2, self.seq_len))
+                curr_seq_ped[:num_peds] = curr_seq[start:start+num_peds]
+                seq_list.append(curr_seq_ped)
+
+                curr_seq_rel_ped = np.zeros((num_peds_considered, 2, self.seq_len))
+                curr_seq_rel_ped[:num_peds] = curr_seq_rel[start:start+num_peds]
+                seq_list_rel.append(curr_seq_rel_ped)
+
+                # index of the first predicted frame
+                frames_dts.append(starts[idx] + self.pred_len)
 
             frame_dict_dataset.append({dataset_name: frames_dts})
         
@@ -248,23 +241,26 @@ class EthUcyDataset(Dataset):
         loss_mask_list = np.concatenate(loss_mask_list, axis=0).astype(np.float32)
         non_linear_ped = np.asarray(non_linear_ped).astype(np.float32)
 
-        ### get frames from dataset
-        iteration = 0
+        ### get frames from dataset: only the needed frames are decoded, once, to the cache
+        os.makedirs(self.frames_cache_dir, exist_ok=True)
+        self.frame_cache_paths = []
+        frame_index = []
         for data in frame_dict_dataset:
             key, value = list(data.keys()), list(data.values())
-            frame_list_im = self.get_frames(
+            cache_path = os.path.join(self.frames_cache_dir, "{}_{}x{}.npy".format(
+                key[0], self.img_shape[0], self.img_shape[1]))
+            ids = extract_frames(
                 os.path.join(self.videos_path, ".".join([key[0], self.video_extension])),
-                self.img_shape, 
-                value[0]
+                value[0], self.img_shape, cache_path
             )
-            print("Frame list: ", frame_list_im)
-            frame_list_im = np.concatenate(frame_list_im, axis=0)
-            if iteration == 0:
-                frames_list = frame_list_im
-                iteration += 1
-                continue
-            frames_list = np.concatenate((frames_list, frame_list_im), axis=0)
-
+            # Sequence -> (video, row of the cache)
+            video = len(self.frame_cache_paths)
+            rows = np.searchsorted(ids, np.asarray(value[0], dtype=np.int64))
+            frame_index.append(np.stack([np.full(len(rows), video), rows], axis=1))
+            self.frame_cache_paths.append(cache_path)
+        self.frame_index = np.concatenate(frame_index, axis=0) if len(frame_index) > 0 else \
+                           np.zeros((0, 2), dtype=np.int64)
+        self.frame_caches = None # Opened lazily (after the DataLoader workers are forked)
 
         # Convert numpy -> Torch Tensor
         self.obs_traj = torch.from_numpy(
@@ -283,26 +279,15 @@ class EthUcyDataset(Dataset):
             for start, end in zip(cum_start_idx, cum_start_idx[1:]) # [1671]
         ]
 
-        self.frames = frames_list # (1671, 600, 600, 3)
-
-    def get_frames(self, path, new_shape, frames):
-        print("path: ", path)
-        print("frames ", frames)
-        cap = cv2.VideoCapture(path) 
-        num_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
-        frames_list = []
-        frame_counter = 0
-        while (num_frames > 0):
-            _, frame = cap.read()
-            num_frames -= 1
-            frame_counter += 1
-            if frame_counter not in frames:
-                continue
-            re_frame = cv2.resize(frame, new_shape)
-            frames_list.append(np.expand_dims(re_frame, axis=0))
-        cap.release()
-        print("frames_list ", frames_list)
-        return frames_list
+    def get_frame(self, idx):
+        """
+        Output:
+        - np.array (600, 600, 3) uint8, frame of the idx-th sequence (read from the memory-mapped cache)
+        """
+        if self.frame_caches is None:
+            self.frame_caches = [np.load(path, mmap_mode="r") for path in self.frame_cache_paths]
+        video, row = self.frame_index[idx]
+        return np.array(self.frame_caches[video][row])
 
     def get_dataset_name(self, path):
         dts_name = path.split("/")[-1].split(".")[0].split("_")[0:-1]
@@ -319,7 +304,7 @@ class EthUcyDataset(Dataset):
             self.obs_traj[start:end, :], self.pred_traj[start:end, :],
             self.obs_traj_rel[start:end, :], self.pred_traj_rel[start:end, :],
             self.non_linear_ped[start:end], self.loss_mask[start:end, :]
-            ,self.frames[idx, :]
+            ,self.get_frame(idx)
         ]
         return out
 
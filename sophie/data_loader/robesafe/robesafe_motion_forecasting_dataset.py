@@ -18,6 +18,8 @@ import torch
 
 from torch.utils.data import Dataset
 
+from sophie.data_loader.windowing import agent_windows
+
 np.set_printoptions(precision=3, suppress=True)
 
 ## File managements functions
@@ -174,14 +176,14 @@ def ignore_file(path):
     """
     """
     first_token = path.split("/")[-1][0]
-    return True if firsk_token == "." else False
+    return True if first_token == "." else False
 
 ## End File management functions
 
 ## Motion Prediction functions
 
 def poly_fit(traj, traj_len, threshold):
-   """
+    """
     Input:
         - traj: Numpy array of shape (2, traj_len)
         - traj_len: Len of trajectory
@@ -318,6 +320,7 @@ class RobeSafeMotionForecastingDataset(Dataset):
         self.seq_len = self.obs_len + self.pred_len
         self.skip, self.delim = skip, delim
         self.frames_path = frames_path
+        self.frames_extension = frames_extension
 
         all_files, _ = load_list_from_folder(self.data_dir)
         num_objs_in_seq = []
@@ -351,202 +354,39 @@ class RobeSafeMotionForecastingDataset(Dataset):
                 min_frame, max_frame = frames[0], frames[-1]
                 num_windows = int(max_frame - min_frame + 1 - skip*(self.seq_len - 1)) # Include all frames for past and future 
 
-            # Loop every window
-
-            for window_index in range(num_windows):
-                start_frame = int(window_index + min_frame)
-                end_frame = int(start_frame + self.seq_len*skip) # This frame is not included
-
-                if phase == 'test':
-                    if windows_frames and start_frame not in windows_frames:
-                        continue
-                
-                frame = start_frame + self.obs_len # Frame of interest
-
-                seq_name_int = seqname2int(seq_name)
-                if frame > 999: # ¿?¿?¿? if and only if you have 1000 frames at most
-                    frame -= 1
-                seq_frame = np.array([seq_name_int, frame])
-
-                # Reduce window during testing, only evaluate every N windows
-                # if phase == 'test':
-                #     check_pass = check_eval_windows(start_frame+self.obs_len*skip, self.obs_len*skip, self.pred_len*skip, phase=phase)
-                #     if not check_pass: 
-                #         continue
-
-                # Get data in current window
-
-                curr_seq_data = []
-                for frame in range(start_frame, end_frame, skip):
-                    curr_seq_data.append(data[frame == data[:,0],:])
-                curr_seq_data = np.concatenate(curr_seq_data, axis=0) # Frame - ID - X - Y
-
-                # Initialize data
-
-                objs_in_curr_seq_list = []
-                objs_in_curr_seq = np.unique(curr_seq_ata[:,1]) # Number of objects in the window
-                objs_len = objs_in_curr_seq.shape[0]
-
-                num_mini_batches = math.ceil(float(objs_len/num_agents)) # If there are less than num_agents,
-                # dummy variables are used to predict. If there are more, it is distributed in total_agents % num_agents
-                # forwards but using the same physical information and frame index
-
-                for mini_batch_index in range(num_mini_batches):
-                    if mini_batch == num_mini_batches - 1:
-                        objs_in_curr_seq_aux = objs_in_curr_seq[num_agents*mini_batch_index:]
-                        dummy = [-1 for i in range(num_agents - objs_in_curr_seq_aux.shape[0])]
-                        objs_in_curr_seq_aux = np.concatenate((objs_in_curr_seq_aux, dummy))
-                    else:
-                        objs_in_curr_seq_aux = objs_in_curr_seq[num_agents*mini_batch_index:num_agents*(mini_batch_index+1)]
-                    objs_in_curr_seq_list.append(objs_in_curr_seq_aux)
-
-                # Create final data to feed the model based on objs_in_curr_seq_list
-
-                for current_objs in objs_in_curr_seq_list:
-                    curr_seq_rel   = np.zeros((len(current_objs), 2, self.seq_len)) # num_agents x 2 x seq_len
-                    curr_seq       = np.zeros((len(current_objs), 2, self.seq_len)) # num_agents x 2 x seq_len
-                    curr_loss_mask = np.zeros((len(current_objs),    self.seq_len)) # num_agents x seq_len
-                    id_frame_list  = np.zeros((len(current_objs), 3, self.seq_len)) # num_agents x 3 x seq_len
-                    object_class_list = np.zeros(len(current_objs))
-                    object_class_list.fill(-1)
-                    id_frame_list.fill(0)
-                    num_objs_considered = 0
-                    _non_linear_obj = []
-
-                    # Loop through every object in this window
-
-                    for _, obj_id in enumerate(current_objs):
-                        if obj_id == -1:
-                            num_objs_considered += 1
-                            continue
-
-                        object_class = getObjecClass(path)
-                        object_class_id = self.objects_id_dict[object_class]
-                        curr_obj_seq = curr_seq_data[curr_seq_data[:, 1] == obj_id, :] # Frame - ID - X - Y for one of the id of the window, same id
-                        pad_front    = int(curr_obj_seq[0, 0] ) - start_frame      # First frame of window       
-                        pad_end      = int(curr_obj_seq[-1, 0]) - start_frame + skip # Last frame of window
-
-                        assert pad_end % skip == 0, 'error'
-
-                        frame_existing = curr_obj_seq[:, 0].tolist() # Frames of windows
-
-                        # Pad front and end data to make the trajectory complete
-
-                        if ((pad_end - pad_front) != (self.seq_len * skip)):
-                            # Pad front
-                            to_be_paded_front = int(pad_front / skip)
-                            pad_front_seq = np.expand_dims(curr_obj_seq[0, :], axis=0)
-                            pad_front_seq = np.repeat(pad_front_seq, to_be_paded_front, axis=0)
-                            frame_offset = np.zeros((to_be_paded_front, 4), dtype='float32')
-                            frame_offset[:, 0] = np.array(range(-to_be_paded_front, 0))
-                            pad_front_seq += frame_offset * skip
-                            curr_obj_seq = np.concatenate((pad_front_seq, curr_obj_seq), axis=0)
-
-                            # Pad end
-                            to_be_paded_end = int(self.seq_len - pad_end / skip)
-                            pad_end_seq = np.expand_dims(curr_obj_seq[-1, :], axis=0)
-                            pad_end_seq  = np.repeat(pad_end_seq, to_be_paded_end, axis=0)
-                            frame_offset = np.zeros((to_be_paded_end, 4)), dtype='float32')
-                            frame_offset[:, 0] = np.array(range(1, to_be_paded_end+1))
-                            pad_end_seq += frame_offset * skip # Shift first columns for frame
-                            curr_obj_seq = np.concatenate((curr_obj_seq, pad_end_seq), axis=0)
-
-                            # Set pad front and end to correct values
-                            pad_front = 0
-                            pad_end = self.seq_len * skip
-
-                        # Special cases
-
-                        # A. The object reappears at a bad frame (missing intermediate frame)
-
-                        if curr_obj_seq.shape[0] != (pad_end - pad_front) / skip:
-                            frame_all = list(range(int(curr_obj_seq[0,0]), int(curr_obj_seq[-1,0]) + skip, skip))
-                            frame_missing, _ = remove_list_from_list(frame_all, curr_obj_seq[:, 0].tolist())
-
-                            # Pad all missing frames with zeros
-
-                            pad_seq = np.expand_dims(curr_obj_seq[-1,:], axis=0)
-                            pad_seq = np.repeat(pad_seq, len(frame_missing), axis=0)
-                            pad_seq.fill(0)
-                            pad_seq[:,0] = np.array(frame_missing)
-                            pad_seq[:,1] = obj_id # Fill ID
-                            curr_obj_seq = np.concatenate((curr_obj_seq, pad_seq), axis=0)
-                            curr_obj_seq = curr_obj_seq[np.argsort(curr_obj_seq[:,0])]
-
-                        assert pad_front == 0, 'error'
-                        assert pad_end == self.seq_len * skip, 'error'
-
-                        # B. Make sure the seq_len frames are continuous, no jumping frames
-
-                        start_frame_now = int(curr_obj_seq[0,0])
-                        if curr_obj_seq[-1,0] != start_frame_now + (self.seq_len-1)*skip:
-                            num_objs_considered += 1
-                            continue
-
-                        # C. Make sure the past data has at least one frame
-
-                        past_frame_list = [*range(start_frame_now, start_frame_now + self.obs_len * skip, skip)]
-                        common = find_unique_common_from_lists(past_frame_list, frame_existing, only_com=True)
-                        if len(common) == 0:
-                            num_objs_considered += 1
-                            continue
-
-                        # D. Make sure that future GT data has at least one frame
-
-                        if phase != 'test':
-                            gt_frame_list = [*range(start_frame_now + self.obs_len*skip, start_frame_now + self.seq_len*skip, skip)]
-                            common = find_unique_common_from_lists(gt_frame_list, frame_existing, only_com=True)
-                            if len(common) == 0:
-                                num_objs_considered += 1
-                                continue
-
-                        # Only keep the state
-
-                        cache_tmp = np.transpose(curr_obj_seq[:,:2]) # 2 x seq_len | [0,:] list of frames | [1,:] id
-                        curr_obj_seq = np.transpose(curr_obj_seq[:,2:]) # 2 x seq_len | [0,:] x | [1,:] y
-
-                        # Make coordinates relative
-
-                        rel_curr_obj_seq = np.zeros(curr_obj_seq.shape)
-                        rel_curr_obj_seq[:,1:] = curr_obj_seq[:,1:] - curr_obj_seq[:,:-1]
-                        _idx = num_objs_considered
-                        curr_seq[_idx, :, :] = curr_obj_seq
-                        curr_seq_rel[_idx, :, :] = rel_curr_obj_seq
-
-                        # Record seqname, frame and ID information 
-
-                        id_frame_list[_idx, :2, :] = cache_tmp
-                        id_frame_list[_idx,  2, :] = seq_name_int # img_id - obj_id - seqname2int
-
-                        # Linear vs Non-Linear Trajectory, only fit for the future part, not past part
-
-                        if phase != 'test':
-                            _non_linear_obj.append(poly_fit(curr_obj_seq, pred_len, threshold))
-
-                        # Add mask onto padded dummy data
-
-                        frame_exist_index = np.array([frame_tmp - start_frame_now for frame_tmp in frame_existing])
-                        frame_exist_index = (frame_exist_index / skip).astype('uint8')
-                        curr_loss_mask[_idx, frame_exist_index] = 1
-
-                        # Object ID
-
-                        object_class_list[num_objs_considered] = object_class_id
-                        num_objs_considered += 1
-
-                    if num_objs_considered > min_objs:
-                        if len(_non_linear_obj) != num_objs_considered:
-                            dummy = [-1 for i in range(num_objs_considered - len(_non_linear_obj))]
-                            _non_linear_obj = _non_linear_obj + dummy
-                        non_linear_obj += _non_linear_obj
-                        num_objs_in_seq.append(num_objs_considered)
-                        loss_mask_list.append(curr_loss_mask[:num_objs_considered])
-                        seq_list.append(curr_seq[:num_objs_considered])
-                        seq_list_rel.append(curr_seq_rel[:num_objs_considered])
-                        seq_id_list.append(id_frame_list[:num_objs_considered])
-                        frames_list.append(seq_frame)
-                        object_class_id_list.append(object_class_list)
-                        object_id_list.append(id_frame_list[:num_objs_considered][:,1,0])
+            # All windows at once (vectorized kernel, see sophie/data_loader/windowing.py). If there are
+            # less than num_agents objects, dummy variables are used to predict. If there are more, they are
+            # distributed in total_agents % num_agents forwards but using the same physical information and frame index
+
+            start_frames = [int(window_index + min_frame) for window_index in range(num_windows)]
+            if phase == 'test' and windows_frames:
+                start_frames = [start_frame for start_frame in start_frames if start_frame in windows_frames]
+            if len(start_frames) == 0 or num_agents <= min_objs:
+                continue
+
+            seq_name_int = seqname2int(seq_name)
+            object_class_id = self.objects_id_dict[getObjecClass(path)]
+            windows = agent_windows(data, start_frames, self.seq_len, self.obs_len, skip=skip,
+                                    num_agents=num_agents, check_future=phase != 'test',
+                                    pred_len=pred_len, threshold=threshold,
+                                    seq_name_int=seq_name_int, object_class_id=object_class_id)
+
+            # Frame of interest of every group
+
+            frame = np.array(start_frames)[windows["window"]] + self.obs_len
+            frame[frame > 999] -= 1 # ¿?¿?¿? if and only if you have 1000 frames at most
+            seq_frame = np.stack([np.full(len(frame), seq_name_int), frame], axis=1)
+
+            num_groups = len(windows["window"])
+            non_linear_obj += windows["non_linear"].tolist()
+            num_objs_in_seq += [num_agents] * num_groups
+            loss_mask_list.append(windows["loss_mask"])
+            seq_list.append(windows["seq"])
+            seq_list_rel.append(windows["seq_rel"])
+            seq_id_list.append(windows["id_frame"])
+            frames_list += list(seq_frame)
+            object_class_id_list += list(windows["object_class"])
+            object_id_list += list(windows["object_id"])
 
         self.num_seq = len(seq_list)
         seq_list = np.concatenate(seq_list, axis=0) # Objects x 2 x seq_len
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+"""
+Vectorized sliding-window kernel shared by the sgan-style loaders (AIODrive, INTERACTION, RoBeSafe
+and ETH/UCY).
+
+Instead of looping over windows, then objects (np.unique, boolean masks, frames.index and padding
+per object), the rows (time, id, x, y) of a file are scattered once into a dense (time, object) grid
+and every window is gathered from it at once. The outputs are (window, object) tracks, sorted by
+window and then by object id (np.unique order, as in the original loops).
+
+NB: an object is assumed to have at most one row per time step.
+"""
+
+import numpy as np
+
+def sliding_windows(times, ids, values, starts, seq_len, step=1, chunk_size=256):
+    """
+    Input:
+        times: np.array (N,) integer time index of every row (>= 0)
+        ids: np.array (N,) object id of every row
+        values: np.array (N,D) per-row values (e.g. x,y)
+        starts: np.array (W,) start time of every window. The window w covers the times
+                starts[w] + step*[0, ..., seq_len-1]
+        chunk_size: windows gathered at once (bounds the memory)
+    Output:
+        window: np.array (K,) window index of every track (object present at least once in the window)
+        obj_id: np.array (K,) object id of every track
+        present: np.array (K,seq_len) bool
+        track_values: np.array (K,seq_len,D), 0 where not present
+    """
+    times = np.asarray(times).astype(np.int64)
+    starts = np.asarray(starts).astype(np.int64)
+    values = np.asarray(values)
+    ids = np.asarray(ids)
+    num_values = values.shape[1]
+
+    if len(times) == 0 or len(starts) == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=ids.dtype),
+                np.zeros((0, seq_len), dtype=bool), np.zeros((0, seq_len, num_values), dtype=values.dtype))
+
+    assert times.min() >= 0, "Negative time index"
+    obj_ids, obj_idx = np.unique(ids, return_inverse=True)
+    num_times = int(times.max()) + 1
+
+    # Dense grid. The extra (last) time step is always empty: out-of-range times point to it
+    present_grid = np.zeros((num_times + 1, len(obj_ids)), dtype=bool)
+    present_grid[times, obj_idx] = True
+    values_grid = np.zeros((num_times + 1, len(obj_ids), num_values), dtype=values.dtype)
+    values_grid[times, obj_idx] = values
+
+    offsets = step * np.arange(seq_len)
+    window, objects, present, track_values = [], [], [], []
+    for c in range(0, len(starts), chunk_size):
+        t_idx = starts[c:c+chunk_size, None] + offsets[None, :] # Wc x seq_len
+        t_idx = np.where((t_idx >= 0) & (t_idx < num_times), t_idx, num_times)
+        chunk_present = present_grid[t_idx] # Wc x seq_len x num_objects
+        w, o = np.nonzero(chunk_present.any(axis=1)) # Sorted by window, then object
+        window.append(w + c)
+        objects.append(o)
+        present.append(chunk_present[w, :, o]) # K x seq_len
+        track_values.append(values_grid[t_idx[w], o[:, None]]) # K x seq_len x D
+
+    window = np.concatenate(window)
+    obj_id = obj_ids[np.concatenate(objects)]
+    return window, obj_id, np.concatenate(present, axis=0), np.concatenate(track_values, axis=0)
+
+def pad_tracks(present, values):
+    """
+    Complete the tracks as the sgan-style loaders do: the steps before the first observation repeat
+    the first observation, the steps after the last one repeat the last observation and the missing
+    intermediate steps are 0
+    Input:
+        present: np.array (K,seq_len) bool (at least one True per track)
+        values: np.array (K,seq_len,D), 0 where not present
+    Output:
+        np.array (K,seq_len,D)
+    """
+    num_tracks, seq_len = present.shape
+    if num_tracks == 0:
+        return values.copy()
+    first = present.argmax(axis=1)
+    last = seq_len - 1 - present[:, ::-1].argmax(axis=1)
+    steps = np.arange(seq_len)[None, :]
+    k = np.arange(num_tracks)
+
+    padded = np.where(present[..., None], values, 0)
+    padded = np.where((steps < first[:, None])[..., None], values[k, first][:, None, :], padded)
+    padded = np.where((steps > last[:, None])[..., None], values[k, last][:, None, :], padded)
+    return padded
+
+def poly_fit_batch(trajs, traj_len, threshold):
+    """
+    Vectorized poly_fit: sum of the residuals of a quadratic fit of the last traj_len steps of x and y
+    Input:
+        trajs: np.array (K,2,seq_len)
+        traj_len: Len of trajectory
+        threshold: Minimum error to be considered for non linear traj
+    Output:
+        np.array (K,) -> 1.0 Non Linear, 0.0 Linear
+    """
+    num_tracks = trajs.shape[0]
+    if num_tracks == 0 or traj_len <= 3: # np.polyfit does not return residuals -> linear
+        return np.zeros(num_tracks)
+    t = np.linspace(0, traj_len - 1, traj_len)
+    A = np.vander(t, 3)
+    Y = trajs[:, :, -traj_len:].reshape(-1, traj_len).T # traj_len x 2K
+    coeffs = np.linalg.lstsq(A, Y, rcond=None)[0]
+    residuals = ((A @ coeffs - Y)**2).sum(axis=0).reshape(num_tracks, 2).sum(axis=1)
+    return np.where(residuals >= threshold, 1.0, 0.0)
+
+def agent_windows(data, start_frames, seq_len, obs_len, skip=1, num_agents=32, check_future=True,
+                  pred_len=12, threshold=0.002, seq_name_int=0, object_class_id=-1):
+    """
+    Windows of the AIODrive-style loaders (AIODrive, INTERACTION, RoBeSafe). The objects of every
+    window are split in groups of num_agents (the last one filled with dummy objects). An object
+    occupies its slot only if it is observed at least once in the past (and in the future, if
+    check_future), otherwise the slot is left empty (zeros, object class -1)
+
+    Input:
+        data: np.array (N,>=4) frame - id - x - y
+        start_frames: list or np.array (W,) first frame of every window
+        check_future: phase with GT. If False, the future is not checked and non_linear is -1
+    Output:
+        dict with (G groups, A = num_agents)
+            window: (G,) index (in start_frames) of the window of every group
+            seq, seq_rel: (G*A,2,seq_len)
+            loss_mask: (G*A,seq_len)
+            non_linear: (G*A,) values of the valid objects of each group first, -1 afterwards
+            id_frame: (G*A,3,seq_len) frame - id - seq_name_int
+            object_class, object_id: (G,A)
+    """
+    start_frames = np.asarray(start_frames, dtype=np.int64).reshape(-1)
+    frames = np.rint(data[:, 0]).astype(np.int64)
+    offset = min(frames.min(), start_frames.min()) if len(frames) > 0 and len(start_frames) > 0 else 0
+    window, obj_id, present, values = sliding_windows(frames - offset, data[:, 1], data[:, 2:4],
+                                                      start_frames - offset, seq_len, skip)
+
+    # Groups of num_agents objects per window
+
+    num_tracks = len(window)
+    tracks_per_window = np.bincount(window, minlength=len(start_frames))
+    groups_per_window = (tracks_per_window + num_agents - 1) // num_agents
+    first_track = np.cumsum(tracks_per_window) - tracks_per_window
+    first_group = np.cumsum(groups_per_window) - groups_per_window
+    num_groups = int(groups_per_window.sum())
+
+    rank = np.arange(num_tracks) - first_track[window]
+    group = first_group[window] + rank // num_agents
+    row = group * num_agents + rank % num_agents
+
+    valid = present[:, :obs_len].any(axis=1)
+    if check_future:
+        valid &= present[:, obs_len:].any(axis=1)
+    row, group, window_valid = row[valid], group[valid], window[valid]
+    obj_valid, present = obj_id[valid], present[valid]
+    traj = pad_tracks(present, values[valid]).transpose(0, 2, 1) # K x 2 x seq_len
+
+    num_rows = num_groups * num_agents
+    seq = np.zeros((num_rows, 2, seq_len))
+    seq_rel = np.zeros((num_rows, 2, seq_len))
+    loss_mask = np.zeros((num_rows, seq_len))
+    id_frame = np.zeros((num_rows, 3, seq_len))
+    object_class = np.full(num_rows, -1.0)
+    non_linear = np.full(num_rows, -1.0)
+
+    seq[row] = traj
+    seq_rel[row, :, 1:] = traj[:, :, 1:] - traj[:, :, :-1]
+    loss_mask[row] = present
+    id_frame[row, 0, :] = start_frames[window_valid][:, None] + skip * np.arange(seq_len)[None, :]
+    id_frame[row, 1, :] = obj_valid[:, None]
+    id_frame[row, 2, :] = seq_name_int
+    object_class[row] = object_class_id
+
+    if check_future:
+        # The values of the valid objects are packed at the beginning of the group
+        valid_per_group = np.bincount(group, minlength=num_groups)
+        first_valid = np.cumsum(valid_per_group) - valid_per_group
+        valid_rank = np.arange(len(group)) - first_valid[group]
+        non_linear[group * num_agents + valid_rank] = poly_fit_batch(traj, pred_len, threshold)
+
+    return {
+        "window": np.repeat(np.arange(len(start_frames)), groups_per_window),
+        "seq": seq,
+        "seq_rel": seq_rel,
+        "loss_mask": loss_mask,
+        "non_linear": non_linear,
+        "id_frame": id_frame,
+        "object_class": object_class.reshape(num_groups, num_agents),
+        "object_id": id_frame[:, 1, 0].reshape(num_groups, num_agents)
+    }
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+"""
+Stateful online inference keyed by track id.
+
+Tracks arrive one observation per tick (10 Hz in Argoverse). Instead of re-running the whole obs_len
+window through EncoderLSTM every tick, each track keeps its LSTM state(s) and all of them are advanced
+together with a single (batched) step per new observation. Social attention and decoding are run on
+demand.
+
+Encoder modes:
+    - "window" (default): exact. The batch path encodes the last obs_len observations starting from a
+      zero state, so every track keeps up to obs_len in-flight LSTM chains (one started at each of the
+      last obs_len ticks). Every tick all chains of all tracks are advanced together with ONE LSTM step
+      and the chain that has consumed obs_len inputs is the encoding of the current window. Predictions
+      are identical to the batch path. Each chain still embeds and steps its own copy of the new
+      displacement (obs_len rows per track and tick), so the embedding and LSTM FLOPs are the same as
+      those of the batch path: only the sequential latency per tick drops (1 LSTM step instead of
+      obs_len), not the compute.
+    - "stream": a single LSTM state per track, carried for the whole life of the track (1 row per track
+      and tick, i.e. obs_len times less compute than "window"). It is NOT equivalent to the batch path:
+      the predictions match only for the first window, afterwards the state summarizes the whole
+      history of the track and diverges from what the model saw in training.
+"""
+
+import torch
+import numpy as np
+
+from sophie.utils.utils import relative_to_abs_sgan_multimodal
+
+ENCODER_MODES = ["window", "stream"]
+
+class TrackState():
+    """
+    Per-track cache: last obs_len absolute positions and the in-flight encoder chains
+    """
+    def __init__(self, track_id, frame, h_dim, device):
+        self.track_id = track_id
+        self.last_frame = frame
+        self.age = 0 # Number of consecutive observations
+        self.positions = [] # Last obs_len absolute positions (x,y)
+        self.h = torch.zeros(0, h_dim, device=device) # Oldest chain first
+        self.c = torch.zeros(0, h_dim, device=device)
+        self.encoding = None # (h_dim,) encoding of the last complete window
+
+class OnlinePredictor():
+    """
+    Online wrapper around a trained generator (e.g. mp_soconf.TrajectoryGenerator). The generator must
+    expose `encoder` (EncoderLSTM) and `decode_from_encoding`.
+
+        predictor = OnlinePredictor(generator, obs_len=20, obs_origin=20)
+        for frame, ids, xy in tracker:
+            predictor.update(frame, ids, xy)
+            out = predictor.predict([agent_id])
+    """
+    def __init__(self, generator, obs_len=20, obs_origin=None, encoder_mode="window", max_missed_frames=0,
+                 distance_threshold=None, device=None):
+        """
+        Input:
+            generator: trained generator
+            obs_len (int): observation window length (as used in training)
+            obs_origin (int or None): if given, scenes are expressed in the obs_origin-relative frame
+                (origin = target position at the obs_origin-th observation of the window, as in
+                ArgoverseMotionForecastingDataset). If None, map coordinates are fed to the generator
+            encoder_mode (str): "window" (exact, same compute as the batch path, lower latency) or "stream"
+                (obs_len times cheaper, diverges from the batch path after the first window)
+            max_missed_frames (int): tracks not observed for more than this number of frames are evicted.
+                A track that misses a frame is restarted (the dataset only considers full windows)
+            distance_threshold (float or None): neighbours further than this distance (at the last frame)
+                from the target are not included in its scene
+        """
+        assert encoder_mode in ENCODER_MODES, "Encoder mode {} is not implemented".format(encoder_mode)
+        if obs_origin is not None:
+            assert 1 <= obs_origin <= obs_len, "obs_origin must be in [1, obs_len]"
+
+        self.generator = generator
+        self.encoder = generator.encoder
+        self.obs_len = obs_len
+        self.obs_origin = obs_origin
+        self.encoder_mode = encoder_mode
+        self.max_missed_frames = max_missed_frames
+        self.distance_threshold = distance_threshold
+        self.device = device if device is not None else next(generator.parameters()).device
+        self.h_dim = self.encoder.h_dim
+
+        self.tracks = {}
+        self.frame = None
+
+    def reset(self):
+        self.tracks = {}
+        self.frame = None
+
+    def _evict(self, frame):
+        stale = [track_id for track_id, track in self.tracks.items()
+                 if frame - track.last_frame > self.max_missed_frames + 1]
+        for track_id in stale:
+            del self.tracks[track_id]
+        return stale
+
+    @torch.no_grad()
+    def update(self, frame, track_ids, positions):
+        """
+        Advance every observed track one step
+        Input:
+            frame (int): frame (tick) index, increasing by 1 per tick
+            track_ids (list): ids observed in this frame
+            positions: np.array or torch.Tensor (n,2) -> map (global) coordinates
+        Output:
+            evicted (list): ids of the tracks removed in this update
+        """
+        self.frame = frame
+        evicted = self._evict(frame)
+        if len(track_ids) == 0:
+            return evicted
+
+        positions = torch.as_tensor(np.asarray(positions), dtype=torch.float32).view(-1, 2)
+
+        rel_steps, h_list, c_list, num_chains = [], [], [], []
+        observed = []
+        for track_id, pos in zip(track_ids, positions):
+            track = self.tracks.get(track_id)
+            if track is None or frame != track.last_frame + 1: # New track or gap -> restart it
+                track = TrackState(track_id, frame, self.h_dim, self.device)
+                self.tracks[track_id] = track
+            rel = pos - track.positions[-1] if len(track.positions) > 0 else torch.zeros(2)
+
+            track.positions.append(pos)
+            if len(track.positions) > self.obs_len:
+                track.positions.pop(0)
+            track.last_frame = frame
+            track.age += 1
+
+            if self.encoder_mode == "stream" and track.age > 1:
+                # Carry the single chain
+                rel_steps.append(rel.view(1, 2))
+                h_list.append(track.h)
+                c_list.append(track.c)
+                num_chains.append(1)
+            else:
+                # Existing chains receive the displacement, the new chain starts with a zero displacement
+                # (first relative position of every window, see process_window_sequence)
+                k = track.h.size(0)
+                rel_steps.append(torch.cat([rel.view(1, 2).repeat(k, 1), torch.zeros(1, 2)], dim=0))
+                h_list.append(torch.cat([track.h, torch.zeros(1, self.h_dim, device=self.device)], dim=0))
+                c_list.append(torch.cat([track.c, torch.zeros(1, self.h_dim, device=self.device)], dim=0))
+                num_chains.append(k + 1)
+            observed.append(track)
+
+        # One LSTM step for all the chains of all the observed tracks
+
+        rel_steps = torch.cat(rel_steps, dim=0).to(self.device)
+        state = (torch.cat(h_list, dim=0).unsqueeze(0), torch.cat(c_list, dim=0).unsqueeze(0))
+        h, c = self.encoder.step(rel_steps, state)
+        h, c = h[0], c[0]
+
+        start = 0
+        for track, k in zip(observed, num_chains):
+            track.h, track.c = h[start:start+k], c[start:start+k]
+            start += k
+            if track.age >= self.obs_len:
+                if self.encoder_mode == "stream":
+                    track.encoding = track.h[0]
+                else:
+                    # The oldest chain has consumed obs_len inputs -> encoding of the current window
+                    track.encoding = track.h[0]
+                    track.h, track.c = track.h[1:], track.c[1:]
+
+        return evicted
+
+    def ready_tracks(self):
+        """
+        Tracks observed in the current frame with a complete window
+        """
+        return [track_id for track_id, track in self.tracks.items()
+                if track.encoding is not None and track.last_frame == self.frame]
+
+    def _build_scenes(self, target_ids):
+        ready = self.ready_tracks()
+        last_pos = {track_id: self.tracks[track_id].positions[-1] for track_id in ready}
+
+        scene_ids = []
+        for target_id in target_ids:
+            assert target_id in last_pos, "Track {} has not a complete window".format(target_id)
+            scene = [target_id]
+            for track_id in ready:
+                if track_id == target_id:
+                    continue
+                if self.distance_threshold is not None and \
+                   torch.norm(last_pos[track_id] - last_pos[target_id]) > self.distance_threshold:
+                    continue
+                scene.append(track_id)
+            scene_ids.append(scene)
+        return scene_ids
+
+    @torch.no_grad()
+    def predict(self, target_ids=None):
+        """
+        Run social attention and decoding for the given targets
+        Input:
+            target_ids (list or None): tracks to predict. None -> every ready track
+        Output:
+            dict with
+                track_ids: list (b)
+                pred_traj_rel: torch.Tensor (b,m,pred_len,2)
+                pred_traj: torch.Tensor (b,m,pred_len,2) -> obs_origin frame if obs_origin is not None,
+                           else map coordinates
+                conf: torch.Tensor (b,m)
+                origin: torch.Tensor (b,2) -> origin of each target scene in map coordinates
+        """
+        if target_ids is None:
+            target_ids = self.ready_tracks()
+        if len(target_ids) == 0:
+            return None
+
+        scene_ids = self._build_scenes(target_ids)
+
+        obs_traj, encodings, origins, agent_idx, seq_start_end = [], [], [], [], []
+        start = 0
+        for scene in scene_ids:
+            target = self.tracks[scene[0]]
+            if self.obs_origin is not None:
+                origin = target.positions[self.obs_origin-1]
+            else:
+                origin = torch.zeros(2)
+            for track_id in scene:
+                track = self.tracks[track_id]
+                obs_traj.append(torch.stack(track.positions, dim=0) - origin) # obs_len x 2
+                encodings.append(track.encoding)
+            origins.append(origin)
+            agent_idx.append(start)
+            seq_start_end.append([start, start + len(scene)])
+            start += len(scene)
+
+        obs_traj = torch.stack(obs_traj, dim=1).to(self.device) # obs_len x n x 2
+        obs_traj_rel = torch.zeros_like(obs_traj)
+        obs_traj_rel[1:] = obs_traj[1:] - obs_traj[:-1]
+        final_encoder_h = torch.stack(encodings, dim=0) # n x h_dim
+        seq_start_end = torch.LongTensor(seq_start_end).to(self.device)
+        agent_idx = np.array(agent_idx)
+        origins = torch.stack(origins, dim=0).to(self.device)
+
+        self.generator.eval()
+        pred_traj_fake_rel, conf = self.generator.decode_from_encoding(
+            final_encoder_h, obs_traj, obs_traj_rel, seq_start_end, agent_idx
+        )
+        pred_traj_fake = relative_to_abs_sgan_multimodal(pred_traj_fake_rel, obs_traj[-1, agent_idx, :])
+
+        return {
+            "track_ids": list(target_ids),
+            "pred_traj_rel": pred_traj_fake_rel,
+            "pred_traj": pred_traj_fake,
+            "conf": conf,
+            "origin": origins
+        }
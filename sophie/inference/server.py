@@ -0,0 +1,335 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+
+"""
+Local micro-batching inference server for the generators (stdlib HTTP, no external services).
+
+Requests (scenes) are queued and gathered by a single worker thread into dynamic micro-batches,
+bounded by max_batch scenes and max_wait_ms since the first queued scene. Every micro-batch is run
+as ONE generator forward (scenes concatenated with seq_start_end, as in seq_collate).
+
+Usage:
+    python -m sophie.inference.server --model_path save/argoverse/soconf_exp/x_with_model.pt --port 8000
+    python -m sophie.inference.server --model_path ... --load_test --num_clients 16 --num_requests 2000
+
+POST /predict
+    {"obs_traj": [[[x,y], ...obs_len], ...num_agents], "agent_index": 0}
+    obs_traj in the obs_origin-relative frame (as obs_traj in ArgoverseMotionForecastingDataset)
+    -> {"pred_traj": [[[x,y], ...pred_len], ...num_modes], "conf": [...num_modes]}
+GET /stats
+    -> throughput and batching statistics
+"""
+
+import argparse
+import json
+import queue
+import random
+import threading
+import time
+import urllib.request
+import numpy as np
+
+import torch
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sophie.models.mp_soconf import TrajectoryGenerator
+from sophie.utils.utils import relative_to_abs_sgan_multimodal
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--model_path', required=True, type=str)
+parser.add_argument('--host', default='127.0.0.1', type=str)
+parser.add_argument('--port', default=8000, type=int)
+parser.add_argument('--device', default='cpu', type=str)
+parser.add_argument('--num_threads', default=0, type=int, help="torch intra-op threads (0 -> torch default)")
+parser.add_argument('--h_dim', default=32, type=int)
+parser.add_argument('--n_samples', default=6, type=int)
+parser.add_argument('--obs_len', default=20, type=int)
+parser.add_argument('--max_batch', default=32, type=int)
+parser.add_argument('--max_wait_ms', default=5.0, type=float)
+parser.add_argument('--load_test', action='store_true')
+parser.add_argument('--num_clients', default=8, type=int)
+parser.add_argument('--num_requests', default=1000, type=int)
+parser.add_argument('--num_agents', default=10, type=int)
+
+def load_generator(model_path, h_dim=32, n_samples=6, device="cpu"):
+    """
+    Load an exported (TorchScript) or checkpointed generator
+        - TorchScript archive (torch.jit.save)
+        - Checkpoint object or dict saved by the trainers (g_best_state, else g_state)
+        - Plain generator state_dict
+    """
+    try:
+        generator = torch.jit.load(model_path, map_location=device)
+        generator.eval()
+        return generator
+    except (RuntimeError, ValueError): # Not a TorchScript archive
+        pass
+
+    checkpoint = torch.load(model_path, map_location=device)
+    if hasattr(checkpoint, "config_cp"):
+        checkpoint = checkpoint.config_cp
+    if "g_best_state" in checkpoint or "g_state" in checkpoint:
+        state_dict = checkpoint["g_best_state"] if checkpoint.get("g_best_state") is not None else checkpoint["g_state"]
+    else:
+        state_dict = checkpoint
+
+    generator = TrajectoryGenerator(h_dim=h_dim, n_samples=n_samples)
+    # strict: a checkpoint of another architecture (or h_dim / n_samples) fails here instead of being served
+    generator.load_state_dict(state_dict, strict=True)
+    generator.to(device)
+    generator.eval()
+    return generator
+
+class PendingRequest():
+    def __init__(self, obs_traj, agent_index):
+        self.obs_traj = obs_traj # obs_len x num_agents x 2
+        self.agent_index = agent_index
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.t_arrival = time.perf_counter()
+
+class MicroBatcher():
+    """
+    Gathers queued scenes into micro-batches and runs them through the generator
+    """
+    def __init__(self, generator, max_batch=32, max_wait_ms=5.0, device="cpu"):
+        self.generator = generator
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.device = torch.device(device)
+        self.requests = queue.Queue()
+        self.stop_event = threading.Event()
+
+        self.lock = threading.Lock()
+        self.num_batches = 0
+        self.num_scenes = 0
+        self.busy_time = 0.0
+        self.t_start = time.perf_counter()
+
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, obs_traj, agent_index=0, timeout=None):
+        request = PendingRequest(obs_traj, agent_index)
+        self.requests.put(request)
+        if not request.done.wait(timeout):
+            raise TimeoutError("Inference request timed out")
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def stats(self):
+        with self.lock:
+            elapsed = time.perf_counter() - self.t_start
+            return {
+                "num_batches": self.num_batches,
+                "num_scenes": self.num_scenes,
+                "mean_batch_size": self.num_scenes / max(self.num_batches, 1),
+                "scenes_per_second": self.num_scenes / max(elapsed, 1e-9),
+                "utilization": self.busy_time / max(elapsed, 1e-9)
+            }
+
+    def close(self):
+        self.stop_event.set()
+        self.worker.join()
+
+    def _gather(self):
+        try:
+            first = self.requests.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first.t_arrival + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            batch = self._gather()
+            if len(batch) == 0:
+                continue
+            t0 = time.perf_counter()
+            try:
+                self._forward(batch)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
+            with self.lock:
+                self.num_batches += 1
+                self.num_scenes += len(batch)
+                self.busy_time += time.perf_counter() - t0
+
+    @torch.no_grad()
+    def _forward(self, batch):
+        obs_traj, seq_start_end, agent_idx = [], [], []
+        start = 0
+        for request in batch:
+            num_agents = request.obs_traj.shape[1]
+            obs_traj.append(request.obs_traj)
+            seq_start_end.append([start, start + num_agents])
+            agent_idx.append(start + request.agent_index)
+            start += num_agents
+
+        obs_traj = torch.from_numpy(np.concatenate(obs_traj, axis=1)).type(torch.float32).to(self.device)
+        obs_traj_rel = torch.zeros_like(obs_traj)
+        obs_traj_rel[1:] = obs_traj[1:] - obs_traj[:-1]
+        seq_start_end = torch.LongTensor(seq_start_end).to(self.device)
+        agent_idx = np.array(agent_idx)
+
+        pred_traj_fake_rel, conf = self.generator(obs_traj, obs_traj_rel, seq_start_end, agent_idx)
+        pred_traj_fake = relative_to_abs_sgan_multimodal(pred_traj_fake_rel, obs_traj[-1, agent_idx, :])
+
+        pred_traj_fake = pred_traj_fake.cpu().numpy()
+        conf = conf.cpu().numpy()
+        for i, request in enumerate(batch):
+            request.result = {"pred_traj": pred_traj_fake[i].tolist(), "conf": conf[i].tolist()}
+
+def make_handler(batcher, obs_len):
+    class InferenceHandler(BaseHTTPRequestHandler):
+        def _reply(self, code, content):
+            body = json.dumps(content).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._reply(200, batcher.stats())
+            else:
+                self._reply(404, {"error": "unknown path {}".format(self.path)})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self._reply(404, {"error": "unknown path {}".format(self.path)})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                scene = json.loads(self.rfile.read(length))
+                obs_traj = np.asarray(scene["obs_traj"], dtype=np.float32)
+                # Checked here: a wrong shape would make the whole micro-batch fail
+                assert obs_traj.ndim == 3 and obs_traj.shape[0] > 0 and obs_traj.shape[1:] == (obs_len, 2), \
+                       "obs_traj must be num_agents x {} x 2, got {}".format(obs_len, obs_traj.shape)
+                obs_traj = obs_traj.transpose(1, 0, 2) # obs_len x n x 2
+                agent_index = int(scene.get("agent_index", 0))
+                assert 0 <= agent_index < obs_traj.shape[1], "agent_index out of range"
+            except Exception as e:
+                self._reply(400, {"error": str(e)})
+                return
+            try:
+                self._reply(200, batcher.submit(obs_traj, agent_index))
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return InferenceHandler
+
+def serve(batcher, host, port, obs_len):
+    server = ThreadingHTTPServer((host, port), make_handler(batcher, obs_len))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def random_scene(num_agents, obs_len):
+    """
+    Synthetic scene (constant velocity + noise) in the obs_origin-relative frame
+    """
+    vel = np.random.uniform(-2, 2, size=(num_agents, 1, 2))
+    steps = np.arange(-obs_len+1, 1).reshape(1, -1, 1)
+    obs_traj = vel * steps + np.random.normal(0, 0.05, size=(num_agents, obs_len, 2))
+    obs_traj += np.random.uniform(-20, 20, size=(num_agents, 1, 2))
+    return {"obs_traj": obs_traj.tolist(), "agent_index": random.randrange(num_agents)}
+
+def run_load_test(url, num_clients, num_requests, num_agents, obs_len):
+    """
+    Closed-loop load generator: num_clients threads sending num_requests scenes in total
+    Output:
+        dict with throughput (requests/s) and latency percentiles (ms)
+    """
+    scenes = [json.dumps(random_scene(num_agents, obs_len)).encode() for _ in range(64)]
+    latencies, errors = [], []
+    lock = threading.Lock()
+    counter = iter(range(num_requests))
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            request = urllib.request.Request(url + "/predict", data=scenes[i % len(scenes)],
+                                             headers={"Content-Type": "application/json"})
+            t0 = time.perf_counter()
+            try:
+                urllib.request.urlopen(request).read()
+                latency = time.perf_counter() - t0
+                with lock:
+                    latencies.append(latency)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(num_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - t0
+
+    latencies_ms = np.array(latencies) * 1000.0 if len(latencies) > 0 else np.zeros(1)
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed,
+        "latency_ms_mean": float(latencies_ms.mean()),
+        "latency_ms_p50": float(np.percentile(latencies_ms, 50)),
+        "latency_ms_p95": float(np.percentile(latencies_ms, 95)),
+        "latency_ms_p99": float(np.percentile(latencies_ms, 99)),
+        "latency_ms_max": float(latencies_ms.max())
+    }
+
+def main(args):
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+
+    generator = load_generator(args.model_path, h_dim=args.h_dim, n_samples=args.n_samples, device=args.device)
+    batcher = MicroBatcher(generator, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms, device=args.device)
+    server = serve(batcher, args.host, args.port, args.obs_len)
+    url = "http://{}:{}".format(args.host, server.server_address[1])
+    print("Serving on {} (max_batch={}, max_wait_ms={})".format(url, args.max_batch, args.max_wait_ms))
+
+    if args.load_test:
+        report = run_load_test(url, args.num_clients, args.num_requests, args.num_agents, args.obs_len)
+        report.update(batcher.stats())
+        print(json.dumps(report, indent=4))
+        server.shutdown()
+        batcher.close()
+        return
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        batcher.close()
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    main(args)
@@ -75,11 +75,9 @@ class mmTrans(nn.Module):
                 social mask: [batch, 1, max_agent_num]
         '''
         # social mask
-        social_valid_len = self.traj_valid_len
-        social_mask = torch.zeros(
-            (self.B, 1, int(self.max_agent_num))).to(traj.device)
-        for i in range(self.B):
-            social_mask[i, 0, :social_valid_len[i]] = 1
+        social_valid_len = self.traj_valid_len.to(traj.device)
+        social_mask = (torch.arange(int(self.max_agent_num), device=traj.device)[None, :]
+                       < social_valid_len[:, None]).float().unsqueeze(1)
 
         return social_mask
 
@@ -100,11 +98,9 @@ class mmTrans(nn.Module):
              lane[:, :, 1:, 2:]], dim=-1)  # bxnlinex9x7
 
         # lane mask
-        lane_valid_len = self.lane_valid_len
-        lane_mask = torch.zeros(
-            (self.B, 1, int(self.max_lane_num))).to(lane_v.device)
-        for i in range(lane_valid_len.shape[0]):
-            lane_mask[i, 0, :lane_valid_len[i]] = 1
+        lane_valid_len = self.lane_valid_len.to(lane_v.device)
+        lane_mask = (torch.arange(int(self.max_lane_num), device=lane_v.device)[None, :]
+                     < lane_valid_len[:, None]).float().unsqueeze(1)
 
         # use vector like structure process lane
         lane_feature = self.subgraph(lane_v)  # [batch size, max_lane_num, 64]
@@ -19,8 +19,8 @@ def make_mlp(dim_list):
         layers.append(nn.LeakyReLU())
     return nn.Sequential(*layers)
 
-def get_noise(shape):
-    return torch.randn(*shape).cuda()
+def get_noise(shape, device="cuda"):
+    return torch.randn(*shape, device=device)
 
 
 class TrajectoryGenerator(nn.Module):
@@ -57,7 +57,7 @@ class TrajectoryGenerator(nn.Module):
     def add_noise(self, _input):
         npeds = _input.size(0)
         noise_shape = (self.noise_dim,)
-        z_decoder = get_noise(noise_shape)
+        z_decoder = get_noise(noise_shape, _input.device)
         vec = z_decoder.view(1, -1).repeat(npeds, 1)
         return torch.cat((_input, vec), dim=1)
 
@@ -108,7 +108,7 @@ class TrajectoryGenerator(nn.Module):
         decoder_h = self.add_noise(noise_input) # 80x32
         decoder_h = torch.unsqueeze(decoder_h, 0) # 1x80x32
 
-        decoder_c = torch.zeros(tuple(decoder_h.shape)).cuda() # 1x80x32
+        decoder_c = torch.zeros_like(decoder_h) # 1x80x32
         state_tuple = (decoder_h, decoder_c)
 
         # Get agent observations
@@ -82,6 +82,15 @@ class TrajectoryGenerator(nn.Module):
         """
         ## Encode trajectory
         final_encoder_h = self.encoder(obs_traj_rel) # batchx32
+        return self.decode_from_encoding(final_encoder_h, obs_traj, obs_traj_rel, start_end_seq, agent_idx)
+
+    def decode_from_encoding(self, final_encoder_h, obs_traj, obs_traj_rel, start_end_seq, agent_idx=None):
+        """
+            Social attention + decoding given the encoder output. Split from forward so that
+            the online predictor (sophie/inference) can reuse cached encoder states
+            final_encoder_h: (n,32)
+            (remaining arguments as in forward)
+        """
         final_encoder_h = torch.unsqueeze(final_encoder_h, 0) #  1xbatchx32
         # queries -> indican la forma del tensor de salida (primer argumento)
         final_encoder_h = self.lne(final_encoder_h)
@@ -112,7 +121,7 @@ class TrajectoryGenerator(nn.Module):
         decoder_h = self.linear_noise(noise_input) # 80 x 32 # TODO: Is this correct?
         decoder_h = torch.unsqueeze(decoder_h, 0) # 1x80x32
 
-        decoder_c = torch.zeros(tuple(decoder_h.shape)).cuda() # 1x80x32
+        decoder_c = torch.zeros_like(decoder_h) # 1x80x32
         state_tuple = (decoder_h, decoder_c)
 
         # Get agent observations
@@ -18,8 +18,8 @@ def make_mlp(dim_list):
         layers.append(nn.LeakyReLU())
     return nn.Sequential(*layers)
 
-def get_noise(shape):
-    return torch.randn(*shape).cuda()
+def get_noise(shape, device="cuda"):
+    return torch.randn(*shape, device=device)
 
 
 class TrajectoryGenerator(nn.Module):
@@ -56,7 +56,7 @@ class TrajectoryGenerator(nn.Module):
     def add_noise(self, _input):
         npeds = _input.size(0)
         noise_shape = (self.noise_dim,)
-        z_decoder = get_noise(noise_shape)
+        z_decoder = get_noise(noise_shape, _input.device)
         vec = z_decoder.view(1, -1).repeat(npeds, 1)
         return torch.cat((_input, vec), dim=1)
 
@@ -106,7 +106,7 @@ class TrajectoryGenerator(nn.Module):
         decoder_h = self.add_noise(noise_input) # 80x32
         decoder_h = torch.unsqueeze(decoder_h, 0) # 1x80x32
 
-        decoder_c = torch.zeros(tuple(decoder_h.shape)).cuda() # 1x80x32
+        decoder_c = torch.zeros_like(decoder_h) # 1x80x32
         state_tuple = (decoder_h, decoder_c)
 
         # Get agent observations
@@ -132,4 +132,32 @@ class TrajectoryDiscriminator(nn.Module):
 
         final_h = self.encoder(traj_rel)
         scores = self.real_classifier(final_h)
-        return scores
\ No newline at end of file
+        return scores
+
+    def score_modes(self, obs_traj_rel, pred_traj_fake_rel, pred_traj_gt_rel=None):
+        """
+        Score the m predicted futures (and the ground truth) of every agent. The observed history is
+        encoded once and its LSTM state is branched for every future, so the scores are the same as
+        forward() on the full (history + future) trajectories
+        Input:
+            obs_traj_rel: (obs_len, n, 2)
+            pred_traj_fake_rel: (n, m, pred_len, 2)
+            pred_traj_gt_rel: (pred_len, n, 2) or None
+        Output:
+            scores_fake: (n·m, 1) agent-major, mode-minor (as the repeat_interleaved trajectories)
+            scores_real: (n, 1) or None
+        """
+        n, m, pred_len, _ = pred_traj_fake_rel.shape
+        h, c = self.encoder.encode(obs_traj_rel) # 1 x n x h_dim
+
+        futures = pred_traj_fake_rel.reshape(n*m, pred_len, 2).permute(1, 0, 2) # pred_len x n·m x 2
+        branch_h, branch_c = h.repeat_interleave(m, dim=1), c.repeat_interleave(m, dim=1)
+        if pred_traj_gt_rel is not None:
+            futures = torch.cat([futures, pred_traj_gt_rel], dim=1)
+            branch_h, branch_c = torch.cat([branch_h, h], dim=1), torch.cat([branch_c, c], dim=1)
+
+        final_h = self.encoder.encode(futures, (branch_h.contiguous(), branch_c.contiguous()))[0]
+        scores = self.real_classifier(final_h.view(-1, self.h_dim))
+        if pred_traj_gt_rel is None:
+            return scores, None
+        return scores[:n*m], scores[n*m:]
\ No newline at end of file
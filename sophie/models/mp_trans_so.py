@@ -155,7 +155,7 @@ class TrajectoryGenerator(nn.Module):
         x = self.mlp_decoder_context(self.lnc(x.view(nb, -1))) # (b, h_dim)
         decoder_h = torch.unsqueeze(x, 0) # 1x80x32
 
-        decoder_c = torch.zeros(tuple(decoder_h.shape)).cuda() # 1x80x32
+        decoder_c = torch.zeros_like(decoder_h) # 1x80x32
         state_tuple = (decoder_h, decoder_c)
 
         # Get agent observations
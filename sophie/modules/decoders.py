@@ -235,7 +235,6 @@ class GoalMMDecoderLSTM(nn.Module):
             pred_traj_fake_rel.append(rel_pos.contiguous().view(batch_size,-1))
 
         pred_traj_fake_rel = torch.stack(pred_traj_fake_rel, dim=0)
-        pdb.set_trace()
         pred_traj_fake_rel = pred_traj_fake_rel.view(self.seq_len, batch_size, self.n_samples, -1)
         pred_traj_fake_rel = pred_traj_fake_rel.permute(1,2,0,3) #(b, m, 30, 2)
         conf = self.confidences(state_tuple[0].contiguous().view(-1, self.h_dim))
@@ -14,20 +14,48 @@ class EncoderLSTM(nn.Module):
         self.encoder = nn.LSTM(self.embedding_dim, self.h_dim, 1)
         self.spatial_embedding = nn.Linear(2, self.embedding_dim)
 
-    def init_hidden(self, batch):
-        h = torch.zeros(1,batch, self.h_dim).cuda()
-        c = torch.zeros(1,batch, self.h_dim).cuda()
+    def init_hidden(self, batch, device=None):
+        if device is None:
+            device = torch.device("cuda")
+        h = torch.zeros(1,batch, self.h_dim, device=device)
+        c = torch.zeros(1,batch, self.h_dim, device=device)
         return h, c
 
+    def step(self, traj_rel_step, state):
+        """
+        Advance the LSTM a single timestep (online inference)
+            traj_rel_step: (n,2) -> displacement of the new observation
+            state: h and c
+                h : c : (1, n, self.h_dim)
+        """
+        n = traj_rel_step.size(0)
+        step_embedding = F.leaky_relu(self.spatial_embedding(traj_rel_step.contiguous().view(-1, 2)))
+        step_embedding = step_embedding.view(1, n, self.embedding_dim)
+        _, state = self.encoder(step_embedding, state)
+        return state
+
+    def encode(self, traj_rel, state=None):
+        """
+        Run the LSTM over a sequence of displacements, starting from state (zeros if None)
+            traj_rel: (seq_len, n, 2)
+            state: h and c
+                h : c : (1, n, self.h_dim)
+        Output: final state (h and c)
+        """
+        npeds = traj_rel.size(1)
+
+        traj_embedding = F.leaky_relu(self.spatial_embedding(traj_rel.contiguous().view(-1, 2)))
+        traj_embedding = traj_embedding.view(-1, npeds, self.embedding_dim)
+        if state is None:
+            state = self.init_hidden(npeds, traj_rel.device)
+        output, state = self.encoder(traj_embedding, state)
+        return state
+
     def forward(self, obs_traj):
 
         npeds = obs_traj.size(1)
 
-        obs_traj_embedding = F.leaky_relu(self.spatial_embedding(obs_traj.contiguous().view(-1, 2)))
-        obs_traj_embedding = obs_traj_embedding.view(-1, npeds, self.embedding_dim)
-        state = self.init_hidden(npeds)
-        output, state = self.encoder(obs_traj_embedding, state)
-        final_h = state[0]
+        final_h = self.encode(obs_traj)[0]
         final_h = final_h.view(npeds, self.h_dim)
         return final_h
 
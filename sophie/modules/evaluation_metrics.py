@@ -31,4 +31,38 @@ def final_displacement_error(
     if mode == 'raw':
         return loss
     else:
-        return torch.sum(loss)
\ No newline at end of file
+        return torch.sum(loss)
+
+
+def drivable_area_compliance(pred_traj, drivable_masks, origin, real_world_offset, outside_drivable=False):
+    """
+    Off-road metric: ratio of predicted points inside the drivable area, for every mode, with a single
+    gather in the batch of binary masks (rasterized maps centered on the origin of each scene, x to the
+    right and y upwards, 2·real_world_offset meters per side, see dataset_utils.transform_real_world2px)
+
+    Input:
+        pred_traj: torch.tensor (B, M, T, 2) in global (map) coordinates
+        drivable_masks: torch.tensor (B, H, W) bool (or 0/1), True = drivable
+        origin: torch.tensor (B, 2) (or (B, 1, 2)) map coordinates of the center of every mask
+        real_world_offset: meters from the center to each side of the masks
+        outside_drivable: value of the points outside the masks
+    Output:
+        compliance: torch.tensor (B, M), 1 -> every point of the mode is drivable
+        drivable: torch.tensor (B, M, T) bool
+    """
+    b, m, t, _ = pred_traj.shape
+    _, height, width = drivable_masks.shape
+    origin = origin.reshape(b, 1, 1, 2).type(pred_traj.dtype)
+    local = pred_traj - origin
+
+    px_x = torch.floor((local[..., 0] + real_world_offset) * (width / (2 * real_world_offset))).long()
+    px_y = torch.floor((real_world_offset - local[..., 1]) * (height / (2 * real_world_offset))).long()
+    inside = (px_x >= 0) & (px_x < width) & (px_y >= 0) & (px_y < height)
+
+    batch_offset = (torch.arange(b, device=pred_traj.device) * height * width).reshape(b, 1, 1)
+    flat_idx = batch_offset + px_y.clamp(0, height - 1) * width + px_x.clamp(0, width - 1)
+    drivable = drivable_masks.reshape(-1).bool()[flat_idx.reshape(-1)].reshape(b, m, t)
+    drivable = torch.where(inside, drivable, torch.full_like(drivable, outside_drivable))
+
+    compliance = drivable.float().mean(dim=2)
+    return compliance, drivable
@@ -5,6 +5,15 @@ import numpy as np
 from torch import Tensor
 import pdb
 
+# Input validation of the multimodal losses (shape asserts, finite values, confidences summing to 1).
+# Every value check forces a device synchronization, so they can be disabled in production runs
+
+_validate_inputs = True
+
+def configure_loss_validation(enabled=True):
+    global _validate_inputs
+    _validate_inputs = enabled
+
 def bce_loss(input, target):
     neg_abs = -input.abs()
     loss = input.clamp(min=0) - input * target + (1 + neg_abs.exp()).log()
@@ -128,30 +137,8 @@ def pytorch_neg_multi_log_likelihood_batch(
     Returns:
         Tensor: negative log-likelihood for this example, a single float number
     """
-    assert len(pred.shape) == 4, f"expected 3D (MxTxC) array for pred, got {pred.shape}"
-    batch_size, num_modes, future_len, num_coords = pred.shape
-
-    assert gt.shape == (
-        batch_size,
-        future_len,
-        num_coords,
-    ), f"expected 2D (Time x Coords) array for gt, got {gt.shape}"
-    assert confidences.shape == (
-        batch_size,
-        num_modes,
-    ), f"expected 1D (Modes) array for gt, got {confidences.shape}"
-    assert torch.allclose(
-        torch.sum(confidences, dim=1), confidences.new_ones((batch_size,))
-    ), "confidences should sum to 1"
-    assert avails.shape == (
-        batch_size,
-        future_len,
-    ), f"expected 1D (Time) array for gt, got {avails.shape}"
-    # assert all data are valid
-    assert torch.isfinite(pred).all(), "invalid value found in pred"
-    assert torch.isfinite(gt).all(), "invalid value found in gt"
-    assert torch.isfinite(confidences).all(), "invalid value found in confidences"
-    assert torch.isfinite(avails).all(), "invalid value found in avails"
+    if _validate_inputs:
+        _check_multimodal_inputs(gt, pred, confidences, avails)
 
     # convert to (batch_size, num_modes, future_len, num_coords)
     gt = torch.unsqueeze(gt, 1)  # add modes
@@ -162,6 +149,12 @@ def pytorch_neg_multi_log_likelihood_batch(
         ((gt - pred) * avails) ** 2, dim=-1
     )  # reduce coords and use availability
 
+    return _neg_multi_log_likelihood(error, confidences, epsilon, is_reduce)
+
+def _neg_multi_log_likelihood(error, confidences, epsilon=1.0e-8, is_reduce=True):
+    """
+    error: (batch_size, num_modes, future_len) squared errors (with availability)
+    """
     with np.errstate(
         divide="ignore"
     ):  # when confidence is 0 log goes to -inf, but we're fine with it
@@ -183,6 +176,74 @@ def pytorch_neg_multi_log_likelihood_batch(
     else:
         return error
 
+def _check_multimodal_inputs(gt, pred, confidences, avails):
+    assert len(pred.shape) == 4, f"expected 3D (MxTxC) array for pred, got {pred.shape}"
+    batch_size, num_modes, future_len, num_coords = pred.shape
+
+    assert gt.shape == (
+        batch_size,
+        future_len,
+        num_coords,
+    ), f"expected 2D (Time x Coords) array for gt, got {gt.shape}"
+    assert confidences.shape == (
+        batch_size,
+        num_modes,
+    ), f"expected 1D (Modes) array for gt, got {confidences.shape}"
+    assert torch.allclose(
+        torch.sum(confidences, dim=1), confidences.new_ones((batch_size,))
+    ), "confidences should sum to 1"
+    assert avails.shape == (
+        batch_size,
+        future_len,
+    ), f"expected 1D (Time) array for gt, got {avails.shape}"
+    # assert all data are valid
+    assert torch.isfinite(pred).all(), "invalid value found in pred"
+    assert torch.isfinite(gt).all(), "invalid value found in gt"
+    assert torch.isfinite(confidences).all(), "invalid value found in confidences"
+    assert torch.isfinite(avails).all(), "invalid value found in avails"
+
+def multimodal_loss(gt, pred, confidences=None, avails=None, epsilon=1.0e-8):
+    """
+    Fused multimodal loss: the squared errors are computed once over (B,M,T,2) and the NLL, the
+    per-mode ADE/FDE (mean euclidean distance, as mse_custom) and the best-of-K errors are derived
+    from them (no loop over modes, no extra allocations for avails)
+
+    Input:
+        gt: (b,t,2)
+        pred: (b,m,t,2)
+        confidences: (b,m) or None (no NLL)
+        avails: (b,t) or None (all the gt timesteps are available)
+    Output:
+        dict with
+            nll: NLL (mean over the batch), if confidences is given
+            ade, fde: mean over modes of the per-mode (mean over the batch) ADE/FDE
+            ade_per_mode, fde_per_mode: (b,m)
+            min_ade, min_fde: (b,) best-of-K
+            best_mode: (b,) mode with the minimum ADE
+    """
+    if _validate_inputs and confidences is not None:
+        b, _, t, _ = pred.shape
+        _check_multimodal_inputs(gt, pred, confidences,
+                                 avails if avails is not None else pred.new_ones((b, t)))
+
+    error = pred - gt.unsqueeze(1)
+    if avails is not None:
+        error = error * avails[:, None, :, None]
+    error = torch.sum(error ** 2, dim=-1) # b, m, t
+    dist = torch.sqrt(error) # b, m, t
+
+    out = {}
+    if confidences is not None:
+        out["nll"] = _neg_multi_log_likelihood(error, confidences, epsilon)
+
+    out["ade_per_mode"] = dist.mean(dim=2)
+    out["fde_per_mode"] = dist[:, :, -1]
+    out["ade"] = out["ade_per_mode"].mean()
+    out["fde"] = out["fde_per_mode"].mean()
+    out["min_ade"], out["best_mode"] = out["ade_per_mode"].min(dim=1)
+    out["min_fde"] = out["fde_per_mode"].min(dim=1)[0]
+    return out
+
 
 def pytorch_neg_multi_log_likelihood_single(
     gt: Tensor, pred: Tensor, avails: Tensor
@@ -320,40 +381,22 @@ def evaluate_feasible_area_prediction(pred_traj_fake_abs, distance_threshold, or
 
     Input:
         pred_traj_fake_abs: Torch.tensor -> pred_len x 2 (x|y) in global (map) coordinates
+        distance_threshold: real world offset (m) of the rasterized map around origin_pos
+        origin_pos: (1,2) center of the rasterized map in global coordinates
         filename: Image filename to read
     Output:
-        feasible_area_loss: min = 0 (num_points · 1), max = pred_len (num_points · 1)
+        feasible_area_loss: list (pred_len) of 1 (drivable) or 0. See evaluation_metrics.drivable_area_compliance
+        for the batched (B,M,T,2) version
     """
+    from sophie.data_loader.argoverse.dataset_utils import get_drivable_mask
+    from sophie.modules.evaluation_metrics import drivable_area_compliance
 
-    img_map = cv2.imread(filename)
-    img_map = cv2.resize(img_map, dsize=(600,600))
-    img_map_gray = cv2.cvtColor(img_map,cv2.COLOR_BGR2GRAY)
-    height, width = img_map.shape
-    img_size = height
-
-    xcenter, ycenter = origin_pos[0][0], origin_pos[0][1]
-    x_min = xcenter + offset[0]
-    x_max = xcenter + offset[1]
-    y_min = ycenter + offset[2]
-    y_max = ycenter + offset[3]
-
-    # Transform global point to pixel
-
-    m_x = float(img_size / (2 * real_world_offset)) # slope
-    m_y = float(-img_size / (2 * real_world_offset))
-
-    i_x = float(-(img_size / (2 * real_world_offset)) * x_min) # intercept
-    i_y = float((img_size / (2 * real_world_offset)) * y_max)
-
-    feasible_area_loss = []
-
-    for i in range(pred_traj_fake_abs.shape[0]): # pred_len
-        pix_x = pt[i,0] * m_x + i_x
-        pix_y = pt[i,1] * m_y + i_y
+    pred_traj_fake_abs = torch.as_tensor(pred_traj_fake_abs, dtype=torch.float)
+    mask = torch.from_numpy(get_drivable_mask(filename)).to(pred_traj_fake_abs.device)
+    origin = torch.as_tensor(np.asarray(origin_pos, dtype=np.float32).reshape(1,2), device=pred_traj_fake_abs.device)
 
-        if img_map[pix_y,pix_x] == 255.0:
-            feasible_area_loss.append(1)
-        else:
-            feasible_area_loss.append(0)
+    _, drivable = drivable_area_compliance(pred_traj_fake_abs.reshape(1, 1, -1, 2), mask.unsqueeze(0),
+                                           origin, distance_threshold)
+    feasible_area_loss = drivable.reshape(-1).long().tolist()
 
     return feasible_area_loss
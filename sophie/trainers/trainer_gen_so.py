@@ -15,7 +15,8 @@ import torch.optim.lr_scheduler as lrs
 from torch.cuda.amp import GradScaler, autocast 
 
 # from sophie.data_loader.argoverse.dataset_sgan_version import ArgoverseMotionForecastingDataset, seq_collate
-from sophie.data_loader.argoverse.dataset_sgan_version_data_augs import ArgoverseMotionForecastingDataset, seq_collate
+from sophie.data_loader.argoverse.dataset_sgan_version_data_augs import ArgoverseMotionForecastingDataset, seq_collate, \
+                                                                          seed_worker
 from sophie.models.mp_so import TrajectoryGenerator
 from sophie.modules.losses import gan_g_loss, l2_loss, gan_g_loss_bce, pytorch_neg_multi_log_likelihood_batch, mse_custom
 from sophie.modules.evaluation_metrics import displacement_error, final_displacement_error
@@ -111,7 +112,8 @@ def model_trainer(config, logger):
                               batch_size=config.dataset.batch_size,
                               shuffle=config.dataset.shuffle,
                               num_workers=config.dataset.num_workers,
-                              collate_fn=seq_collate)
+                              collate_fn=seq_collate,
+                              worker_init_fn=seed_worker)
 
     logger.info("Initializing val dataset")
     data_val = ArgoverseMotionForecastingDataset(dataset_name=config.dataset_name,
@@ -14,7 +14,10 @@ from torch.utils.data import DataLoader
 import torch.optim.lr_scheduler as lrs
 from torch.cuda.amp import GradScaler, autocast 
 
-from sophie.data_loader.argoverse.dataset_sgan_version_data_augs import ArgoverseMotionForecastingDataset, seq_collate
+import sophie.data_loader.argoverse.dataset_sgan_version_data_augs as dataset_module
+from sophie.data_loader.argoverse.dataset_sgan_version_data_augs import ArgoverseMotionForecastingDataset, seq_collate, \
+                                                                          seed_worker
+from sophie.data_loader.argoverse.batch_augs import BatchAugmentation
 from sophie.models.mp_so_goals import TrajectoryGenerator
 from sophie.modules.losses import gan_g_loss, l2_loss, gan_g_loss_bce, pytorch_neg_multi_log_likelihood_batch, mse_custom
 from sophie.modules.evaluation_metrics import displacement_error, final_displacement_error
@@ -110,7 +113,8 @@ def model_trainer(config, logger):
                               batch_size=config.dataset.batch_size,
                               shuffle=config.dataset.shuffle,
                               num_workers=config.dataset.num_workers,
-                              collate_fn=seq_collate)
+                              collate_fn=seq_collate,
+                              worker_init_fn=seed_worker)
 
     logger.info("Initializing val dataset")
     data_val = ArgoverseMotionForecastingDataset(dataset_name=config.dataset_name,
@@ -134,6 +138,16 @@ def model_trainer(config, logger):
     hyperparameters = config.hyperparameters
     optim_parameters = config.optim_parameters
 
+    # Data augmentation on the GPU (batched, after the host to device copy) instead of in seq_collate
+
+    augmentation = None
+    if hyperparameters.gpu_augmentation:
+        dataset_module.APPLY_DATA_AUGMENTATION = False
+        augmentation = BatchAugmentation(erase_prob=dataset_module.dropout_prob[1],
+                                         noise_prob=dataset_module.gaussian_noise_prob[1],
+                                         erase_percentage=0.3, mu=0, sigma=0.5,
+                                         seed=hyperparameters.augmentation_seed, device=device)
+
     iterations_per_epoch = len(data_train) / config.dataset.batch_size
     if hyperparameters.num_epochs:
         hyperparameters.num_iterations = int(iterations_per_epoch * hyperparameters.num_epochs)
@@ -215,7 +229,7 @@ def model_trainer(config, logger):
         for batch in train_loader: # bottleneck
 
             losses_g = generator_step(hyperparameters, batch, generator,
-                                        optimizer_g, loss_f, w_loss)
+                                        optimizer_g, loss_f, w_loss, augmentation)
             checkpoint.config_cp["norm_g"].append(
                 get_total_norm(generator.parameters())
             )
@@ -350,13 +364,16 @@ def model_trainer(config, logger):
 
 
 def generator_step(
-    hyperparameters, batch, generator, optimizer_g, loss_f, w_loss=None
+    hyperparameters, batch, generator, optimizer_g, loss_f, w_loss=None, augmentation=None
 ):
     batch = [tensor.cuda() for tensor in batch]
 
     (obs_traj, pred_traj_gt, obs_traj_rel, pred_traj_gt_rel, non_linear_obj,
      loss_mask, seq_start_end, frames, object_cls, obj_id, ego_origin, _, _) = batch
 
+    if augmentation is not None:
+        obs_traj, pred_traj_gt, obs_traj_rel, _ = augmentation(obs_traj, pred_traj_gt, seq_start_end)
+
     # place holder loss
     losses = {}
     # single agent output idx
@@ -12,19 +12,23 @@ import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import DataLoader
 import torch.optim.lr_scheduler as lrs
-from torch.cuda.amp import GradScaler, autocast 
+from torch.cuda.amp import GradScaler, autocast
 
-from sophie.data_loader.argoverse.dataset_sgan_version_test_map import ArgoverseMotionForecastingDataset, seq_collate
+from sophie.data_loader.argoverse.dataset_sgan_version_test_map import ArgoverseMotionForecastingDataset, seq_collate, \
+                                                                       dist_around, get_frames_kind
+from sophie.data_loader.argoverse.dataset_utils import get_drivable_masks
 from sophie.models.mp_soconf_goals import TrajectoryGenerator, TrajectoryDiscriminator
-from sophie.modules.losses import pytorch_neg_multi_log_likelihood_batch, mse_custom, l2_loss, l2_loss_multimodal
-from sophie.modules.evaluation_metrics import displacement_error, final_displacement_error
-from sophie.utils.checkpoint_data import Checkpoint, get_total_norm
+from sophie.modules.losses import l2_loss_multimodal, multimodal_loss, configure_loss_validation
+from sophie.modules.evaluation_metrics import displacement_error, final_displacement_error, drivable_area_compliance
+from sophie.data_loader.argoverse.batch_augs import BatchAugmentation
+from sophie.utils.checkpoint_data import Checkpoint, AsyncCheckpointWriter, grad_norm
 from sophie.utils.utils import relative_to_abs_sgan_multimodal, create_weights
+from sophie.utils.instrumentation import configure_timer, get_timer, build_profiler, profiler_schedule_done
+from sophie.utils.metric_history import MetricHistory, StepMetrics
 
 from torch.utils.tensorboard import SummaryWriter
 
 torch.backends.cudnn.benchmark = True
-scaler = GradScaler()
 
 def get_lr(optimizer):
     for param_group in optimizer.param_groups:
@@ -43,31 +47,6 @@ def get_dtypes(use_gpu):
         float_dtype = torch.cuda.FloatTensor
     return long_dtype, float_dtype
 
-def calculate_nll_loss(gt, pred, loss_f, confidences):
-    time, bs, _ = gt.shape
-    gt = gt.permute(1,0,2)
-    avails = torch.ones(bs,time).cuda()
-    loss = loss_f(
-        gt, 
-        pred,
-        confidences,
-        avails
-    )
-    return loss
-
-def calculate_mse_loss(gt, pred, loss_f):
-    """
-    pred: (b,m,t,2)
-    """
-    b,m,t,_ = pred.shape
-    pred = pred.permute(1,2,0,3) # (m,t,b,2)
-    loss_ade = torch.zeros(1).to(pred)
-    loss_fde = torch.zeros(1).to(pred)
-    for i in range(m):
-        loss_ade += loss_f(pred[i,:,:,:], gt)
-        loss_fde += loss_f(pred[i][-1].unsqueeze(0), gt[-1].unsqueeze(0))
-    return loss_ade/m, loss_fde/m
-
 
 def model_trainer(config, logger):
     """
@@ -92,7 +71,10 @@ def model_trainer(config, logger):
                                                    shuffle=config.dataset.shuffle,
                                                    batch_size=config.dataset.batch_size,
                                                    class_balance=config.dataset.class_balance,
-                                                   obs_origin=config.hyperparameters.obs_origin)
+                                                   obs_origin=config.hyperparameters.obs_origin,
+                                                   lazy=bool(config.dataset.lazy),
+                                                   lazy_cache_size=config.dataset.lazy_cache_size or 1024,
+                                                   centerlines=bool(config.dataset.candidate_centerlines))
 
     train_loader = DataLoader(data_train,
                               batch_size=config.dataset.batch_size,
@@ -111,7 +93,10 @@ def model_trainer(config, logger):
                                                  split_percentage=config.dataset.split_percentage,
                                                  shuffle=config.dataset.shuffle,
                                                  class_balance=-1,
-                                                 obs_origin=config.hyperparameters.obs_origin)
+                                                 obs_origin=config.hyperparameters.obs_origin,
+                                                 lazy=bool(config.dataset.lazy),
+                                                 lazy_cache_size=config.dataset.lazy_cache_size or 1024,
+                                                 centerlines=bool(config.dataset.candidate_centerlines))
     val_loader = DataLoader(data_val,
                             batch_size=config.dataset.batch_size,
                             shuffle=config.dataset.shuffle,
@@ -122,13 +107,21 @@ def model_trainer(config, logger):
     hyperparameters = config.hyperparameters
     optim_parameters = config.optim_parameters
 
-    iterations_per_epoch = len(data_train) / config.dataset.batch_size
+    # An iteration (t) is one D/G update cycle: grad_accum_steps batches per update and, unless the GAN
+    # step is fused, d_steps + g_steps updates on different batches
+    grad_accum_steps = max(1, int(hyperparameters.grad_accum_steps or 1))
+    if not hyperparameters.train_gan or hyperparameters.fused_gan_step:
+        batches_per_iteration = grad_accum_steps
+    else:
+        batches_per_iteration = grad_accum_steps * (hyperparameters.d_steps + hyperparameters.g_steps)
+    iterations_per_epoch = len(data_train) / (config.dataset.batch_size * batches_per_iteration)
     if hyperparameters.num_epochs:
         hyperparameters.num_iterations = int(iterations_per_epoch * hyperparameters.num_epochs)
         hyperparameters.num_iterations = hyperparameters.num_iterations if hyperparameters.num_iterations != 0 else 1
 
     logger.info(
-        'There are {} iterations per epoch'.format(hyperparameters.num_iterations)
+        'There are {:.1f} iterations per epoch, {} iterations'.format(iterations_per_epoch,
+                                                                      hyperparameters.num_iterations)
     )
 
     generator = TrajectoryGenerator(
@@ -152,15 +145,15 @@ def model_trainer(config, logger):
     # optimizer, scheduler and loss functions
 
     loss_f = {
-        "mse": mse_custom ,
-        "nll": pytorch_neg_multi_log_likelihood_batch,
         "gan": nn.BCEWithLogitsLoss()
     }
 
     optimizer_g = optim.Adam(generator.parameters(), lr=optim_parameters.g_learning_rate, weight_decay=optim_parameters.g_weight_decay)
     if hyperparameters.lr_schduler:
+        # Stepped once every print_every iterations (mean G_total_loss of the window)
         scheduler_g = lrs.ReduceLROnPlateau(
-            optimizer_g, "min", min_lr=5e-5, verbose=True, factor=0.5, patience=20000,
+            optimizer_g, "min", min_lr=5e-5, verbose=True, factor=0.5,
+            patience=max(1, 20000 // hyperparameters.print_every),
         )
     
     if hyperparameters.train_gan:
@@ -195,6 +188,15 @@ def model_trainer(config, logger):
         t, epoch = 0, 0
         checkpoint = Checkpoint()
 
+    # Losses, norms and metrics are appended to disk (one file per series), the checkpoints only
+    # store the pointer and offsets. A run that is not restored starts from an empty history
+    history_folder = os.path.join(config.base_dir, hyperparameters.output_dir,
+                                  "{}_{}_history".format(config.dataset_name, hyperparameters.checkpoint_name))
+    if checkpoint.config_cp.get("history") is not None:
+        history = MetricHistory.restore(checkpoint.config_cp["history"], history_folder)
+    else:
+        history = MetricHistory(history_folder)
+
     if hyperparameters.tensorboard_active:
         exp_path = os.path.join(
             config.base_dir, hyperparameters.output_dir, "tensorboard_logs"
@@ -209,53 +211,117 @@ def model_trainer(config, logger):
         hyperparameters.d_steps = 0
         hyperparameters.g_steps = 1
 
+    # Fused GAN step: the D and G updates of an iteration share the batch and the generator forward
+    fused_gan_step = bool(hyperparameters.train_gan and hyperparameters.fused_gan_step)
+
+    # Gradient accumulation: every D/G update (iteration t) sums the gradients of grad_accum_steps
+    # batches (effective batch size = batch_size * grad_accum_steps). Mixed precision (AMP) on GPU,
+    # one GradScaler per network since D and G step independently
+    amp = bool(hyperparameters.amp) and torch.cuda.is_available()
+    scaler_g = GradScaler() if amp else None
+    scaler_d = GradScaler() if amp and hyperparameters.train_gan else None
+
+    # Per-stage timers (data wait, H2D, forward, backward...), aggregated every print_every iterations
+    timer = configure_timer(enabled=bool(hyperparameters.instrumentation),
+                            cuda_sync=bool(hyperparameters.instrumentation_cuda_sync))
+
+    # Shape/finite/sum-to-one checks of the multimodal losses (each one synchronizes with the GPU)
+    configure_loss_validation(enabled=bool(hyperparameters.loss_checks))
+
+    # torch.profiler capture windows (Chrome traces + TensorBoard profiler data in output_dir/profiler)
+    profile_dir = os.path.join(config.base_dir, hyperparameters.output_dir, "profiler")
+    profiler = build_profiler(hyperparameters.profile, profile_dir, name="train")
+    profile_val = bool(hyperparameters.profile and hyperparameters.profile.enabled)
+
+    # Checkpoints are snapshotted to CPU and written (fsync + atomic rename) by a background thread
+    checkpoint_writer = AsyncCheckpointWriter(keep_last=hyperparameters.checkpoint_keep_last or 0,
+                                              asynchronous=bool(hyperparameters.async_checkpoint),
+                                              logger=logger)
+    # Scene-consistent rotation (trajectories, goal points, candidate centerlines and rasters) of the training
+    # batches on the GPU. The frames are rotated according to what the dataset serves in their slot
+
+    augmentation = None
+    if hyperparameters.rotation_prob:
+        augmentation = BatchAugmentation(rotation_prob=hyperparameters.rotation_prob,
+                                         seed=hyperparameters.augmentation_seed, device=device,
+                                         frames_kind=get_frames_kind())
+
+    # Per-step losses and gradient norms stay on the device until print_every
+    step_metrics = StepMetrics()
+
+    profiler.start()
+
     ## start training
     while t < hyperparameters.num_iterations:
         gc.collect()
         epoch += 1
         d_steps_left = hyperparameters.d_steps
         g_steps_left = hyperparameters.g_steps
+        accum_step = 0 # A partial accumulation of the last epoch is discarded
         logger.info('Starting epoch {}'.format(epoch))
-        for batch in train_loader: # bottleneck
-            
-            if d_steps_left > 0:
+        for batch in timer.iterate(train_loader, "data_wait"): # bottleneck
+            optimizer_step = accum_step == grad_accum_steps - 1 # last batch of the accumulation
+
+            if fused_gan_step: # d_steps D updates + g_steps G updates per batch, one generator forward
+                losses_d, losses_g = gan_step(hyperparameters, batch, generator, discriminator,
+                                              optimizer_g, optimizer_d, loss_f,
+                                              d_steps=hyperparameters.d_steps, g_steps=hyperparameters.g_steps,
+                                              augmentation=augmentation, scalers=(scaler_d, scaler_g),
+                                              accum_step=accum_step, accum_steps=grad_accum_steps)
+                step_metrics.add_dict("D_losses/", t, losses_d)
+                step_metrics.add_dict("G_losses/", t, losses_g)
+                if optimizer_step:
+                    step_metrics.add("norm_d", t, grad_norm(discriminator.parameters()))
+                    step_metrics.add("norm_g", t, grad_norm(generator.parameters()))
+                    d_steps_left, g_steps_left = 0, 0
+            elif d_steps_left > 0:
                 losses_d = discriminator_step(hyperparameters, batch, generator,
-                                            discriminator, optimizer_d, loss_f)
-
-                checkpoint.config_cp["norm_d"].append(
-                    get_total_norm(discriminator.parameters()))
-                d_steps_left -= 1
+                                            discriminator, optimizer_d, loss_f, augmentation,
+                                            scaler=scaler_d, accum_step=accum_step, accum_steps=grad_accum_steps)
+                step_metrics.add_dict("D_losses/", t, losses_d)
+                if optimizer_step:
+                    step_metrics.add("norm_d", t, grad_norm(discriminator.parameters()))
+                    d_steps_left -= 1
             elif g_steps_left > 0:
                 losses_g = generator_step(hyperparameters, batch, generator,
                                     optimizer_g, loss_f,
-                                    discriminator=None if not hyperparameters.train_gan else discriminator)
-                checkpoint.config_cp["norm_g"].append(
-                    get_total_norm(generator.parameters())
-                )
-                g_steps_left -= 1
-            
-            if d_steps_left > 0 or g_steps_left > 0:
+                                    discriminator=None if not hyperparameters.train_gan else discriminator,
+                                    augmentation=augmentation,
+                                    scaler=scaler_g, accum_step=accum_step, accum_steps=grad_accum_steps)
+                step_metrics.add_dict("G_losses/", t, losses_g)
+                if optimizer_step:
+                    step_metrics.add("norm_g", t, grad_norm(generator.parameters()))
+                    g_steps_left -= 1
+            accum_step = 0 if optimizer_step else accum_step + 1
+
+            if d_steps_left > 0 or g_steps_left > 0 or accum_step > 0:
                     continue
 
+            timer.step()
+            timer.count("scenes", config.dataset.batch_size * grad_accum_steps)
+            profiler.step()
+
             if t % hyperparameters.print_every == 0:
+                # Losses and gradient norms of every step since the last print, copied to host at once.
+                # The logged losses are their means over these steps
+                records = flush_step_metrics(step_metrics, history)
+
                 # print logger
                 logger.info('t = {} / {}'.format(t + 1, hyperparameters.num_iterations))
-                if hyperparameters.train_gan:
-                    for k, v in sorted(losses_d.items()):
-                        logger.info('  [D] {}: {:.3f}'.format(k, v))
+                for prefix, tag in (("D_losses/", "D"), ("G_losses/", "G")):
+                    for series in sorted(records.keys()):
+                        if not series.startswith(prefix):
+                            continue
+                        k, v = series[len(prefix):], float(records[series][1].mean())
+                        logger.info('  [{}] {}: {:.3f}'.format(tag, k, v))
                         if hyperparameters.tensorboard_active:
                             writer.add_scalar(k, v, t+1)
-                        if k not in checkpoint.config_cp["D_losses"].keys():
-                            checkpoint.config_cp["D_losses"][k] = []
-                        checkpoint.config_cp["D_losses"][k].append(v)
-                for k, v in sorted(losses_g.items()):
-                    logger.info('  [G] {}: {:.3f}'.format(k, v))
-                    if hyperparameters.tensorboard_active:
-                        writer.add_scalar(k, v, t+1)
-                    if k not in checkpoint.config_cp["G_losses"].keys():
-                        checkpoint.config_cp["G_losses"][k] = [] 
-                    checkpoint.config_cp["G_losses"][k].append(v)
-                checkpoint.config_cp["losses_ts"].append(t)
+                timer.log(logger, writer if hyperparameters.tensorboard_active else None, t+1)
+
+                if hyperparameters.lr_schduler and "G_losses/G_total_loss" in records:
+                    scheduler_g.step(float(records["G_losses/G_total_loss"][1].mean()))
+                    g_lr = get_lr(optimizer_g)
+                    writer.add_scalar("G_lr", g_lr, epoch+1)
 
             if t > 0 and t % hyperparameters.checkpoint_every == 0:
                 checkpoint.config_cp["counters"]["t"] = t
@@ -265,21 +331,24 @@ def model_trainer(config, logger):
                 # Check stats on the validation set
                 logger.info('Checking stats on val ...')
                 # TODO add trainer metrics -> Compare for overfitting/underfitting
-                metrics_val = check_accuracy(
-                    hyperparameters, val_loader, generator
-                )
+                # The validation is only profiled once the training profiler has recorded all its windows
+                # (two torch.profiler sessions cannot be active on the same thread)
+                profile_val_t = profile_val and profiler_schedule_done(hyperparameters.profile, t + 1)
+                with timer.stage("validation"):
+                    metrics_val = check_accuracy(
+                        hyperparameters, val_loader, generator,
+                        profile_dir=os.path.join(profile_dir, "val_{}".format(t)) if profile_val_t else None
+                    )
 
                 for k, v in sorted(metrics_val.items()):
                     logger.info('  [val] {}: {:.3f}'.format(k, v))
                     if hyperparameters.tensorboard_active:
                         writer.add_scalar(k, v, t+1)
-                    if k not in checkpoint.config_cp["metrics_val"].keys():
-                        checkpoint.config_cp["metrics_val"][k] = []
-                    checkpoint.config_cp["metrics_val"][k].append(v)
+                    history.append("metrics_val/{}".format(k), t, v)
 
-                min_ade = min(checkpoint.config_cp["metrics_val"]['ade'])
-                min_fde = min(checkpoint.config_cp["metrics_val"]['fde'])
-                min_ade_nl = min(checkpoint.config_cp["metrics_val"]['ade_nl'])
+                min_ade = history.min("metrics_val/ade")
+                min_fde = history.min("metrics_val/fde")
+                min_ade_nl = history.min("metrics_val/ade_nl")
                 logger.info("Min ADE: {}".format(min_ade))
                 logger.info("Min FDE: {}".format(min_fde))
                 if metrics_val['ade'] <= min_ade:
@@ -296,9 +365,13 @@ def model_trainer(config, logger):
                     if hyperparameters.train_gan:
                         checkpoint.config_cp["d_best_nl_state"] = discriminator.state_dict()
 
+                flush_step_metrics(step_metrics, history)
+                checkpoint.config_cp["history"] = history.state()
+
                 # Save another checkpoint with model weights and
                 # optimizer state
                 if metrics_val['ade'] <= min_ade:
+                    timer.start("checkpoint")
                     checkpoint.config_cp["g_state"] = generator.state_dict()
                     checkpoint.config_cp["g_optim_state"] = optimizer_g.state_dict()
                     if hyperparameters.train_gan:
@@ -308,8 +381,7 @@ def model_trainer(config, logger):
                         config.base_dir, hyperparameters.output_dir, "{}_{}_with_model.pt".format(config.dataset_name, hyperparameters.checkpoint_name)
                     )
                     logger.info('Saving checkpoint to {}'.format(checkpoint_path))
-                    torch.save(checkpoint, checkpoint_path)
-                    logger.info('Done.')
+                    checkpoint_writer.save(checkpoint, checkpoint_path, step=t)
 
                     # Save a checkpoint with no model weights by making a shallow
                     # copy of the checkpoint excluding some items
@@ -326,20 +398,17 @@ def model_trainer(config, logger):
                     for k, v in checkpoint.config_cp.items():
                         if k not in key_blacklist:
                             small_checkpoint[k] = v
-                    torch.save(small_checkpoint, checkpoint_path)
-                    logger.info('Done.')
+                    checkpoint_writer.save(small_checkpoint, checkpoint_path, step=t)
+                    timer.stop("checkpoint")
 
             t += 1
             d_steps_left = hyperparameters.d_steps
             g_steps_left = hyperparameters.g_steps
             if t >= hyperparameters.num_iterations:
                 break
-
-            if hyperparameters.lr_schduler:
-                scheduler_g.step(losses_g["G_total_loss"])
-                g_lr = get_lr(optimizer_g)
-                writer.add_scalar("G_lr", g_lr, epoch+1)
     ###
+    profiler.stop()
+    flush_step_metrics(step_metrics, history) # Steps after the last print_every
     logger.info("Training finished")
 
     # Check stats on the validation set
@@ -357,12 +426,10 @@ def model_trainer(config, logger):
         logger.info('  [val] {}: {:.3f}'.format(k, v))
         if hyperparameters.tensorboard_active:
             writer.add_scalar(k, v, t+1)
-        if k not in checkpoint.config_cp["metrics_val"].keys():
-            checkpoint.config_cp["metrics_val"][k] = []
-        checkpoint.config_cp["metrics_val"][k].append(v)
+        history.append("metrics_val/{}".format(k), t, v)
 
-    min_ade = min(checkpoint.config_cp["metrics_val"]['ade'])
-    min_ade_nl = min(checkpoint.config_cp["metrics_val"]['ade_nl'])
+    min_ade = history.min("metrics_val/ade")
+    min_ade_nl = history.min("metrics_val/ade_nl")
 
     if metrics_val['ade'] <= min_ade:
         logger.info('New low for avg_disp_error')
@@ -381,175 +448,247 @@ def model_trainer(config, logger):
     checkpoint_path = os.path.join(
         config.base_dir, hyperparameters.output_dir, "{}_{}_with_model.pt".format(config.dataset_name, hyperparameters.checkpoint_name)
     )
+    checkpoint.config_cp["history"] = history.state()
+    logger.info('Saving checkpoint to {}'.format(checkpoint_path))
+    checkpoint_writer.save(checkpoint, checkpoint_path, step=t)
+    checkpoint_writer.close() # Barrier: every pending checkpoint is on disk
+    logger.info('Done.')
 
-def discriminator_step(
-    hyperparameters, batch, generator, discriminator, optimizer_d, loss_f
-):
-    batch = [tensor.cuda() for tensor in batch]
+def flush_step_metrics(step_metrics, history):
+    """
+    Move the per-step records buffered on the device (StepMetrics) to the metric history
+    Output:
+        records: series -> (t, values) (see StepMetrics.flush)
+    """
+    records = step_metrics.flush()
+    for series, (ts, values) in records.items():
+        for step, value in zip(ts, values):
+            history.append(series, int(step), float(value))
+    return records
+
+def prepare_batch(hyperparameters, batch, augmentation=None, device="cuda"):
+    """
+    H2D copy (+ augmentation) of a batch and the inputs shared by the D and G steps
+    """
+    timer = get_timer()
+    with timer.stage("h2d"):
+        batch = [tensor.to(device, non_blocking=True) for tensor in batch]
+    if augmentation is not None:
+        batch = augmentation.augment_batch(batch)
 
     (obs_traj, pred_traj_gt, obs_traj_rel, pred_traj_gt_rel, non_linear_obj,
      loss_mask, seq_start_end, frames, object_cls, obj_id, ego_origin, _, _) = batch
 
-    # place holder loss
-    losses = {}
     # single agent output idx
     agent_idx = None
     if hyperparameters.output_single_agent:
         agent_idx = torch.where(object_cls==1)[0].cpu().numpy()
 
+    # observed and gt displacements of the predicted agents (discriminator and losses)
+    obs_traj_rel_pred, pred_traj_gt_rel_pred = obs_traj_rel, pred_traj_gt_rel
     if hyperparameters.output_single_agent:
-        loss_mask = loss_mask[agent_idx, hyperparameters.obs_len:]
-        pred_traj_gt_rel = pred_traj_gt_rel[:, agent_idx, :]
-    else:  # 160x30 -> 0 o 1
-        loss_mask = loss_mask[:, hyperparameters.obs_len:]
+        obs_traj_rel_pred = obs_traj_rel[:, agent_idx, :]
+        pred_traj_gt_rel_pred = pred_traj_gt_rel[:, agent_idx, :]
 
-    # forward
-    optimizer_d.zero_grad()
-    generator_out, conf = generator(
-        obs_traj, obs_traj_rel, frames, seq_start_end, agent_idx
-    )
+    return (obs_traj, obs_traj_rel, frames, seq_start_end, agent_idx,
+            obs_traj_rel_pred, pred_traj_gt_rel_pred)
 
-    pred_traj_fake_rel = generator_out
-    if hyperparameters.output_single_agent:
-        pred_traj_fake = relative_to_abs_sgan_multimodal(pred_traj_fake_rel, obs_traj[-1,agent_idx, :])
-    else:
-        pred_traj_fake = relative_to_abs_sgan_multimodal(pred_traj_fake_rel, obs_traj[-1])
-        
-
-    # handle single agent output
-    if hyperparameters.output_single_agent:
-        obs_traj = obs_traj[:,agent_idx, :]
-        pred_traj_gt = pred_traj_gt[:,agent_idx, :]
-        obs_traj_rel = obs_traj_rel[:, agent_idx, :]
-
-    # calculate full traj
-    traj_real_rel = torch.cat([obs_traj_rel, pred_traj_gt_rel], dim=0)
-    _, m, _, _ = pred_traj_fake_rel.shape
-    obs_traj_rel = obs_traj_rel.permute(1,0,2).unsqueeze(1)
-    obs_traj_rel = obs_traj_rel.repeat_interleave(m, dim=1)
-    traj_fake_rel = torch.cat([obs_traj_rel, pred_traj_fake_rel], dim=2)
-    traj_fake_rel = traj_fake_rel.view(-1, traj_real_rel.shape[0], 2)
-    traj_fake_rel = traj_fake_rel.permute(1,0,2)
-
-    scores_fake = discriminator(
-        traj_fake_rel
-    )
-    scores_real = discriminator(
-        traj_real_rel
-    )
+def discriminator_loss(discriminator, obs_traj_rel, pred_traj_fake_rel, pred_traj_gt_rel, loss_f, losses):
+    """
+    Input:
+        obs_traj_rel: (obs_len, n, 2), pred_traj_fake_rel: (n, m, pred_len, 2), pred_traj_gt_rel: (pred_len, n, 2)
+    """
+    # score the m modes and the gt (history encoded once)
+    scores_fake, scores_real = discriminator.score_modes(obs_traj_rel, pred_traj_fake_rel, pred_traj_gt_rel)
 
     loss_real = loss_f["gan"](scores_real, torch.ones_like(scores_real).to(scores_real))
     loss_fake = loss_f["gan"](scores_fake, torch.zeros_like(scores_fake).to(scores_fake))
     loss = loss_fake + loss_real
-    losses['D_real_loss'] = loss_real.item()
-    losses['D_fake_loss'] = loss_fake.item()
-    losses['D_gan_loss'] = loss.item()
-    losses['D_total_loss'] = loss.item()
-
-    optimizer_d.zero_grad()
-    loss.backward()
-    if hyperparameters.clipping_threshold_d > 0:
-        nn.utils.clip_grad_norm_(discriminator.parameters(),
-                                 hyperparameters.clipping_threshold_d)
-    optimizer_d.step()
+    losses['D_real_loss'] = loss_real.detach()
+    losses['D_fake_loss'] = loss_fake.detach()
+    losses['D_gan_loss'] = loss.detach()
+    losses['D_total_loss'] = loss.detach()
+    return loss
 
-    return losses
+def generator_loss(hyperparameters, obs_traj_rel, pred_traj_fake_rel, pred_traj_gt_rel, conf, loss_f, losses,
+                   discriminator=None):
+    """
+    Input:
+        obs_traj_rel: (obs_len, n, 2), pred_traj_fake_rel: (n, m, pred_len, 2), pred_traj_gt_rel: (pred_len, n, 2)
+        discriminator: adversarial term if not None
+    """
+    # Squared errors computed once: NLL and per-mode ADE/FDE (see losses.multimodal_loss)
+    mm_loss = multimodal_loss(pred_traj_gt_rel.permute(1,0,2), pred_traj_fake_rel,
+                              conf if "nll" in hyperparameters.loss_type_g else None)
+
+    if hyperparameters.loss_type_g == "mse" or hyperparameters.loss_type_g == "mse_w":
+        loss_ade, loss_fde = mm_loss["ade"], mm_loss["fde"]
+        loss = loss_ade + loss_fde
+        losses["G_mse_ade_loss"] = loss_ade.detach()
+        losses["G_mse_fde_loss"] = loss_fde.detach()
+    elif hyperparameters.loss_type_g == "nll":
+        loss = mm_loss["nll"]
+        losses["G_nll_loss"] = loss.detach()
+    elif hyperparameters.loss_type_g == "mse+nll" or hyperparameters.loss_type_g == "mse_w+nll":
+        loss_ade, loss_fde, loss_nll = mm_loss["ade"], mm_loss["fde"], mm_loss["nll"]
+        loss = loss_ade + loss_fde + loss_nll*0.75
+        losses["G_mse_ade_loss"] = loss_ade.detach()
+        losses["G_mse_fde_loss"] = loss_fde.detach()
+        losses["G_nll_loss"] = loss_nll.detach()
 
+    if discriminator is not None:
+        # score the m modes (history encoded once)
+        scores_fake, _ = discriminator.score_modes(obs_traj_rel, pred_traj_fake_rel)
+        loss_fake = loss_f["gan"](scores_fake, torch.ones_like(scores_fake).to(scores_fake))
+        losses['G_gan_loss'] = loss_fake.detach()
+        loss = loss + loss_fake
 
-def generator_step(
-    hyperparameters, batch, generator, optimizer_g, loss_f, discriminator=None
-):
-    batch = [tensor.cuda() for tensor in batch]
+    losses['G_total_loss'] = loss.detach()
+    return loss
 
-    (obs_traj, pred_traj_gt, obs_traj_rel, pred_traj_gt_rel, non_linear_obj,
-     loss_mask, seq_start_end, frames, object_cls, obj_id, ego_origin, _, _) = batch
+def update(loss, optimizer, parameters, clipping_threshold, name, scaler=None, accum_step=0, accum_steps=1):
+    """
+    Backward + (clipping) + optimizer step, with gradient accumulation: the gradients of accum_steps
+    consecutive micro-batches (loss / accum_steps each) are summed and the optimizer only steps on the
+    last one (accum_step == accum_steps - 1). Only the given parameters receive gradients (the generator
+    loss does not leak into the discriminator)
+    Input:
+        scaler: GradScaler (AMP) or None
+    Output:
+        True if the optimizer stepped
+    """
+    timer = get_timer()
+    parameters = [p for p in parameters if p.requires_grad]
+    with timer.stage("{}_backward".format(name)):
+        if accum_step == 0:
+            optimizer.zero_grad()
+        loss = loss / accum_steps
+        if scaler is not None:
+            loss = scaler.scale(loss)
+        loss.backward(inputs=parameters)
+    if accum_step < accum_steps - 1:
+        return False
+
+    with timer.stage("{}_optimizer".format(name)):
+        if scaler is not None:
+            scaler.unscale_(optimizer) # clipping and logged norms on the true gradients
+        if clipping_threshold > 0:
+            nn.utils.clip_grad_norm_(parameters, clipping_threshold)
+        if scaler is not None:
+            scaler.step(optimizer) # skipped if the gradients overflowed
+            scaler.update()
+        else:
+            optimizer.step()
+    return True
+
+def discriminator_step(
+    hyperparameters, batch, generator, discriminator, optimizer_d, loss_f, augmentation=None,
+    scaler=None, accum_step=0, accum_steps=1
+):
+    timer = get_timer()
+    (obs_traj, obs_traj_rel, frames, seq_start_end, agent_idx,
+     obs_traj_rel_pred, pred_traj_gt_rel) = prepare_batch(hyperparameters, batch, augmentation,
+                                                          next(generator.parameters()).device)
 
     # place holder loss
     losses = {}
-    # single agent output idx
-    agent_idx = None
-    if hyperparameters.output_single_agent:
-        agent_idx = torch.where(object_cls==1)[0].cpu().numpy()
 
-    if hyperparameters.output_single_agent:
-        loss_mask = loss_mask[agent_idx, hyperparameters.obs_len:]
-        pred_traj_gt_rel = pred_traj_gt_rel[:, agent_idx, :]
-    else:  # 160x30 -> 0 o 1
-        loss_mask = loss_mask[:, hyperparameters.obs_len:]
+    # forward (the fakes are constants for the discriminator)
+    timer.start("D_forward")
+    with autocast(enabled=scaler is not None):
+        with torch.no_grad():
+            pred_traj_fake_rel, conf = generator(
+                obs_traj, obs_traj_rel, frames, seq_start_end, agent_idx
+            )
+        loss = discriminator_loss(discriminator, obs_traj_rel_pred, pred_traj_fake_rel, pred_traj_gt_rel,
+                                  loss_f, losses)
+    timer.stop("D_forward")
 
-    # forward
-    optimizer_g.zero_grad()
-    generator_out, conf = generator(
-        obs_traj, obs_traj_rel, frames, seq_start_end, agent_idx
-    )
+    update(loss, optimizer_d, discriminator.parameters(), hyperparameters.clipping_threshold_d, "D",
+           scaler, accum_step, accum_steps)
+    return losses
 
-    pred_traj_fake_rel = generator_out
-    if hyperparameters.output_single_agent:
-        pred_traj_fake = relative_to_abs_sgan_multimodal(pred_traj_fake_rel, obs_traj[-1,agent_idx, :])
-    else:
-        pred_traj_fake = relative_to_abs_sgan_multimodal(pred_traj_fake_rel, obs_traj[-1])
-        
+def generator_step(
+    hyperparameters, batch, generator, optimizer_g, loss_f, discriminator=None, augmentation=None,
+    scaler=None, accum_step=0, accum_steps=1
+):
+    timer = get_timer()
+    (obs_traj, obs_traj_rel, frames, seq_start_end, agent_idx,
+     obs_traj_rel_pred, pred_traj_gt_rel) = prepare_batch(hyperparameters, batch, augmentation,
+                                                          next(generator.parameters()).device)
 
-    # handle single agent output
-    if hyperparameters.output_single_agent:
-        obs_traj = obs_traj[:,agent_idx, :]
-        pred_traj_gt = pred_traj_gt[:,agent_idx, :]
-        obs_traj_rel = obs_traj_rel[:, agent_idx, :]
+    # place holder loss
+    losses = {}
 
-    if hyperparameters.loss_type_g == "mse" or hyperparameters.loss_type_g == "mse_w":
-        _,b,_ = pred_traj_gt_rel.shape
-        w_loss = w_loss[:b, :]
-        loss_ade, loss_fde = calculate_mse_loss(
-            pred_traj_gt_rel, pred_traj_fake_rel, loss_f["mse"]
-        )
-        loss = loss_ade + loss_fde
-        losses["G_mse_ade_loss"] = loss_ade.item()
-        losses["G_mse_fde_loss"] = loss_fde.item()
-    elif hyperparameters.loss_type_g == "nll":
-        loss = calculate_nll_loss(pred_traj_gt_rel, pred_traj_fake_rel,loss_f)
-        losses["G_nll_loss"] = loss.item()
-    elif hyperparameters.loss_type_g == "mse+nll" or hyperparameters.loss_type_g == "mse_w+nll":
-        _,b,_ = pred_traj_gt_rel.shape
-        loss_ade, loss_fde = calculate_mse_loss(
-            pred_traj_gt_rel, pred_traj_fake_rel, loss_f["mse"]
+    # forward
+    timer.start("G_forward")
+    with autocast(enabled=scaler is not None):
+        pred_traj_fake_rel, conf = generator(
+            obs_traj, obs_traj_rel, frames, seq_start_end, agent_idx
         )
-        loss_nll = calculate_nll_loss(pred_traj_gt_rel, pred_traj_fake_rel,loss_f["nll"], conf)
-        loss = loss_ade + loss_fde + loss_nll*0.75
-        losses["G_mse_ade_loss"] = loss_ade.item()
-        losses["G_mse_fde_loss"] = loss_fde.item()
-        losses["G_nll_loss"] = loss_nll.item()
-    
-    if hyperparameters.train_gan:
-        # calculate full traj
-        traj_real_rel = torch.cat([obs_traj_rel, pred_traj_gt_rel], dim=0)
-        _, m, _, _ = pred_traj_fake_rel.shape
-        obs_traj_rel = obs_traj_rel.permute(1,0,2).unsqueeze(1)
-        obs_traj_rel = obs_traj_rel.repeat_interleave(m, dim=1)
-        traj_fake_rel = torch.cat([obs_traj_rel, pred_traj_fake_rel], dim=2)
-        traj_fake_rel = traj_fake_rel.view(-1, traj_real_rel.shape[0], 2)
-        traj_fake_rel = traj_fake_rel.permute(1,0,2)
-
-        scores_fake = discriminator(traj_fake_rel)
-        loss_fake = loss_f["gan"](scores_fake, torch.ones_like(scores_fake).to(scores_fake))
-        losses['G_gan_loss'] = loss_fake.item()
-        loss = loss + loss_fake
+        loss = generator_loss(hyperparameters, obs_traj_rel_pred, pred_traj_fake_rel, pred_traj_gt_rel, conf,
+                              loss_f, losses, discriminator=discriminator if hyperparameters.train_gan else None)
+    timer.stop("G_forward")
 
-    losses['G_total_loss'] = loss.item()
+    update(loss, optimizer_g, generator.parameters(), hyperparameters.clipping_threshold_g, "G",
+           scaler, accum_step, accum_steps)
+    return losses
 
-    # scaler.scale(loss).backward()
-    loss.backward()
-    if hyperparameters.clipping_threshold_g > 0:
-        nn.utils.clip_grad_norm_(
-            generator.parameters(), hyperparameters.clipping_threshold_g
+def gan_step(
+    hyperparameters, batch, generator, discriminator, optimizer_g, optimizer_d, loss_f,
+    d_steps=1, g_steps=1, augmentation=None, scalers=(None, None), accum_step=0, accum_steps=1
+):
+    """
+    Fused GAN step: a single generator forward per batch. Its detached fakes feed the d_steps
+    discriminator updates and the attached ones the (first) generator update, which is scored by
+    the updated discriminator. Every extra generator update (g_steps > 1) needs a new forward.
+    With gradient accumulation (accum_steps > 1) a single D and G update is accumulated per batch
+    Input:
+        scalers: GradScaler (AMP) or None of D and G
+    Output:
+        losses_d, losses_g (last update of each)
+    """
+    assert accum_steps == 1 or (d_steps == 1 and g_steps == 1), \
+           "Gradient accumulation with the fused GAN step needs d_steps = g_steps = 1"
+    timer = get_timer()
+    (obs_traj, obs_traj_rel, frames, seq_start_end, agent_idx,
+     obs_traj_rel_pred, pred_traj_gt_rel) = prepare_batch(hyperparameters, batch, augmentation,
+                                                          next(generator.parameters()).device)
+    scaler_d, scaler_g = scalers
+
+    losses_d, losses_g = {}, {}
+
+    timer.start("G_forward")
+    with autocast(enabled=scaler_g is not None):
+        pred_traj_fake_rel, conf = generator(
+            obs_traj, obs_traj_rel, frames, seq_start_end, agent_idx
         )
-    # scaler.step(optimizer_g)
-    optimizer_g.step()
-    # scaler.update()
+    timer.stop("G_forward")
+
+    for _ in range(d_steps):
+        with timer.stage("D_forward"), autocast(enabled=scaler_d is not None):
+            loss_d = discriminator_loss(discriminator, obs_traj_rel_pred, pred_traj_fake_rel.detach(),
+                                        pred_traj_gt_rel, loss_f, losses_d)
+        update(loss_d, optimizer_d, discriminator.parameters(), hyperparameters.clipping_threshold_d, "D",
+               scaler_d, accum_step, accum_steps)
+
+    for g_step in range(g_steps):
+        timer.start("G_forward")
+        with autocast(enabled=scaler_g is not None):
+            if g_step > 0:
+                pred_traj_fake_rel, conf = generator(
+                    obs_traj, obs_traj_rel, frames, seq_start_end, agent_idx
+                )
+            loss_g = generator_loss(hyperparameters, obs_traj_rel_pred, pred_traj_fake_rel, pred_traj_gt_rel,
+                                    conf, loss_f, losses_g, discriminator=discriminator)
+        timer.stop("G_forward")
+        update(loss_g, optimizer_g, generator.parameters(), hyperparameters.clipping_threshold_g, "G",
+               scaler_g, accum_step, accum_steps)
 
-    return losses
+    return losses_d, losses_g
 
 def check_accuracy(
-    hyperparameters, loader, generator, limit=False
+    hyperparameters, loader, generator, limit=False, profile_dir=None
 ):
     metrics = {}
     g_l2_losses_abs, g_l2_losses_rel = [], []
@@ -557,14 +696,21 @@ def check_accuracy(
     f_disp_error, f_disp_error_l, f_disp_error_nl = [], [], []
     total_traj, total_traj_l, total_traj_nl = 0, 0, 0
     loss_mask_sum = 0
+    drivable_area, drivable_modes, total_modes = [], [], 0
+    data_images_folder = loader.dataset.root_folder + loader.dataset.split + "/data_images/"
     generator.eval()
+    device = next(generator.parameters()).device
+
+    profiler = build_profiler(hyperparameters.profile if profile_dir else None, profile_dir, name="val")
+    profiler.start()
 
     with torch.no_grad():
         for batch in loader:
-            batch = [tensor.cuda() for tensor in batch]
+            profiler.step()
+            batch = [tensor.to(device, non_blocking=True) for tensor in batch]
 
             (obs_traj, pred_traj_gt, obs_traj_rel, pred_traj_gt_rel, non_linear_obj,
-             loss_mask, seq_start_end, frames, object_cls, obj_id, ego_origin, _, _) = batch
+             loss_mask, seq_start_end, frames, object_cls, obj_id, ego_origin, num_seq, _) = batch
 
             # single agent output idx
             agent_idx = None
@@ -623,15 +769,30 @@ def check_accuracy(
             disp_error.append(ade_min.sum())
             f_disp_error.append(fde_min.sum())
 
+            # Drivable area compliance of every mode (predictions in map coordinates)
+            if hyperparameters.feasible_area_metric and hyperparameters.output_single_agent:
+                filenames = [data_images_folder + str(int(seq)) + ".png" for seq in num_seq.cpu().numpy()]
+                masks = torch.from_numpy(get_drivable_masks(filenames)).to(pred_traj_fake.device)
+                compliance, _ = drivable_area_compliance(pred_traj_fake + ego_origin.unsqueeze(1), masks,
+                                                         ego_origin, dist_around)
+                drivable_area.append(compliance.sum())
+                drivable_modes.append((compliance == 1).sum())
+                total_modes += compliance.numel()
+
             loss_mask_sum += torch.numel(loss_mask.data)
             total_traj += pred_traj_gt.size(1)
             total_traj_l += torch.sum(linear_obj).item()
             total_traj_nl += torch.sum(non_linear_obj).item()
             if limit and total_traj >= hyperparameters.num_samples_check:
                 break
+    profiler.stop()
     metrics['g_l2_loss_abs'] = sum(g_l2_losses_abs) / loss_mask_sum
     metrics['g_l2_loss_rel'] = sum(g_l2_losses_rel) / loss_mask_sum
 
+    if total_modes > 0:
+        metrics['drivable_area'] = (sum(drivable_area) / total_modes).item() # Ratio of drivable points
+        metrics['drivable_modes'] = (sum(drivable_modes) / total_modes).item() # Ratio of fully drivable modes
+
     metrics['ade'] = sum(disp_error) / (total_traj * hyperparameters.pred_len)
     metrics['fde'] = sum(f_disp_error) / total_traj
     if total_traj_l != 0:
@@ -14,7 +14,8 @@ from torch.utils.data import DataLoader
 import torch.optim.lr_scheduler as lrs
 from torch.cuda.amp import GradScaler, autocast 
 
-from sophie.data_loader.argoverse.dataset_sgan_version_data_augs import ArgoverseMotionForecastingDataset, seq_collate
+from sophie.data_loader.argoverse.dataset_sgan_version_data_augs import ArgoverseMotionForecastingDataset, seq_collate, \
+                                                                          seed_worker
 from sophie.models.mp_trans_so_set_goal import TrajectoryGenerator
 from sophie.modules.losses import pytorch_neg_multi_log_likelihood_batch, mse_custom, l2_loss, l2_loss_multimodal
 from sophie.modules.evaluation_metrics import displacement_error, final_displacement_error
@@ -98,7 +99,8 @@ def model_trainer(config, logger):
                               batch_size=config.dataset.batch_size,
                               shuffle=config.dataset.shuffle,
                               num_workers=config.dataset.num_workers,
-                              collate_fn=seq_collate)
+                              collate_fn=seq_collate,
+                              worker_init_fn=seed_worker)
 
     logger.info("Initializing val dataset")
     data_val = ArgoverseMotionForecastingDataset(dataset_name=config.dataset_name,
@@ -1,3 +1,10 @@
+import io
+import os
+import queue
+import threading
+import time
+import torch
+
 from collections import defaultdict
 
 class Checkpoint():
@@ -14,6 +21,7 @@ class Checkpoint():
             "restore_ts" : [],
             "norm_g" : [],
             "norm_d" : [],
+            "history" : None, # MetricHistory.state() (pointer + offsets) if the metrics are logged to disk
             "counters" : {
                 "t": None,
                 "epoch": None,
@@ -54,16 +62,152 @@ class Checkpoint():
         self.config_cp["best_t_nl"] = config.best_t_nl
 
 
+def grad_norm(parameters, norm_type=2):
+    """
+    Norm of all the gradients (as if they were flattened and concatenated), computed on the device:
+    returns a 0-dim tensor, so there is no synchronization with the GPU until it is read.
+    The per-gradient norms are computed by a single fused (multi-tensor) kernel when available,
+    otherwise by one norm over the concatenated gradients
+    """
+    grads = [p.grad.detach() for p in parameters if p.grad is not None]
+    if len(grads) == 0:
+        return torch.zeros(())
+    norm_type = float(norm_type)
+    if hasattr(torch, "_foreach_norm"):
+        norms = torch._foreach_norm(grads, norm_type)
+        return torch.linalg.vector_norm(torch.stack(norms), norm_type)
+    return torch.linalg.vector_norm(torch.cat([g.reshape(-1) for g in grads]), norm_type)
+
 def get_total_norm(parameters, norm_type=2):
-    if norm_type == float('inf'):
-        total_norm = max(p.grad.data.abs().max() for p in parameters)
-    else:
-        total_norm = 0
-        for p in parameters:
+    return float(grad_norm(parameters, norm_type))
+
+def snapshot_to_cpu(obj):
+    """
+    Copy every tensor of a (nested) checkpoint to CPU memory, so that the training can go on
+    modifying the parameters while the copy is serialized in background
+    """
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, Checkpoint):
+        snapshot = Checkpoint()
+        snapshot.config_cp = snapshot_to_cpu(obj.config_cp)
+        return snapshot
+    if isinstance(obj, defaultdict):
+        snapshot = defaultdict(obj.default_factory)
+        snapshot.update({k: snapshot_to_cpu(v) for k, v in obj.items()})
+        return snapshot
+    if isinstance(obj, dict):
+        snapshot = obj.__class__((k, snapshot_to_cpu(v)) for k, v in obj.items())
+        if hasattr(obj, "_metadata"): # state_dict versions, used by load_state_dict
+            snapshot._metadata = obj._metadata
+        return snapshot
+    if isinstance(obj, (list, tuple)):
+        return obj.__class__(snapshot_to_cpu(v) for v in obj)
+    return obj
+
+class AsyncCheckpointWriter():
+    """
+    Serialize checkpoints in a background thread
+
+        writer = AsyncCheckpointWriter(keep_last=3)
+        writer.save(checkpoint, path, step=t) # Returns once the CPU snapshot is taken
+        ...
+        writer.wait() # Barrier, e.g. before the final save or exiting
+
+    - The snapshot to CPU is taken on the caller thread, torch.save + fsync are done in background.
+    - Files are written to a temporary file and atomically renamed (a crash never leaves a truncated
+      checkpoint at path).
+    - keep_last > 0: a copy tagged with the step (<name>_<step>.pt) is also kept for the last keep_last saves.
+    - asynchronous=False: same atomic write, but on the caller thread.
+    """
+    def __init__(self, keep_last=0, asynchronous=True, max_pending=2, logger=None):
+        self.keep_last = keep_last
+        self.asynchronous = asynchronous
+        self.logger = logger
+        self.history = defaultdict(list) # path -> tagged copies
+        self.error = None
+        if self.asynchronous:
+            self.queue = queue.Queue(maxsize=max_pending)
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def save(self, obj, path, step=None):
+        self._raise_error()
+        snapshot = snapshot_to_cpu(obj)
+        if self.asynchronous:
+            self.queue.put((snapshot, path, step)) # Blocks if max_pending saves are not finished yet
+        else:
+            self._write(snapshot, path, step)
+
+    def wait(self):
+        """
+        Barrier: return when every pending checkpoint has been written
+        """
+        if self.asynchronous:
+            self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        self.wait()
+        if self.asynchronous:
+            self.queue.put(None)
+            self.thread.join()
+            self.asynchronous = False
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
             try:
-                param_norm = p.grad.data.norm(norm_type)
-                total_norm += param_norm**norm_type
-                total_norm = total_norm**(1. / norm_type)
-            except:
-                continue
-    return total_norm
\ No newline at end of file
+                self._write(*item)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _write(self, snapshot, path, step):
+        t0 = time.time()
+        buffer = io.BytesIO()
+        torch.save(snapshot, buffer)
+        data = buffer.getbuffer()
+
+        atomic_write(data, path)
+        if self.keep_last > 0 and step is not None:
+            root, ext = os.path.splitext(path)
+            tagged_path = "{}_{}{}".format(root, step, ext)
+            atomic_write(data, tagged_path)
+            self.history[path].append(tagged_path)
+            while len(self.history[path]) > self.keep_last:
+                old_path = self.history[path].pop(0)
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+        if self.logger is not None:
+            self.logger.info('Checkpoint {} written ({:.1f} MB, {:.2f} s)'.format(
+                path, len(data) / 1e6, time.time() - t0))
+
+def atomic_write(data, path):
+    """
+    Write data to path through a temporary file + fsync + rename
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    tmp_path = "{}.tmp{}".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    try:
+        dir_fd = os.open(folder, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError: # fsync on directories is not supported on every platform
+        pass
@@ -0,0 +1,242 @@
+import time
+import torch
+
+from collections import defaultdict
+
+class _NullStage():
+    """
+    No-op context manager returned when the instrumentation is disabled
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage():
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        if self.timer.cuda_sync:
+            torch.cuda.synchronize()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        if self.timer.cuda_sync:
+            torch.cuda.synchronize()
+        self.timer.add(self.name, time.perf_counter() - self.t0)
+        return False
+
+class StageTimer():
+    """
+    Named stage timers and counters aggregated over a window (e.g. print_every iterations)
+
+        timer = StageTimer(enabled=True)
+        for batch in timer.iterate(train_loader, "data_wait"):
+            with timer.stage("forward"):
+                ...
+            timer.count("scenes", batch_size)
+            timer.step()
+        timer.log(logger, writer, t) # Log and reset the window
+
+    When disabled, stage() returns a shared no-op context manager and iterate() returns the iterable
+    itself, so the instrumented code pays (almost) nothing.
+    cuda_sync: synchronize CUDA at stage boundaries (accurate GPU times, but it stalls the pipeline)
+    """
+    def __init__(self, enabled=False, cuda_sync=False):
+        self.enabled = enabled
+        self.cuda_sync = cuda_sync and torch.cuda.is_available()
+        self.reset()
+
+    def reset(self):
+        self.totals = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(float)
+        self.running = {}
+        self.steps = 0
+        self.t_window = time.perf_counter()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def start(self, name):
+        """
+        start/stop: same as stage() for code blocks that are not worth re-indenting
+        """
+        if not self.enabled:
+            return
+        if self.cuda_sync:
+            torch.cuda.synchronize()
+        self.running[name] = time.perf_counter()
+
+    def stop(self, name):
+        if not self.enabled or name not in self.running:
+            return
+        if self.cuda_sync:
+            torch.cuda.synchronize()
+        self.add(name, time.perf_counter() - self.running.pop(name))
+
+    def add(self, name, seconds):
+        self.totals[name] += seconds
+        self.calls[name] += 1
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] += value
+
+    def step(self):
+        if self.enabled:
+            self.steps += 1
+
+    def iterate(self, iterable, name="data_wait"):
+        """
+        Time every next() on the iterable (e.g. the time the training loop waits for the DataLoader)
+        """
+        if not self.enabled:
+            return iterable
+        return self._timed_iterator(iterable, name)
+
+    def _timed_iterator(self, iterable, name):
+        iterator = iter(iterable)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(name, time.perf_counter() - t0)
+            yield item
+
+    def summary(self):
+        """
+        Output:
+            dict name -> {"total_s", "calls", "ms_per_step", "share"} and throughput counters (per second)
+        """
+        wall = max(time.perf_counter() - self.t_window, 1e-9)
+        steps = max(self.steps, 1)
+        stats = {}
+        for name, total in self.totals.items():
+            stats[name] = {
+                "total_s": total,
+                "calls": self.calls[name],
+                "ms_per_step": total * 1000.0 / steps,
+                "share": total / wall
+            }
+        throughput = {name: value / wall for name, value in self.counters.items()}
+        throughput["steps"] = self.steps / wall
+        return {"stages": stats, "throughput": throughput, "wall_s": wall}
+
+    def log(self, logger, writer=None, t=0, reset=True):
+        """
+        Write the current window to the log and (optionally) to the TensorBoard SummaryWriter
+        """
+        if not self.enabled:
+            return
+        summary = self.summary()
+        for name, stats in sorted(summary["stages"].items()):
+            logger.info('  [time] {}: {:.2f} ms/it ({:.1f}%)'.format(name, stats["ms_per_step"], 100.0*stats["share"]))
+            if writer is not None:
+                writer.add_scalar("time/{}_ms".format(name), stats["ms_per_step"], t)
+        for name, value in sorted(summary["throughput"].items()):
+            logger.info('  [throughput] {}: {:.2f}/s'.format(name, value))
+            if writer is not None:
+                writer.add_scalar("throughput/{}_per_s".format(name), value, t)
+        if reset:
+            self.reset()
+
+# Process-wide timer, shared by the data pipeline (seq_collate, load_images...) and the trainers.
+# NB: with num_workers > 0 the collate function runs in the workers, so its stages are not reported
+
+_timer = StageTimer(enabled=False)
+
+def get_timer():
+    return _timer
+
+def configure_timer(enabled=False, cuda_sync=False):
+    _timer.enabled = enabled
+    _timer.cuda_sync = cuda_sync and torch.cuda.is_available()
+    _timer.reset()
+    return _timer
+
+# torch.profiler capture windows (hyperparameters.profile in the YAML config)
+
+class _NullProfiler():
+    def start(self):
+        pass
+
+    def step(self):
+        pass
+
+    def stop(self):
+        pass
+
+def profiler_schedule_done(profile_config, steps):
+    """
+    True if the profiler of build_profiler is disabled or, after steps calls to step(), every capture
+    window of its schedule has been recorded (repeat 0 -> never). Only then another profiler (e.g. the
+    validation one) can be started on the same thread, torch.profiler sessions cannot be nested
+    """
+    if not profile_config or not profile_config.get("enabled", False):
+        return True
+    repeat = profile_config.get("repeat", 1)
+    if not repeat:
+        return False
+    cycle = profile_config.get("wait", 10) + profile_config.get("warmup", 2) + profile_config.get("active", 5)
+    return steps >= cycle * repeat
+
+def build_profiler(profile_config, output_dir, name="train"):
+    """
+    Build a torch.profiler.profile with a wait/warmup/active schedule from the config, e.g.
+
+        profile:
+            enabled: True
+            wait: 10
+            warmup: 2
+            active: 5
+            repeat: 1
+            record_shapes: True
+            profile_memory: True
+            with_stack: False
+
+    Every active window is exported as a Chrome trace (output_dir/<name>_step_<n>.json) and as
+    TensorBoard profiler data (output_dir/tensorboard). Call start() before the loop, step() after every
+    iteration and stop() at the end. If the profiler is not enabled, a no-op object is returned.
+    """
+    if not profile_config or not profile_config.get("enabled", False):
+        return _NullProfiler()
+
+    import os
+    import torch.profiler
+
+    os.makedirs(output_dir, exist_ok=True)
+    tensorboard_handler = torch.profiler.tensorboard_trace_handler(os.path.join(output_dir, "tensorboard"),
+                                                                   worker_name=name)
+
+    def on_trace_ready(prof):
+        tensorboard_handler(prof)
+        prof.export_chrome_trace(os.path.join(output_dir, "{}_step_{}.json".format(name, prof.step_num)))
+
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+    return torch.profiler.profile(
+        activities=activities,
+        schedule=torch.profiler.schedule(
+            wait=profile_config.get("wait", 10),
+            warmup=profile_config.get("warmup", 2),
+            active=profile_config.get("active", 5),
+            repeat=profile_config.get("repeat", 1)
+        ),
+        on_trace_ready=on_trace_ready,
+        record_shapes=profile_config.get("record_shapes", False),
+        profile_memory=profile_config.get("profile_memory", False),
+        with_stack=profile_config.get("with_stack", False)
+    )
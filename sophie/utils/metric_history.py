@@ -0,0 +1,185 @@
+import os
+import numpy as np
+import torch
+
+from collections import defaultdict
+
+# One append-only file per series (e.g. "G_losses/G_total_loss", "metrics_val/ade", "norm_g") with
+# fixed-size (t, value) records, so a series can be read without the trainer:
+#
+#     history = np.fromfile("save/.../<name>_history/metrics_val__ade.bin", dtype=RECORD_DTYPE)
+#     history["t"], history["value"]
+
+RECORD_DTYPE = np.dtype([("t", "<i8"), ("value", "<f8")])
+
+def series_filename(series):
+    return series.replace("/", "__") + ".bin"
+
+class MetricHistory():
+    """
+    Append-only, on-disk metric history. Replaces the ever-growing lists of Checkpoint.config_cp
+    (G_losses, D_losses, metrics_val, losses_ts, norm_g, norm_d...), so the checkpoints only store
+    state() -> {"path", "offsets"} and their size does not grow with the number of iterations.
+
+        history = MetricHistory(folder) # New run: the series of the folder are cleared
+        history.append("G_losses/G_total_loss", t, loss) # value: float or 0-dim tensor
+        checkpoint.config_cp["history"] = history.state() # Flush + pointer and offsets
+        history = MetricHistory.restore(checkpoint.config_cp["history"], folder) # Records up to the checkpoint
+
+    Values are buffered in memory (at most flush_every records per series) and written in blocks.
+    Tensors are converted to float at flush time, so append() does not synchronize with the GPU.
+    """
+    def __init__(self, folder, flush_every=1000, resume=False):
+        """
+        resume: keep the records of the folder (see restore()). Otherwise its series are removed, so
+                a new run does not inherit the records (and min()/max()) of a previous one
+        """
+        self.folder = folder
+        self.flush_every = flush_every
+        os.makedirs(folder, exist_ok=True)
+
+        self.buffers = defaultdict(list)
+        self.offsets = {} # series -> number of records on disk
+        self.best = {} # series -> (min, max) of the values seen so far
+        for filename in os.listdir(folder):
+            if not filename.endswith(".bin"):
+                continue
+            if not resume:
+                os.remove(os.path.join(folder, filename))
+                continue
+            series = filename[:-len(".bin")].replace("__", "/")
+            self.offsets[series] = os.path.getsize(os.path.join(folder, filename)) // RECORD_DTYPE.itemsize
+
+    def path(self, series):
+        return os.path.join(self.folder, series_filename(series))
+
+    def append(self, series, t, value):
+        buffer = self.buffers[series]
+        buffer.append((t, value))
+        if len(buffer) >= self.flush_every:
+            self._flush_series(series)
+
+    def flush(self):
+        for series in list(self.buffers.keys()):
+            self._flush_series(series)
+
+    def _flush_series(self, series):
+        buffer = self.buffers[series]
+        if len(buffer) == 0:
+            return
+        records = np.empty(len(buffer), dtype=RECORD_DTYPE)
+        records["t"] = [t for t, _ in buffer]
+        records["value"] = [float(value) for _, value in buffer]
+        with open(self.path(series), "ab") as f:
+            records.tofile(f)
+        self.offsets[series] = self.offsets.get(series, 0) + len(records)
+        if series in self.best: # Otherwise computed from the whole file on the first min()/max()
+            self._update_best(series, records["value"])
+        buffer.clear()
+
+    def _update_best(self, series, values):
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        lo, hi = values.min(), values.max()
+        if series in self.best:
+            lo, hi = min(lo, self.best[series][0]), max(hi, self.best[series][1])
+        self.best[series] = (float(lo), float(hi))
+
+    def read(self, series):
+        """
+        Output:
+            np.array (n,) with RECORD_DTYPE (fields "t" and "value"), including buffered records
+        """
+        self._flush_series(series)
+        if not os.path.isfile(self.path(series)):
+            return np.empty(0, dtype=RECORD_DTYPE)
+        return np.fromfile(self.path(series), dtype=RECORD_DTYPE, count=self.offsets.get(series, 0))
+
+    def min(self, series):
+        self._flush_series(series) # Includes the buffered records
+        if series not in self.best:
+            values = self.read(series)["value"]
+            self._update_best(series, values)
+        return self.best[series][0] if series in self.best else None
+
+    def max(self, series):
+        self.min(series)
+        return self.best[series][1] if series in self.best else None
+
+    def state(self):
+        """
+        Pointer and offsets to store in the checkpoints (constant size)
+        """
+        self.flush()
+        return {"path": os.path.abspath(self.folder), "offsets": dict(self.offsets)}
+
+    @classmethod
+    def restore(cls, state, folder, flush_every=1000):
+        """
+        History of the current run (folder) restored from the state of a checkpoint, consistent with the
+        restored counters (only the records up to the checkpoint offsets):
+            - Same folder (the run continues): the records written after the checkpoint are truncated
+            - Other folder (e.g. checkpoint_start_from of another experiment): the folder is cleared and
+              the records are copied from the folder of the checkpoint, which is never modified
+        """
+        if os.path.abspath(folder) != os.path.abspath(state["path"]):
+            history = cls(folder, flush_every=flush_every)
+            for series, offset in state["offsets"].items():
+                source = os.path.join(state["path"], series_filename(series))
+                if offset == 0 or not os.path.isfile(source):
+                    continue
+                records = np.fromfile(source, dtype=RECORD_DTYPE, count=offset)
+                with open(history.path(series), "wb") as f:
+                    records.tofile(f)
+                history.offsets[series] = len(records)
+            return history
+
+        history = cls(folder, flush_every=flush_every, resume=True)
+        for series in list(history.offsets.keys()):
+            offset = state["offsets"].get(series, 0)
+            if history.offsets[series] > offset:
+                with open(history.path(series), "r+b") as f:
+                    f.truncate(offset * RECORD_DTYPE.itemsize)
+                history.offsets[series] = offset
+        return history
+
+class StepMetrics():
+    """
+    On-device buffer of per-step scalars (losses, gradient norms). add() only keeps the detached
+    0-dim tensor, flush() stacks every series and copies all of them to the host at once (a single
+    synchronization with the GPU), e.g. every print_every iterations.
+
+        metrics = StepMetrics()
+        metrics.add("G_losses/G_total_loss", t, loss) # value: float or 0-dim tensor
+        records = metrics.flush() # series -> (t np.array (n,), value np.array (n,))
+    """
+    def __init__(self):
+        self.buffers = defaultdict(list)
+
+    def add(self, series, t, value):
+        if torch.is_tensor(value):
+            value = value.detach()
+        self.buffers[series].append((t, value))
+
+    def add_dict(self, prefix, t, values):
+        for k, v in values.items():
+            self.add(prefix + k, t, v)
+
+    def flush(self):
+        series = [name for name, buffer in self.buffers.items() if len(buffer) > 0]
+        if len(series) == 0:
+            return {}
+        values = [v for name in series for _, v in self.buffers[name]]
+        device = next((v.device for v in values if torch.is_tensor(v)), torch.device("cpu"))
+        values = torch.stack([v.reshape(()).to(device, torch.float64) if torch.is_tensor(v) else
+                              torch.tensor(float(v), dtype=torch.float64, device=device) for v in values])
+        values = values.cpu().numpy()
+
+        records, offset = {}, 0
+        for name in series:
+            buffer = self.buffers[name]
+            records[name] = (np.array([t for t, _ in buffer], dtype=np.int64), values[offset:offset+len(buffer)])
+            offset += len(buffer)
+            buffer.clear()
+        return records
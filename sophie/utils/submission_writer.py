@@ -0,0 +1,108 @@
+import os
+import numpy as np
+import h5py
+
+# Streaming version of argoverse.evaluation.competition_util.generate_forecasting_h5. The rows of the
+# "argoverse_forecasting" dataset have the same layout (seq_id, x, y, probability), num_modes x pred_len
+# consecutive rows per sequence, but they are appended (and flushed) batch by batch:
+#
+#     writer = SubmissionWriter(results_path, num_modes=6, resume=True)
+#     writer.append(seq_ids, trajectories, probabilities) # (B,), (B,K,30,2), (B,K) or None
+#     writer.close(expected_seq_ids) # Sequences never written are filled with zeros
+
+DATASET_NAME = "argoverse_forecasting"
+
+class SubmissionWriter():
+    """
+    Chunked HDF5 submission file. The memory does not grow with the split and the file is flushed after
+    every batch: with resume=True it is reopened, truncated to its last complete sequence and the written
+    sequence ids are skipped (see done()). NB: a plain (non-SWMR) HDF5 file is not crash-safe, a crash
+    during a write can leave it unreadable (then it must be regenerated without resume)
+    """
+    def __init__(self, output_path, filename="argoverse_forecasting_baseline", num_modes=6, pred_len=30,
+                 resume=False, chunk_sequences=256, compression="gzip", compression_opts=4):
+        self.path = os.path.join(output_path, filename + ".h5")
+        self.num_modes = num_modes
+        self.pred_len = pred_len
+        self.rows_per_seq = num_modes * pred_len
+        self.written = set()
+
+        if resume and os.path.isfile(self.path):
+            self.file = h5py.File(self.path, "a")
+            dataset = self.file[DATASET_NAME]
+            assert dataset.attrs["num_modes"] == num_modes and dataset.attrs["pred_len"] == pred_len, \
+                   "{} was written with a different number of modes or prediction length".format(self.path)
+            num_seqs = dataset.shape[0] // self.rows_per_seq # Drop an incomplete sequence
+            dataset.resize((num_seqs * self.rows_per_seq, 4))
+            seq_ids = dataset[::self.rows_per_seq, 0] if num_seqs > 0 else np.zeros(0)
+            self.written = set(int(seq_id) for seq_id in seq_ids)
+            print("Resuming {} ({} sequences)".format(self.path, len(self.written)))
+        else:
+            self.file = h5py.File(self.path, "w")
+            dataset = self.file.create_dataset(DATASET_NAME, shape=(0, 4), maxshape=(None, 4), dtype=np.float64,
+                                               chunks=(chunk_sequences * self.rows_per_seq, 4),
+                                               compression=compression, compression_opts=compression_opts)
+            dataset.attrs["num_modes"] = num_modes
+            dataset.attrs["pred_len"] = pred_len
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.written)
+
+    def done(self, seq_id):
+        return int(seq_id) in self.written
+
+    def append(self, seq_ids, trajectories, probabilities=None):
+        """
+        Input:
+            seq_ids: (B,) ids of the sequences (csv file names)
+            trajectories: np.array or torch.tensor (B,K,pred_len,2) (map coordinates)
+            probabilities: (B,K) or None (uniform)
+        """
+        if hasattr(trajectories, "detach"):
+            trajectories = trajectories.detach().cpu().numpy()
+        if probabilities is not None and hasattr(probabilities, "detach"):
+            probabilities = probabilities.detach().cpu().numpy()
+        seq_ids = np.asarray(seq_ids, dtype=np.int64).reshape(-1)
+        trajectories = np.asarray(trajectories, dtype=np.float64)
+        b, k, t, _ = trajectories.shape
+        assert k == self.num_modes and t == self.pred_len, \
+               "Expected (B,{},{},2) predictions, got {}".format(self.num_modes, self.pred_len, trajectories.shape)
+        if probabilities is None:
+            probabilities = np.full((b, k), 1.0 / k)
+
+        # First occurrence of every sequence that is not in the file yet
+        _, first = np.unique(seq_ids, return_index=True)
+        keep = np.zeros(b, dtype=bool)
+        keep[first] = True
+        keep &= np.array([int(seq_id) not in self.written for seq_id in seq_ids], dtype=bool)
+        if not keep.any():
+            return
+
+        seq_ids, trajectories = seq_ids[keep], trajectories[keep]
+        probabilities = np.asarray(probabilities, dtype=np.float64).reshape(b, k)[keep]
+        n = len(seq_ids)
+
+        rows = np.empty((n, k, t, 4), dtype=np.float64)
+        rows[..., 0] = seq_ids[:, None, None]
+        rows[..., 1:3] = trajectories
+        rows[..., 3] = probabilities[:, :, None]
+
+        start = self.dataset.shape[0]
+        self.dataset.resize((start + n * self.rows_per_seq, 4))
+        self.dataset[start:] = rows.reshape(-1, 4)
+        self.file.flush()
+        self.written.update(int(seq_id) for seq_id in seq_ids)
+
+    def close(self, expected_seq_ids=None):
+        """
+        Fill the expected sequences that were not written (zeros, uniform probabilities) and close the file
+        """
+        if expected_seq_ids is not None:
+            missing = np.array(sorted(set(int(seq_id) for seq_id in expected_seq_ids) - self.written), dtype=np.int64)
+            if len(missing) > 0:
+                print("No processed files: {}".format(len(missing)))
+                for i in range(0, len(missing), 1024):
+                    chunk = missing[i:i+1024]
+                    self.append(chunk, np.zeros((len(chunk), self.num_modes, self.pred_len, 2)))
+        self.file.close()
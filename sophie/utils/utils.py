@@ -1,9 +1,24 @@
 import torch
 import copy
+import importlib
 import pdb
 import numpy as np
 import torch.nn as nn
 
+class LazyModule():
+    """
+    Module imported on first attribute access, e.g. plt = LazyModule("matplotlib.pyplot"), so heavy
+    libraries (plotting, maps) are only loaded by the code paths that use them
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
 def relative_to_abs_sgan(rel_traj, start_pos):
     """
     Inputs: